@@ -362,6 +362,7 @@ def upload(request, id):
             "redirect_urls": upload_obj.redirect_urls or [],
             "completed_at": upload_obj.completed_at,
             "created_at": upload_obj.created_at,
+            "timings": upload_obj.timings,
             "file_uploads": file_uploads,
         }
 
@@ -2,6 +2,7 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import os
 import time
 from urllib.parse import urlparse, urlunparse
 
@@ -9,6 +10,7 @@ from dockerflow.version import get_version as dockerflow_get_version
 from django_redis import get_redis_connection
 
 from django import get_version
+from django import http
 from django.conf import settings
 from django.contrib import admin
 from django.contrib.admin.models import LogEntry, ADDITION, CHANGE, DELETION
@@ -22,6 +24,7 @@ from django.utils.html import format_html
 import redis.exceptions
 
 from tecken.base import symbolstorage
+from tecken.upload import executor
 
 
 ACTION_TO_NAME = {ADDITION: "add", CHANGE: "change", DELETION: "delete"}
@@ -193,3 +196,15 @@ def site_status(request):
     context["versions"].sort(key=lambda x: x["key"])
 
     return render(request, "admin/site_status.html", context)
+
+
+@login_required(login_url="/")
+@user_passes_test(lambda user: user.is_active and user.is_staff, login_url="/")
+def executor_status(request):
+    """Return the live state of the upload executor of the process serving this.
+
+    Every gunicorn worker has its own executor, so this shows the state of one of them,
+    identified by the process id.
+
+    """
+    return http.JsonResponse({"pid": os.getpid(), "executor": executor.state()})
@@ -10,4 +10,5 @@ from tecken.base import admin
 app_name = "siteadmin"
 urlpatterns = [
     path("sitestatus/", admin.site_status, name="site_status"),
+    path("executorstatus/", admin.executor_status, name="executor_status"),
 ]
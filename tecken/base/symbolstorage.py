@@ -2,19 +2,76 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from concurrent.futures import ThreadPoolExecutor
 import logging
+import os
+import threading
 from typing import Optional
 
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 
 from tecken.libmarkus import METRICS
-from tecken.libstorage import ObjectMetadata, StorageBackend, backend_from_config
+from tecken.librequests import default_pool_maxsize
+from tecken.libstorage import (
+    ObjectMetadata,
+    StorageBackend,
+    StorageError,
+    backend_from_config,
+)
 
 
 logger = logging.getLogger("tecken")
 
 
+def _known_key_cache_key(backend: StorageBackend, key: str) -> str:
+    return f"download_known_key::{backend.bucket}/{backend.prefix}/{key}"
+
+
+def remember_key(backend: StorageBackend, key: str):
+    """Record that the symbols file exists in the given backend.
+
+    This is only done if DOWNLOAD_OPTIMISTIC_REDIRECT is enabled, and allows redirecting
+    downloads of the file without looking it up in storage.
+    """
+    if settings.DOWNLOAD_OPTIMISTIC_REDIRECT:
+        cache.set(
+            _known_key_cache_key(backend, key),
+            True,
+            settings.DOWNLOAD_KNOWN_KEYS_TIMEOUT,
+        )
+
+
+# Thread pool for looking up a file in several backends at the same time
+_LOOKUP_EXECUTOR: Optional[ThreadPoolExecutor] = None
+_LOOKUP_EXECUTOR_LOCK = threading.Lock()
+
+
+def _reset_lookup_executor():
+    """Forget the lookup thread pool.
+
+    This is called in child processes after a fork, since the threads of the parent's
+    pool don't exist in the child.
+    """
+    global _LOOKUP_EXECUTOR, _LOOKUP_EXECUTOR_LOCK
+    _LOOKUP_EXECUTOR = None
+    _LOOKUP_EXECUTOR_LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_lookup_executor)
+
+
+def _lookup_executor() -> ThreadPoolExecutor:
+    global _LOOKUP_EXECUTOR
+    with _LOOKUP_EXECUTOR_LOCK:
+        if _LOOKUP_EXECUTOR is None:
+            _LOOKUP_EXECUTOR = ThreadPoolExecutor(
+                max_workers=default_pool_maxsize(), thread_name_prefix="storage-lookup"
+            )
+        return _LOOKUP_EXECUTOR
+
+
 class SymbolStorage:
     """Persistent wrapper around multiple StorageBackend instances.
 
@@ -44,6 +101,17 @@ class SymbolStorage:
         backend_reprs = " ".join(map(repr, self.backends))
         return f"<{self.__class__.__name__} backends: {backend_reprs}>"
 
+    def warm_up(self):
+        """Set up the clients of all backends, so the first requests don't have to.
+
+        Failures are logged, and the clients are created on first use instead.
+        """
+        for backend in self.backends:
+            try:
+                backend.warm_up()
+            except StorageError:
+                logger.warning(f"Warming up {backend!r} failed", exc_info=True)
+
     def get_download_backends(self, try_storage: bool) -> list[StorageBackend]:
         """Return a list of all download backends.
 
@@ -59,6 +127,26 @@ class SymbolStorage:
             return self.try_upload_backend
         return self.upload_backend
 
+    def get_known_download_url(
+        self, key: str, try_storage: bool = False
+    ) -> Optional[str]:
+        """Return the download URL of the symbols file if it's known to exist.
+
+        This doesn't look up the file in storage. It only returns a URL if the first
+        download backend has a public URL and the file was recently uploaded to or found in
+        it. Since the first backend that has the file wins, that's the URL get_metadata()
+        would return, too. Returns None if unsure.
+        """
+        backend = self.get_download_backends(try_storage)[0]
+        url = backend.get_public_download_url(key)
+        if url is None:
+            return None
+        if cache.get(_known_key_cache_key(backend, key)):
+            METRICS.incr("download_optimistic_redirect", tags=["result:hit"])
+            return url
+        METRICS.incr("download_optimistic_redirect", tags=["result:miss"])
+        return None
+
     def get_metadata(
         self, key: str, try_storage: bool = False
     ) -> Optional[ObjectMetadata]:
@@ -67,6 +155,7 @@ class SymbolStorage:
             with METRICS.timer("symboldownloader_exists"):
                 metadata = backend.get_object_metadata(key)
             if metadata:
+                remember_key(backend, key)
                 if metadata.last_modified:
                     age_days = (timezone.now() - metadata.last_modified).days
                     if backend.try_symbols:
@@ -76,6 +165,30 @@ class SymbolStorage:
                     METRICS.histogram("symboldownloader.file_age_days", age_days, tags)
                 return metadata
 
+    def get_all_metadata(
+        self, key: str, try_storage: bool = False
+    ) -> list[tuple[StorageBackend, ObjectMetadata]]:
+        """Return the metadata of the symbols file in every download backend that has it.
+
+        Unlike get_metadata(), this doesn't stop at the first backend that has the file.
+        The backends are looked up in parallel, and the results are in the order of the
+        backends.
+        """
+        backends = self.get_download_backends(try_storage)
+        if len(backends) == 1:
+            results = [backends[0].get_object_metadata(key)]
+        else:
+            results = list(
+                _lookup_executor().map(
+                    lambda backend: backend.get_object_metadata(key), backends
+                )
+            )
+        return [
+            (backend, metadata)
+            for backend, metadata in zip(backends, results, strict=True)
+            if metadata
+        ]
+
 
 # Global SymbolStorage instance, eventually used for all interactions with storage backends.
 SYMBOL_STORAGE: Optional[SymbolStorage] = None
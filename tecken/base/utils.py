@@ -4,6 +4,7 @@
 
 import re
 
+from django.conf import settings
 from django.template.defaultfilters import filesizeformat as dj_filesizeformat
 
 
@@ -15,6 +16,21 @@ def filesizeformat(bytes):
     return dj_filesizeformat(bytes).replace("\xa0", " ")
 
 
+def allowed_host() -> str:
+    """Return a host name this site accepts requests for.
+
+    The Django test client sends requests for "testserver", which is only allowed while
+    running the tests. Management commands that send requests to the views in-process
+    use this host instead.
+    """
+    for host in settings.ALLOWED_HOSTS:
+        if host != "*":
+            # ".example.com" matches example.com and all of its subdomains.
+            return host.removeprefix(".")
+    # Django accepts localhost if ALLOWED_HOSTS is empty and DEBUG is set.
+    return "localhost"
+
+
 # Characters valid in the first and last part of a symbols file key. The allowed
 # characters were originally based on what's valid in AWS S3 object keys:
 #
@@ -0,0 +1,247 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.utils import timezone
+
+from tecken.base.symbolstorage import symbol_storage
+from tecken.base.utils import allowed_host
+from tecken.librequests import pooled_session
+from tecken.libstorage import ObjectMetadata
+from tecken.upload.models import FileUpload
+
+
+# Outcomes of the download requests in the workload, their share of the workload, and
+# the status code each is expected to respond with.
+WORKLOAD = {
+    "hit": (60, 302),
+    "miss": (15, 404),
+    "code_id": (15, 302),
+    "try_hit": (5, 302),
+    "try_miss": (5, 404),
+}
+
+
+def benchmark_file(index):
+    """Return (debug file, debug id, code file, code id, sym file) of a benchmark file."""
+    debug_id = f"{index:032X}1"
+    code_id = f"{index:X}1000"
+    return (
+        f"benchmark{index}.pdb",
+        debug_id,
+        f"benchmark{index}.dll",
+        code_id,
+        f"benchmark{index}.sym",
+    )
+
+
+def set_up_files(count):
+    """Upload the benchmark sym files to storage and record them as uploaded.
+
+    The files are uploaded to the regular and the try upload backends. Only files
+    uploaded to the regular backend get fileupload records, so they can be downloaded
+    by code file and code id.
+
+    """
+    storage = symbol_storage()
+    backends = {
+        try_storage: storage.get_upload_backend(try_storage)
+        for try_storage in (False, True)
+    }
+    for index in range(count):
+        debug_file, debug_id, code_file, code_id, sym_file = benchmark_file(index)
+        key = f"{debug_file}/{debug_id}/{sym_file}"
+        body = (
+            f"MODULE windows x86_64 {debug_id} {debug_file}\n"
+            f"INFO CODE_ID {code_id} {code_file}\n"
+        ).encode("utf-8")
+        for backend in backends.values():
+            metadata = ObjectMetadata(
+                content_type="text/plain", content_length=len(body)
+            )
+            backend.upload(key, BytesIO(body), metadata)
+        FileUpload.objects.update_or_create(
+            bucket_name=backends[False].bucket,
+            key=key,
+            defaults={
+                "size": len(body),
+                "debug_filename": debug_file,
+                "debug_id": debug_id,
+                "code_file": code_file,
+                "code_id": code_id,
+                "generator": "benchmark_download",
+                "created_at": timezone.now(),
+            },
+        )
+
+
+def build_workload(files, requests, seed):
+    """Return a shuffled list of (outcome, url path) of the given length."""
+    rng = random.Random(seed)
+    outcomes = list(WORKLOAD)
+    weights = [WORKLOAD[outcome][0] for outcome in outcomes]
+    workload = []
+    for outcome in rng.choices(outcomes, weights=weights, k=requests):
+        debug_file, debug_id, code_file, code_id, sym_file = benchmark_file(
+            rng.randrange(files)
+        )
+        if outcome == "hit":
+            path = f"/{debug_file}/{debug_id}/{sym_file}"
+        elif outcome == "miss":
+            path = f"/{debug_file}/{rng.getrandbits(128):032X}F/{sym_file}"
+        elif outcome == "code_id":
+            path = f"/{code_file}/{code_id}/{sym_file}"
+        elif outcome == "try_hit":
+            path = f"/try/{debug_file}/{debug_id}/{sym_file}"
+        else:
+            path = f"/try/{debug_file}/{rng.getrandbits(128):032X}F/{sym_file}"
+        workload.append((outcome, path))
+    return workload
+
+
+def percentile(durations, percent):
+    """Return the given percentile of a list of durations."""
+    if len(durations) < 2:
+        return durations[0]
+    return statistics.quantiles(durations, n=100, method="inclusive")[percent - 1]
+
+
+class Command(BaseCommand):
+    """Benchmark downloading symbols files with a mixed workload.
+
+    This uploads a set of small sym files to the regular and try upload backends, then
+    replays a shuffled mix of downloads that hit, miss, and fall back to looking up the
+    code file and code id, and reports throughput and latency percentiles for each
+    outcome.
+
+    Requests are sent to the download views in-process, unless a base URL of a running
+    Tecken instance is passed. This is meant to be run in the local development
+    environment against the GCS emulator, Postgres, and Redis, to compare the download
+    path before and after a change.
+
+    """
+
+    help = "Benchmark downloading symbols files with a mixed workload."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--files",
+            type=int,
+            default=100,
+            help="Number of sym files to upload for the benchmark.",
+        )
+        parser.add_argument(
+            "--requests",
+            type=int,
+            default=2000,
+            help="Number of download requests to send.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=1,
+            help="Number of download requests to send concurrently.",
+        )
+        parser.add_argument(
+            "--base-url",
+            default=None,
+            help="URL of a running Tecken instance to send the requests to.",
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed for generating the workload, so runs can be compared.",
+        )
+        parser.add_argument(
+            "--skip-setup",
+            action="store_true",
+            help="Don't upload the sym files because a previous run did.",
+        )
+
+    def send_requests(self, workload, base_url, concurrency):
+        """Send the requests in the workload and return {outcome: [(status, ms)]}."""
+        if base_url:
+            session = pooled_session()
+
+            def get(path):
+                return session.get(
+                    base_url.rstrip("/") + path, allow_redirects=False
+                ).status_code
+
+        else:
+            client = Client(HTTP_HOST=allowed_host())
+
+            def get(path):
+                return client.get(path).status_code
+
+        def send(item):
+            outcome, path = item
+            start = time.perf_counter()
+            status_code = get(path)
+            return outcome, status_code, (time.perf_counter() - start) * 1000
+
+        def send_in_thread(item):
+            try:
+                return send(item)
+            finally:
+                connection.close()
+
+        results = defaultdict(list)
+        if concurrency > 1:
+            with ThreadPoolExecutor(max_workers=concurrency) as pool:
+                sent = list(pool.map(send_in_thread, workload))
+        else:
+            sent = [send(item) for item in workload]
+        for outcome, status_code, duration in sent:
+            results[outcome].append((status_code, duration))
+        return results
+
+    def handle(self, *args, **options):
+        files = options["files"]
+        if files < 1 or options["requests"] < 1:
+            raise CommandError("--files and --requests have to be at least 1")
+
+        if not options["skip_setup"]:
+            set_up_files(files)
+        workload = build_workload(files, options["requests"], options["seed"])
+
+        self.stdout.write(
+            f"benchmark_download: {len(workload)} requests, {files} files, "
+            f"concurrency {options['concurrency']}"
+        )
+        start = time.perf_counter()
+        results = self.send_requests(
+            workload, options["base_url"], options["concurrency"]
+        )
+        wall_time = time.perf_counter() - start
+
+        for outcome in WORKLOAD:
+            if outcome not in results:
+                continue
+            expected_status = WORKLOAD[outcome][1]
+            durations = [duration for _, duration in results[outcome]]
+            errors = sum(
+                status_code != expected_status for status_code, _ in results[outcome]
+            )
+            self.stdout.write(
+                f">>> {outcome}: requests={len(durations)} errors={errors} "
+                f"throughput={len(durations) / wall_time:.1f}/s "
+                f"p50={percentile(durations, 50):.2f}ms "
+                f"p95={percentile(durations, 95):.2f}ms "
+                f"p99={percentile(durations, 99):.2f}ms"
+            )
+        self.stdout.write(
+            f">>> total: requests={len(workload)} "
+            f"throughput={len(workload) / wall_time:.1f}/s"
+        )
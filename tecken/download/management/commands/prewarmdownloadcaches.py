@@ -0,0 +1,95 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from tecken.base.symbolstorage import symbol_storage
+from tecken.download.views import prewarm_syminfo_cache
+from tecken.libmarkus import METRICS
+from tecken.libstorage import StorageError
+from tecken.upload.models import FileUpload
+
+
+def lookup_metadata(key_and_try):
+    """Return whether the symbols file exists in storage.
+
+    Looking up the file records it as known to exist if DOWNLOAD_OPTIMISTIC_REDIRECT is
+    enabled.
+    """
+    # This function is run in a thread and should not access the database.
+    key, try_storage = key_and_try
+    try:
+        return symbol_storage().get_metadata(key, try_storage=try_storage) is not None
+    except StorageError:
+        return False
+
+
+class Command(BaseCommand):
+    """Pre-warm the download caches for the most recently uploaded sym files.
+
+    This looks up the sym files of the most recent fileupload records in storage, which
+    records them as known to exist for optimistic redirects, and stores the syminfo
+    lookup results for their code files and code ids in the cache. Run this after a
+    release build uploaded its symbols, so the first wave of crash reports is served
+    from the cache.
+
+    """
+
+    help = "Pre-warm the download caches for recently uploaded sym files."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=1000,
+            help="Number of most recently uploaded sym files to pre-warm caches for.",
+        )
+        parser.add_argument(
+            "--days",
+            type=int,
+            default=7,
+            help="Only consider sym files uploaded in this many days.",
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=20,
+            help="Number of sym files to look up in storage concurrently.",
+        )
+
+    @METRICS.timer_decorator("prewarmdownloadcaches.timing")
+    def handle(self, *args, **options):
+        self.stdout.write("prewarmdownloadcaches:")
+
+        cutoff = timezone.now() - datetime.timedelta(days=options["days"])
+        file_uploads = list(
+            FileUpload.objects.filter(created_at__gte=cutoff, key__iendswith=".sym")
+            .select_related("upload")
+            .order_by("-created_at")[: options["limit"]]
+        )
+        # The most recent upload has to come last to win in the syminfo cache.
+        file_uploads.reverse()
+
+        keys = list(
+            dict.fromkeys(
+                (
+                    file_upload.key,
+                    file_upload.upload is not None and file_upload.upload.try_symbols,
+                )
+                for file_upload in file_uploads
+            )
+        )
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            found = sum(pool.map(lookup_metadata, keys))
+        syminfo = prewarm_syminfo_cache(file_uploads)
+
+        METRICS.incr("prewarmdownloadcaches.found", found)
+        self.stdout.write(
+            f">>> keys={len(keys)}, found={found}, missing={len(keys) - found}, "
+            f"syminfo={syminfo}"
+        )
@@ -2,13 +2,19 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import hashlib
 import logging
+import threading
+import time
 
 
 from django import http
 from django.conf import settings
 from django.core.cache import cache
+from django.db import connection
 from django.urls import reverse
+from django.utils.cache import patch_cache_control
+from django.utils.http import parse_etags, quote_etag
 
 from tecken.base.decorators import (
     set_request_debug,
@@ -17,6 +23,7 @@ from tecken.base.decorators import (
 )
 from tecken.base.symbolstorage import symbol_storage
 from tecken.libtiming import measure_time
+from tecken.upload import executor
 from tecken.upload.models import FileUpload
 from tecken.libmarkus import METRICS
 
@@ -43,18 +50,292 @@ def _ignore_symbol(debug_file, debug_id, symbols_file):
     return False
 
 
-# Store a result for 10 minutes
-SYMINFO_RESULT_CACHE_TIMEOUT = 600
+def _set_cache_headers(response, key, try_storage, found):
+    """Set the headers allowing caches in front of Tecken to store the response.
+
+    The max-age depends on whether the symbols file was found and whether try storage
+    was used. Responses with debug information are never cached.
+
+    :arg response: the response
+    :arg key: the key of the symbols file
+    :arg try_storage: whether try storage was included in the lookup
+    :arg found: whether the symbols file was found
+
+    """
+    if try_storage:
+        max_age = (
+            settings.DOWNLOAD_TRY_HIT_CACHE_MAX_AGE
+            if found
+            else settings.DOWNLOAD_TRY_MISS_CACHE_MAX_AGE
+        )
+    else:
+        max_age = (
+            settings.DOWNLOAD_HIT_CACHE_MAX_AGE
+            if found
+            else settings.DOWNLOAD_MISS_CACHE_MAX_AGE
+        )
+    if max_age:
+        patch_cache_control(response, public=True, max_age=max_age)
+    else:
+        patch_cache_control(response, no_cache=True)
+    if settings.DOWNLOAD_SURROGATE_KEYS:
+        # This allows purging the responses for a key from the CDN, e.g. after an
+        # upload.
+        response["Surrogate-Key"] = key
+
+
+def _not_modified_if_matching(request, response):
+    """Return a 304 Not Modified response if the request has a matching If-None-Match.
+
+    Django's get_conditional_response() only handles 2xx responses, but it's the redirect
+    itself that clients and caches revalidate here.
+
+    """
+    etags = parse_etags(request.headers.get("If-None-Match", ""))
+    if "*" not in etags and response["ETag"] not in etags:
+        return response
+    not_modified = http.HttpResponseNotModified()
+    for header in ("Cache-Control", "ETag", "Surrogate-Key"):
+        if header in response:
+            not_modified[header] = response[header]
+    return not_modified
+
+
+class _Flight:
+    """A lookup in flight that other requests for the same key can wait for."""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.failed = False
+
+
+# Lookups in flight in this process by key
+_FLIGHTS = {}
+_FLIGHTS_LOCK = threading.Lock()
+
+# Seconds between the first checks for the result of a lookup in flight in another
+# process. The interval doubles after every check, up to the maximum.
+_SHARED_FLIGHT_POLL_INTERVAL = 0.01
+_SHARED_FLIGHT_MAX_POLL_INTERVAL = 0.25
+
+
+def _call_shared(key, fn, *args, **kwargs):
+    """Call fn unless another process is already calling it for the same key.
+
+    A cache entry is used as a lock across processes. The process holding it stores the
+    result in the cache for the others, which poll for it with a growing interval. If
+    the call fails, it stores a failure marker instead, and the others call fn
+    themselves right away. They also do that if the result takes longer than
+    DOWNLOAD_SINGLE_FLIGHT_TIMEOUT. The result must be serializable by the cache.
+
+    """
+    timeout = settings.DOWNLOAD_SINGLE_FLIGHT_TIMEOUT
+    lock_key = f"single_flight_lock::{key}"
+    result_key = f"single_flight_result::{key}"
+    # Note: add() returns None instead of False if the cache is unavailable, in which
+    # case there is no way to coordinate with other processes.
+    if cache.add(lock_key, True, timeout) is not False:
+        try:
+            result = fn(*args, **kwargs)
+        except BaseException:
+            # An empty list tells the others that the call failed.
+            cache.set(result_key, [], timeout)
+            raise
+        else:
+            # The result is wrapped in a list to tell a None result from a cache miss.
+            cache.set(result_key, [result], timeout)
+            return result
+        finally:
+            cache.delete(lock_key)
+
+    deadline = time.monotonic() + timeout
+    interval = _SHARED_FLIGHT_POLL_INTERVAL
+    while True:
+        wrapped_result = cache.get(result_key)
+        if wrapped_result:
+            METRICS.incr("download_single_flight", tags=["result:shared"])
+            return wrapped_result[0]
+        if wrapped_result is not None:
+            METRICS.incr("download_single_flight", tags=["result:failed"])
+            return fn(*args, **kwargs)
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(interval, remaining))
+        interval = min(interval * 2, _SHARED_FLIGHT_MAX_POLL_INTERVAL)
+    METRICS.incr("download_single_flight", tags=["result:timeout"])
+    return fn(*args, **kwargs)
+
+
+def single_flight(key, fn, *args, **kwargs):
+    """Call fn(*args, **kwargs) and return its result, sharing it between concurrent
+    calls with the same key.
+
+    When a new build crashes en masse, many requests for the same new symbols file
+    arrive at once. Only one lookup per key is in flight in this process, and the
+    others wait for its result. That only helps processes serving several requests at
+    once. With DOWNLOAD_SINGLE_FLIGHT_SHARED, lookups are also coordinated across
+    processes using the cache.
+
+    If the call in flight fails, or takes longer than DOWNLOAD_SINGLE_FLIGHT_TIMEOUT,
+    the waiting callers call fn themselves.
+
+    """
+    if not settings.DOWNLOAD_SINGLE_FLIGHT:
+        return fn(*args, **kwargs)
+
+    with _FLIGHTS_LOCK:
+        flight = _FLIGHTS.get(key)
+        is_leader = flight is None
+        if is_leader:
+            flight = _FLIGHTS[key] = _Flight()
+
+    if not is_leader:
+        if not flight.done.wait(settings.DOWNLOAD_SINGLE_FLIGHT_TIMEOUT):
+            METRICS.incr("download_single_flight", tags=["result:timeout"])
+        elif flight.failed:
+            METRICS.incr("download_single_flight", tags=["result:failed"])
+        else:
+            METRICS.incr("download_single_flight", tags=["result:shared"])
+            return flight.result
+        return fn(*args, **kwargs)
+
+    try:
+        if settings.DOWNLOAD_SINGLE_FLIGHT_SHARED:
+            flight.result = _call_shared(key, fn, *args, **kwargs)
+        else:
+            flight.result = fn(*args, **kwargs)
+    except BaseException:
+        flight.failed = True
+        raise
+    finally:
+        with _FLIGHTS_LOCK:
+            del _FLIGHTS[key]
+        flight.done.set()
+    return flight.result
+
+
+def _lookup_download_url(key, try_storage):
+    """Return the download URL of the symbols file, or None if it doesn't exist."""
+    metadata = symbol_storage().get_metadata(key, try_storage=try_storage)
+    if metadata:
+        return metadata.download_url
+    return None
+
 
 # Indicates there's nothing in the cache
 NO_VALUE_IN_CACHE = object()
 
 
+def _syminfo_cache_key(somefile, someid):
+    return f"lookup_by_syminfo::{somefile}//{someid}"
+
+
+def _syminfo_cache_entry(data):
+    """Return the cache entry for a syminfo lookup result and its timeout.
+
+    The entry records until when the result is fresh. After that, it's still served
+    until the timeout, but refreshed in the background. Results for files that weren't
+    found have separate, shorter timeouts.
+
+    """
+    if data is None:
+        fresh_timeout = settings.SYMINFO_NEGATIVE_CACHE_FRESH_TIMEOUT
+        timeout = settings.SYMINFO_NEGATIVE_CACHE_TIMEOUT
+    else:
+        fresh_timeout = settings.SYMINFO_CACHE_FRESH_TIMEOUT
+        timeout = settings.SYMINFO_CACHE_TIMEOUT
+    entry = {"data": data, "fresh_until": time.time() + fresh_timeout}
+    return entry, max(timeout, fresh_timeout)
+
+
+def prewarm_syminfo_cache(file_uploads):
+    """Store the syminfo lookup results for the given files in the cache.
+
+    This is done for just-uploaded files, so downloads by code file and code id are
+    served from the cache from the first request. The most recently uploaded file wins,
+    like in cached_lookup_by_syminfo().
+
+    :arg file_uploads: FileUpload instances in the order they were uploaded
+
+    """
+    entries = {}
+    for file_upload in file_uploads:
+        if not (file_upload.code_file and file_upload.code_id):
+            continue
+        try_symbols = file_upload.upload is not None and file_upload.upload.try_symbols
+        key = _syminfo_cache_key(file_upload.code_file, file_upload.code_id)
+        entries[key] = {
+            "debug_filename": file_upload.debug_filename,
+            "debug_id": file_upload.debug_id,
+            "code_file": file_upload.code_file,
+            "code_id": file_upload.code_id,
+            "generator": file_upload.generator,
+            "upload__try_symbols": try_symbols,
+        }
+    for key, data in entries.items():
+        entry, timeout = _syminfo_cache_entry(data)
+        cache.set(key, entry, timeout)
+    return len(entries)
+
+
+def evict_syminfo_cache(file_uploads):
+    """Remove the cached syminfo lookup results for the given files.
+
+    This is done for just-uploaded files, so a code id that was looked up before it was
+    uploaded doesn't stay "not found" until the cached result expires.
+
+    :arg file_uploads: FileUpload instances
+
+    """
+    keys = {
+        _syminfo_cache_key(file_upload.code_file, file_upload.code_id)
+        for file_upload in file_uploads
+        if file_upload.code_file and file_upload.code_id
+    }
+    if keys:
+        cache.delete_many(keys)
+
+
+def _lookup_by_syminfo(somefile, someid):
+    qs = FileUpload.objects.lookup_by_syminfo(some_file=somefile, some_id=someid)
+    return qs.values(
+        "debug_filename",
+        "debug_id",
+        "code_file",
+        "code_id",
+        "generator",
+        "upload__try_symbols",
+    ).last()
+
+
+def _refresh_syminfo_cache(key, somefile, someid):
+    """Look up somefile/someid in fileupload data and store the result in the cache."""
+    data = single_flight(key, _lookup_by_syminfo, somefile, someid)
+    entry, timeout = _syminfo_cache_entry(data)
+    cache.set(key, entry, timeout)
+    return data
+
+
+def _refresh_syminfo_cache_in_background(key, somefile, someid):
+    try:
+        _refresh_syminfo_cache(key, somefile, someid)
+    except Exception:
+        logger.exception(f"Error refreshing {key}")
+    finally:
+        # This runs in an executor thread, which would otherwise keep its database
+        # connection open.
+        if not connection.in_atomic_block:
+            connection.close()
+
+
 @METRICS.timer_decorator("syminfo.lookup.timing")
 def cached_lookup_by_syminfo(somefile, someid, refresh_cache=False):
     """Looks up somefile/someid in fileupload data; caches result
 
-    This value is cached.
+    This value is cached. Once a cached result is no longer fresh, it's still returned,
+    but refreshed in the background, so clients don't wait for the database.
 
     :arg somefile: a string that's either a debug_file or a code_file
     :arg someid: a string that's either a debug_id or a code_id
@@ -68,22 +349,23 @@ def cached_lookup_by_syminfo(somefile, someid, refresh_cache=False):
     try symbols as well.
 
     """
-    key = f"lookup_by_syminfo::{somefile}//{someid}"
-    data = cache.get(key, default=NO_VALUE_IN_CACHE)
-    if data is NO_VALUE_IN_CACHE or refresh_cache is True:
-        qs = FileUpload.objects.lookup_by_syminfo(some_file=somefile, some_id=someid)
-        data = qs.values(
-            "debug_filename",
-            "debug_id",
-            "code_file",
-            "code_id",
-            "generator",
-            "upload__try_symbols",
-        ).last()
-
-        cache.set(key, data, SYMINFO_RESULT_CACHE_TIMEOUT)
+    key = _syminfo_cache_key(somefile, someid)
+    entry = cache.get(key, default=NO_VALUE_IN_CACHE)
+    if not isinstance(entry, dict) or "fresh_until" not in entry:
+        # Entries cached before results had a freshness are looked up again.
+        entry = NO_VALUE_IN_CACHE
+    if entry is NO_VALUE_IN_CACHE or refresh_cache is True:
+        data = _refresh_syminfo_cache(key, somefile, someid)
         METRICS.incr("syminfo.lookup.cached", tags=["result:false"])
+    elif entry["fresh_until"] < time.time():
+        data = entry["data"]
+        # Only one process refreshes a stale result.
+        refresh_timeout = settings.DOWNLOAD_SINGLE_FLIGHT_TIMEOUT
+        if cache.add(f"{key}::refreshing", True, refresh_timeout):
+            executor.submit(_refresh_syminfo_cache_in_background, key, somefile, someid)
+        METRICS.incr("syminfo.lookup.cached", tags=["result:stale"])
     else:
+        data = entry["data"]
         METRICS.incr("syminfo.lookup.cached", tags=["result:true"])
 
     return data
@@ -130,16 +412,27 @@ def download_symbol(request, debug_file, debug_id, symbols_file, try_storage=Fal
         response = http.HttpResponseNotFound("Symbol Not Found (and ignored)")
         if request._request_debug:
             response["Debug-Time"] = 0
+        else:
+            _set_cache_headers(response, key, try_storage, found=False)
         return response
 
     try_storage |= "try" in request.GET
-    metadata, elapsed_time = measure_time(
-        symbol_storage().get_metadata,
-        key,
-        try_storage=try_storage,
-    )
-    if metadata:
-        url = metadata.download_url
+    url = None
+    elapsed_time = 0
+    if settings.DOWNLOAD_OPTIMISTIC_REDIRECT:
+        # Files known to exist are redirected to without asking storage. In the rare
+        # case the file was removed since, the client gets a 404 from the CDN.
+        url = symbol_storage().get_known_download_url(key, try_storage=try_storage)
+    if url is None:
+        # Concurrent requests for the same file share a single storage lookup.
+        url, elapsed_time = measure_time(
+            single_flight,
+            f"download_url::{try_storage}::{key}",
+            _lookup_download_url,
+            key,
+            try_storage,
+        )
+    if url:
         if request.get_host() == "localhost:8000":
             # If doing local development, with Docker, you're most likely running
             # an object storage emulator. It runs on its own hostname that is only
@@ -150,7 +443,12 @@ def download_symbol(request, debug_file, debug_id, symbols_file, try_storage=Fal
         response = http.HttpResponseRedirect(url)
         if request._request_debug:
             response["Debug-Time"] = elapsed_time
-        if request.method == "HEAD":
+        else:
+            _set_cache_headers(response, key, try_storage, found=True)
+            # The redirect only changes if the file is moved to a different backend.
+            response["ETag"] = quote_etag(hashlib.md5(url.encode()).hexdigest())
+            response = _not_modified_if_matching(request, response)
+        if request.method == "HEAD" and response.status_code == 302:
             # Tecken has the nonstandard convention of returning a 200 status code for successful
             # HEAD requests even if the corresponding GET request returns a 302.
             response.status_code = 200
@@ -175,9 +473,15 @@ def download_symbol(request, debug_file, debug_id, symbols_file, try_storage=Fal
             if request.GET:
                 new_url = f"{new_url}?{request.GET.urlencode()}"
             METRICS.incr("download_symbol_code_id_lookup")
-            return http.HttpResponseRedirect(new_url)
+            response = http.HttpResponseRedirect(new_url)
+            # The code id may be uploaded again with a different debug id, so this
+            # is only cached as long as a miss.
+            _set_cache_headers(response, key, try_storage, found=False)
+            return response
 
     response = http.HttpResponseNotFound("Symbol Not Found")
     if request._request_debug:
         response["Debug-Time"] = elapsed_time
+    else:
+        _set_cache_headers(response, key, try_storage, found=False)
     return response
@@ -3,21 +3,223 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import base64
+from collections.abc import Iterator
+from contextlib import contextmanager, nullcontext
+from datetime import datetime
 from io import BufferedReader
+import os
+import queue
 import threading
 from typing import Optional
-from urllib.parse import quote
+from urllib.parse import quote, urlparse
 
 from django.conf import settings
 from google.api_core.client_options import ClientOptions
-from google.api_core.exceptions import ClientError
+from google.api_core.exceptions import (
+    ClientError,
+    from_http_response,
+    NotFound,
+    PreconditionFailed,
+    RequestRangeNotSatisfiable,
+    ServiceUnavailable,
+    TooManyRequests,
+)
+import google.auth
+from google.auth.credentials import AnonymousCredentials
+from google.auth.exceptions import GoogleAuthError
+from google.auth.transport.requests import AuthorizedSession
 from google.cloud import storage
+from requests.adapters import HTTPAdapter, Retry
 from requests.exceptions import RequestException
 
-from tecken.librequests import session_with_retries
+from tecken.libconcurrency import AIMDLimiter
+from tecken.libmarkus import METRICS
+from tecken.librequests import (
+    default_pool_maxsize,
+    pooled_session,
+    PooledHTTPAdapter,
+)
 from tecken.libstorage import ObjectMetadata, StorageBackend, StorageError
 
 
+# The fields of the object resource get_object_metadata() needs
+_METADATA_FIELDS = (
+    "size,md5Hash,contentType,contentEncoding,metadata,customTime,updated"
+)
+
+
+class ClientPool:
+    """A bounded pool of storage clients shared by all threads.
+
+    Storage clients aren't thread-safe, so every client is only used by one thread at a
+    time. A thread checks out an idle client, or creates a new one if there is none, and
+    returns it to the pool when it's done. At most size idle clients are kept.
+
+    All clients share the same credentials, so the default credentials are only looked
+    up and refreshed once per pool. Plain JSON API requests that don't need a client go
+    through a single authorized session with the same credentials, shared by all
+    threads.
+
+    :arg endpoint_url: the API endpoint of the clients, or None for the default
+    :arg size: the maximum number of idle clients to keep
+    """
+
+    def __init__(self, endpoint_url: Optional[str], size: int):
+        self.endpoint_url = endpoint_url
+        self.size = size
+        self.idle = queue.LifoQueue()
+        self.credentials = None
+        self.project = None
+        self.session = None
+        self.lock = threading.Lock()
+
+    def _get_credentials(self):
+        """Return the credentials and the project for the clients."""
+        with self.lock:
+            if self.credentials is None:
+                if os.environ.get("STORAGE_EMULATOR_HOST"):
+                    # The emulator doesn't check credentials, and storage clients use
+                    # anonymous ones with it, too.
+                    self.credentials = AnonymousCredentials()
+                else:
+                    self.credentials, self.project = google.auth.default(
+                        scopes=storage.Client.SCOPE
+                    )
+            return self.credentials, self.project
+
+    def _create_client(self) -> storage.Client:
+        credentials, project = self._get_credentials()
+        # Every client is only used by one thread at a time, so its session never needs
+        # more than one connection. The session is built here to size its connection
+        # pool, since storage.Client only takes a ready session as its _http argument.
+        session = AuthorizedSession(credentials)
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=1)
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        return storage.Client(
+            project=project,
+            credentials=credentials,
+            client_options=ClientOptions(api_endpoint=self.endpoint_url),
+            _http=session,
+        )
+
+    def get_session(self) -> AuthorizedSession:
+        """Return the authorized session for JSON API requests made without a client."""
+        credentials, _ = self._get_credentials()
+        with self.lock:
+            if self.session is None:
+                session = AuthorizedSession(credentials)
+                # Retry like storage clients do for idempotent requests. The last
+                # response is returned when retries run out, so overloads still reach
+                # the concurrency limiter.
+                retries = Retry(
+                    total=3,
+                    backoff_factor=0.2,
+                    status_forcelist=[429, 500, 502, 503, 504],
+                    raise_on_status=False,
+                )
+                adapter = PooledHTTPAdapter(
+                    max_retries=retries,
+                    pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=default_pool_maxsize(),
+                )
+                session.mount("http://", adapter)
+                session.mount("https://", adapter)
+                self.session = session
+            return self.session
+
+    def warm_up(self):
+        """Fill the pool with idle clients."""
+        while self.idle.qsize() < self.size:
+            self.idle.put(self._create_client())
+
+    @contextmanager
+    def checkout(self) -> Iterator[storage.Client]:
+        """Check out a client for the duration of the context."""
+        try:
+            client = self.idle.get_nowait()
+            METRICS.incr("storage_client_pool", tags=["result:hit"])
+        except queue.Empty:
+            client = self._create_client()
+            METRICS.incr("storage_client_pool", tags=["result:miss"])
+        try:
+            yield client
+        finally:
+            if self.idle.qsize() < self.size:
+                self.idle.put(client)
+
+
+# Client pools and concurrency limiters shared by all backends with the same endpoint
+_CLIENT_POOLS = {}
+_CONCURRENCY_LIMITERS = {}
+_CLIENT_POOLS_LOCK = threading.Lock()
+
+
+def _reset_client_pools():
+    """Forget all client pools and concurrency limiters.
+
+    This is called in child processes after a fork, so the child doesn't use the
+    connections of the parent's clients or inherit calls in flight in the parent.
+    """
+    global _CLIENT_POOLS_LOCK
+    _CLIENT_POOLS.clear()
+    _CONCURRENCY_LIMITERS.clear()
+    _CLIENT_POOLS_LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_client_pools)
+
+
+def get_client_pool(endpoint_url: Optional[str]) -> ClientPool:
+    """Return the process-wide client pool for the given endpoint."""
+    with _CLIENT_POOLS_LOCK:
+        if endpoint_url not in _CLIENT_POOLS:
+            size = settings.STORAGE_CLIENT_POOL_SIZE or default_pool_maxsize()
+            _CLIENT_POOLS[endpoint_url] = ClientPool(endpoint_url, size)
+        return _CLIENT_POOLS[endpoint_url]
+
+
+def get_concurrency_limiter(endpoint_url: Optional[str]) -> AIMDLimiter:
+    """Return the process-wide limiter of concurrent calls to the given endpoint."""
+    with _CLIENT_POOLS_LOCK:
+        if endpoint_url not in _CONCURRENCY_LIMITERS:
+            _CONCURRENCY_LIMITERS[endpoint_url] = AIMDLimiter(
+                name=urlparse(endpoint_url).netloc if endpoint_url else "default",
+                initial_limit=settings.STORAGE_CONCURRENCY_INITIAL_LIMIT,
+                max_limit=(
+                    settings.STORAGE_CONCURRENCY_MAX_LIMIT or default_pool_maxsize()
+                ),
+                overload_exceptions=(ServiceUnavailable, TooManyRequests),
+            )
+        return _CONCURRENCY_LIMITERS[endpoint_url]
+
+
+def _original_content(
+    gcs_metadata: dict, md5_hash: Optional[str], size: Optional[int]
+) -> tuple[Optional[str], Optional[int]]:
+    """Return the MD5 sum and the size of the original content of an object.
+
+    Compressed objects record them in their custom metadata. For other objects, they
+    are the MD5 hash and the size of the object itself.
+
+    :arg gcs_metadata: the custom metadata of the object
+    :arg md5_hash: the base64-encoded MD5 hash of the object as returned by GCS
+    :arg size: the size of the object
+    """
+    original_content_length = gcs_metadata.get("original_size")
+    if original_content_length is None:
+        original_content_length = size
+    else:
+        try:
+            original_content_length = int(original_content_length)
+        except ValueError:
+            original_content_length = None
+    original_md5_sum = gcs_metadata.get("original_md5_hash")
+    if original_md5_sum is None and md5_hash:
+        original_md5_sum = base64.b64decode(md5_hash).hex()
+    return original_md5_sum, original_content_length
+
+
 class GCSStorage(StorageBackend):
     """
     An implementation of the StorageBackend interface for Google Cloud Storage.
@@ -43,7 +245,6 @@ class GCSStorage(StorageBackend):
             self.public_url = public_url.removesuffix("/")
         else:
             self.public_url = None
-        self.clients = threading.local()
         # The Cloud Storage client doesn't support setting global timeouts for all requests, so we
         # need to pass the timeout for every single request. the default timeout is 60 seconds for
         # both connecting and reading from the socket.
@@ -52,16 +253,47 @@ class GCSStorage(StorageBackend):
     def __repr__(self):
         return f"<{self.__class__.__name__} gs://{self.bucket}/{self.prefix}> try:{self.try_symbols}"
 
-    def _get_client(self) -> storage.Client:
-        """Return a thread-local low-level storage client."""
-        if not hasattr(self.clients, "client"):
-            options = ClientOptions(api_endpoint=self.endpoint_url)
-            self.clients.client = storage.Client(client_options=options)
-        return self.clients.client
+    @property
+    def client_pool(self) -> ClientPool:
+        return get_client_pool(self.endpoint_url)
+
+    def _limit(self, track_latency: bool = True):
+        """Return a context that limits the number of concurrent storage calls.
+
+        The limit is adaptive and shared by all backends with the same endpoint. It's
+        only enforced if STORAGE_ADAPTIVE_CONCURRENCY is set.
+        """
+        if not settings.STORAGE_ADAPTIVE_CONCURRENCY:
+            return nullcontext()
+        limiter = get_concurrency_limiter(self.endpoint_url)
+        return limiter.limit(track_latency=track_latency)
+
+    @contextmanager
+    def _get_client(self) -> Iterator[storage.Client]:
+        """Check out a low-level storage client from the shared pool."""
+        with self.client_pool.checkout() as client:
+            yield client
+
+    @contextmanager
+    def _get_bucket(self) -> Iterator[storage.Bucket]:
+        """Check out a low-level storage bucket client from the shared pool."""
+        with self._get_client() as client:
+            yield client.bucket(self.bucket)
 
-    def _get_bucket(self) -> storage.Bucket:
-        """Return a thread-local low-level storage bucket client."""
-        return self._get_client().bucket(self.bucket)
+    def _default_endpoint_url(self) -> str:
+        """Return the API endpoint of the storage clients."""
+        with self._get_client() as client:
+            return client.api_endpoint
+
+    def warm_up(self):
+        """Create the storage clients up front, so the first requests don't have to.
+
+        :raises StorageError: an unexpected backend-specific error was raised
+        """
+        try:
+            self.client_pool.warm_up()
+        except GoogleAuthError as exc:
+            raise StorageError(str(exc), backend=self) from exc
 
     def exists(self) -> bool:
         """Check that this storage exists.
@@ -70,7 +302,7 @@ class GCSStorage(StorageBackend):
 
         :raises StorageError: an unexpected backend-specific error was raised
         """
-        endpoint_url = self.endpoint_url or self._get_client().api_endpoint
+        endpoint_url = self.endpoint_url or self._default_endpoint_url()
         if endpoint_url.startswith("http://gcs-emulator"):
             # NOTE(smarnach): The GCS emulator does not support HEAD requests. Moreover, the
             # simpler public endpoint used below will throw 500s if the bucket doesn't exists,
@@ -83,7 +315,7 @@ class GCSStorage(StorageBackend):
             method = "HEAD"
             url = f"{endpoint_url}/{self.bucket}"
         try:
-            session = session_with_retries()
+            session = pooled_session()
             response = session.request(method, url)
         except RequestException as exc:
             raise StorageError(str(exc), backend=self) from exc
@@ -91,10 +323,20 @@ class GCSStorage(StorageBackend):
 
     def get_download_url(self, key: str) -> str:
         """Return the download URL for the given key."""
-        endpoint_url = self.endpoint_url or self._get_client().meta.endpoint_url
+        endpoint_url = self.endpoint_url or self._default_endpoint_url()
         endpoint_url = endpoint_url.removesuffix("/")
         return f"{endpoint_url}/{self.bucket}/{self.prefix}/{quote(key)}"
 
+    def get_public_download_url(self, key: str) -> Optional[str]:
+        """Return the public download URL for the given key without checking storage.
+
+        :returns: The URL the object would be downloaded from if it exists, or None if the
+            backend has no public URL.
+        """
+        if not self.public_url:
+            return None
+        return f"{self.public_url}/{quote(f'{self.prefix}/{key}')}"
+
     def get_object_metadata(self, key: str) -> Optional[ObjectMetadata]:
         """Return object metadata for the object with the given key.
 
@@ -105,47 +347,89 @@ class GCSStorage(StorageBackend):
 
         :raises StorageError: an unexpected backend-specific error was raised
         """
-        bucket = self._get_bucket()
         gcs_key = f"{self.prefix}/{key}"
+        endpoint_url = self.endpoint_url or self._default_endpoint_url()
+        endpoint_url = endpoint_url.removesuffix("/")
+        # Fetching the object resource with a projection to the fields needed here is
+        # considerably cheaper than bucket.get_blob(), which fetches the full resource
+        # and builds a Blob from it.
+        url = f"{endpoint_url}/storage/v1/b/{self.bucket}/o/{quote(gcs_key, safe='')}"
         try:
-            blob = bucket.get_blob(gcs_key, timeout=self.timeout)
-            if not blob:
-                return None
-        except ClientError as exc:
+            with self._limit():
+                response = self.client_pool.get_session().get(
+                    url, params={"fields": _METADATA_FIELDS}, timeout=self.timeout
+                )
+                if response.status_code != 200:
+                    raise from_http_response(response)
+                resource = response.json()
+        except NotFound:
+            return None
+        except (ClientError, RequestException, ValueError) as exc:
             raise StorageError(str(exc), backend=self) from exc
-        gcs_metadata = blob.metadata or {}
-        original_content_length = gcs_metadata.get("original_size")
-        if original_content_length is None:
-            original_content_length = blob.size
-        else:
-            try:
-                original_content_length = int(original_content_length)
-            except ValueError:
-                original_content_length = None
-        original_md5_sum = gcs_metadata.get("original_md5_hash")
-        if original_md5_sum is None and blob.md5_hash:
-            original_md5_sum = base64.b64decode(blob.md5_hash).hex()
-        if self.public_url:
-            download_url = f"{self.public_url}/{quote(gcs_key)}"
-        else:
-            download_url = blob.public_url
+        size = resource.get("size")
+        if size is not None:
+            size = int(size)
+        original_md5_sum, original_content_length = _original_content(
+            resource.get("metadata") or {}, resource.get("md5Hash"), size
+        )
+        download_url = self.get_public_download_url(key)
+        if download_url is None:
+            download_url = f"{endpoint_url}/{self.bucket}/{quote(gcs_key, safe='/~')}"
+        last_modified = resource.get("customTime") or resource.get("updated")
+        if last_modified is not None:
+            last_modified = datetime.fromisoformat(last_modified)
         metadata = ObjectMetadata(
             download_url=download_url,
-            content_type=blob.content_type,
-            content_length=blob.size,
-            content_encoding=blob.content_encoding,
+            content_type=resource.get("contentType"),
+            content_length=size,
+            content_encoding=resource.get("contentEncoding"),
             original_content_length=original_content_length,
             original_md5_sum=original_md5_sum,
-            last_modified=blob.custom_time or blob.updated,
+            last_modified=last_modified,
         )
         return metadata
 
-    def _prepare_upload_blob(self, key: str, metadata: ObjectMetadata) -> storage.Blob:
+    def read_range(self, key: str, start: int, length: int) -> Optional[bytes]:
+        """Return up to length bytes of the stored object starting at offset start.
+
+        The bytes are returned as stored, i.e. without undoing any content encoding.
+
+        :arg key: the key of the symbol file not including the prefix, i.e. the key in the format
+            ``<debug-file>/<debug-id>/<symbols-file>``.
+        :arg start: the offset of the first byte to return
+        :arg length: the maximum number of bytes to return
+
+        :returns: The bytes read if the object exists, None otherwise. Fewer than length bytes
+            are returned if the object ends before start + length.
+
+        :raises StorageError: an unexpected backend-specific error was raised
+        """
+        try:
+            with self._limit(), self._get_bucket() as bucket:
+                blob = bucket.blob(f"{self.prefix}/{key}")
+                # raw_download prevents the client from decompressing gzip-encoded
+                # objects, which would fail for a partial gzip stream.
+                return blob.download_as_bytes(
+                    start=start,
+                    end=start + length - 1,
+                    raw_download=True,
+                    timeout=self.timeout,
+                )
+        except NotFound:
+            return None
+        except RequestRangeNotSatisfiable:
+            # The object ends before start.
+            return b""
+        except ClientError as exc:
+            raise StorageError(str(exc), backend=self) from exc
+
+    def _prepare_upload_blob(
+        self, bucket: storage.Bucket, key: str, metadata: ObjectMetadata
+    ) -> storage.Blob:
         """Helper function for upload() and initiate_upload().
 
         This function can be inlined once we remove the upload() method.
         """
-        bucket = self._get_bucket()
         blob = bucket.blob(f"{self.prefix}/{key}")
         gcs_metadata = {}
         if metadata.original_content_length:
@@ -170,14 +454,77 @@ class GCSStorage(StorageBackend):
 
         :raises StorageError: an unexpected backend-specific error was raised
         """
-        blob = self._prepare_upload_blob(key, metadata)
         try:
-            blob.upload_from_file(
-                body, size=metadata.content_length, timeout=self.timeout
-            )
+            # The duration of an upload depends on the size of the file, so it can't
+            # be compared with other calls.
+            with self._limit(track_latency=False), self._get_bucket() as bucket:
+                blob = self._prepare_upload_blob(bucket, key, metadata)
+                blob.upload_from_file(
+                    body, size=metadata.content_length, timeout=self.timeout
+                )
         except ClientError as exc:
             raise StorageError(str(exc), backend=self) from exc
 
+    def copy(
+        self,
+        source_key: str,
+        key: str,
+        metadata: ObjectMetadata,
+        original_md5_sum: str,
+        original_size: int,
+    ) -> bool:
+        """Copy the object with the given source key to the given key in storage.
+
+        The data is copied without downloading it, and the copy gets the given metadata
+        instead of the metadata of the source object. The source object is only copied if
+        its original content has the given MD5 sum and size.
+
+        :arg source_key: the key of the object to copy, not including the prefix
+        :arg key: the key of the symbol file not including the prefix, i.e. the key in the format
+            ``<debug-file>/<debug-id>/<symbols-file>``.
+        :arg metadata: An ObjectMetadata instance with the metadata.
+        :arg original_md5_sum: the expected MD5 sum of the original content of the source object
+        :arg original_size: the expected size of the original content of the source object
+
+        :returns: True if the object was copied, False if the source object doesn't exist or
+            doesn't have the expected content.
+
+        :raises StorageError: an unexpected backend-specific error was raised
+        """
+        try:
+            with self._limit(), self._get_bucket() as bucket:
+                source = bucket.get_blob(
+                    f"{self.prefix}/{source_key}", timeout=self.timeout
+                )
+                if source is None:
+                    return False
+                source_content = _original_content(
+                    source.metadata or {}, source.md5_hash, source.size
+                )
+                if source_content != (original_md5_sum, original_size):
+                    return False
+                # Rewriting sends the properties of the destination blob, which
+                # replaces the metadata of the source object.
+                blob = self._prepare_upload_blob(bucket, key, metadata)
+                # Pinning the generation that was checked makes the copy fail if the
+                # source object was replaced in the meantime.
+                token = None
+                while True:
+                    token, _, _ = blob.rewrite(
+                        source,
+                        token=token,
+                        if_source_generation_match=source.generation,
+                        timeout=self.timeout,
+                    )
+                    # Large objects may take several calls to rewrite.
+                    if token is None:
+                        break
+        except (NotFound, PreconditionFailed):
+            return False
+        except ClientError as exc:
+            raise StorageError(str(exc), backend=self) from exc
+        return True
+
     def initiate_upload(self, key: str, metadata: ObjectMetadata) -> str:
         """Initiate uploading an object with the given key to the storage backend.
 
@@ -191,10 +538,11 @@ class GCSStorage(StorageBackend):
 
         :raises StorageError: an unexpected backend-specific error was raised
         """
-        blob = self._prepare_upload_blob(key, metadata)
         try:
-            return blob.create_resumable_upload_session(
-                size=metadata.content_length, timeout=self.timeout
-            )
+            with self._limit(), self._get_bucket() as bucket:
+                blob = self._prepare_upload_blob(bucket, key, metadata)
+                return blob.create_resumable_upload_session(
+                    size=metadata.content_length, timeout=self.timeout
+                )
         except ClientError as exc:
             raise StorageError(str(exc), backend=self) from exc
@@ -24,3 +24,15 @@ def worker_abort(worker):
     from tecken.libmarkus import METRICS
 
     METRICS.incr("gunicorn_worker_abort")
+
+
+def post_worker_init(worker):
+    """Set up the storage clients once the worker loaded the webapp
+
+    This way the first requests the worker handles don't have to create them, and other
+    processes like management commands don't create clients they don't need.
+
+    """
+    from tecken.base.symbolstorage import symbol_storage
+
+    symbol_storage().warm_up()
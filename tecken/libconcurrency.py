@@ -0,0 +1,170 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from contextlib import contextmanager
+import threading
+import time
+from typing import Optional
+
+from tecken.libmarkus import METRICS
+
+
+class Overloaded(Exception):
+    """Raised inside AIMDLimiter.limit() to report an overloaded backend.
+
+    Backends that signal overload in their responses rather than with exceptions can
+    raise this to make the limiter back off. It's re-raised by the limiter.
+    """
+
+
+class AIMDLimiter:
+    """Adaptive limit for the number of concurrent calls to a backend.
+
+    The limit is adjusted with additive increase and multiplicative decrease (AIMD),
+    like the congestion window of TCP: every call that completes in time while the
+    limit is mostly used grows the limit by 1 / limit, i.e. by about one per round trip
+    of calls. A call that fails with one of the overload exceptions or that takes more
+    than latency_tolerance times the average latency shrinks the limit by backoff_ratio.
+
+    Calls that were started before the last backoff don't cause another backoff, so a
+    single latency spike shared by all calls in flight only backs off once.
+
+    Usage::
+
+        limiter = AIMDLimiter("storage", initial_limit=10, max_limit=32)
+        with limiter.limit():
+            ...
+
+    :arg name: the name of the limiter, used as a tag of its metrics
+    :arg initial_limit: the limit to start with
+    :arg max_limit: the limit never grows beyond this
+    :arg min_limit: the limit never shrinks below this
+    :arg backoff_ratio: the factor the limit is multiplied with when backing off
+    :arg latency_tolerance: calls that take longer than this multiple of the average
+        latency make the limiter back off
+    :arg smoothing: the weight of a new latency in the moving average of latencies
+    :arg overload_exceptions: exceptions that signal an overloaded backend, in addition
+        to Overloaded
+    """
+
+    def __init__(
+        self,
+        name: str,
+        initial_limit: int,
+        max_limit: int,
+        min_limit: int = 1,
+        backoff_ratio: float = 0.9,
+        latency_tolerance: float = 2.0,
+        smoothing: float = 0.05,
+        overload_exceptions: tuple[type[BaseException], ...] = (),
+    ):
+        self.name = name
+        self.min_limit = min_limit
+        self.max_limit = max(max_limit, min_limit)
+        self.backoff_ratio = backoff_ratio
+        self.latency_tolerance = latency_tolerance
+        self.smoothing = smoothing
+        self.overload_exceptions = (Overloaded,) + tuple(overload_exceptions)
+        self._limit = float(min(max(initial_limit, self.min_limit), self.max_limit))
+        self.in_flight = 0
+        self.average_latency: Optional[float] = None
+        self._backoff_at = 0.0
+        self._condition = threading.Condition()
+        self._emit_limit()
+
+    @property
+    def current_limit(self) -> int:
+        """Return the number of calls currently allowed to run concurrently."""
+        return int(self._limit)
+
+    def _emit_limit(self):
+        METRICS.gauge(
+            "storage_concurrency_limit",
+            value=self.current_limit,
+            tags=[f"limiter:{self.name}"],
+        )
+
+    def acquire(self) -> float:
+        """Wait until a call can be started and return its start time."""
+        with self._condition:
+            while self.in_flight >= self.current_limit:
+                self._condition.wait()
+            self.in_flight += 1
+            return time.monotonic()
+
+    def release(
+        self, started_at: float, overloaded: bool = False, track_latency: bool = True
+    ):
+        """Record the outcome of a call and adjust the limit.
+
+        :arg started_at: the start time of the call returned by acquire()
+        :arg overloaded: whether the call failed because the backend is overloaded
+        :arg track_latency: whether the duration of the call is comparable to other
+            calls, so it can be used to detect latency spikes
+        """
+        latency = time.monotonic() - started_at
+        with self._condition:
+            old_limit = self.current_limit
+            # Whether the limit was mostly used while the call was running. There is
+            # no point in growing a limit that isn't reached.
+            saturated = self.in_flight * 2 >= old_limit
+            self.in_flight -= 1
+            spike = (
+                track_latency
+                and self.average_latency is not None
+                and latency > self.latency_tolerance * self.average_latency
+            )
+            if overloaded or spike:
+                if started_at >= self._backoff_at:
+                    self._limit = max(self._limit * self.backoff_ratio, self.min_limit)
+                    self._backoff_at = time.monotonic()
+                    reason = "overload" if overloaded else "latency"
+                    METRICS.incr(
+                        "storage_concurrency_backoff",
+                        tags=[f"limiter:{self.name}", f"reason:{reason}"],
+                    )
+            elif saturated:
+                self._limit = min(self._limit + 1 / self._limit, self.max_limit)
+            if track_latency and not overloaded:
+                # Spikes are included in the average, so the limiter adapts to a lasting
+                # change in latency instead of backing off forever.
+                if self.average_latency is None:
+                    self.average_latency = latency
+                else:
+                    self.average_latency += self.smoothing * (
+                        latency - self.average_latency
+                    )
+            if self.current_limit != old_limit:
+                self._emit_limit()
+            self._condition.notify_all()
+
+    @contextmanager
+    def limit(self, track_latency: bool = True):
+        """Run the body of the context as a limited call.
+
+        :arg track_latency: pass False for calls whose duration mostly depends on the
+            size of the data transferred, so it isn't used to detect latency spikes
+        """
+        started_at = self.acquire()
+        overloaded = False
+        try:
+            yield
+        except self.overload_exceptions:
+            overloaded = True
+            raise
+        finally:
+            self.release(started_at, overloaded=overloaded, track_latency=track_latency)
+
+    def state(self) -> dict:
+        """Return the current state of the limiter for debugging."""
+        with self._condition:
+            return {
+                "limit": self.current_limit,
+                "in_flight": self.in_flight,
+                "average_latency_ms": (
+                    None
+                    if self.average_latency is None
+                    else round(self.average_latency * 1000, 1)
+                ),
+            }
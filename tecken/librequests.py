@@ -2,8 +2,17 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from http.cookiejar import DefaultCookiePolicy
+import os
+import socket
+import threading
+
+from django.conf import settings
 import requests
 from requests.adapters import HTTPAdapter, Retry
+from urllib3.connection import HTTPConnection
+
+from tecken.libmarkus import METRICS
 
 
 class HTTPAdapterWithTimeout(HTTPAdapter):
@@ -32,6 +41,24 @@ class HTTPAdapterWithTimeout(HTTPAdapter):
         return super().send(*args, **kwargs)
 
 
+class PooledHTTPAdapter(HTTPAdapterWithTimeout):
+    """HTTPAdapterWithTimeout that enables TCP keep-alive on its connections
+
+    Idle connections kept in the pools of long-lived sessions are otherwise
+    silently dropped by NAT gateways and load balancers, which makes the next
+    request on them fail.
+
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs.setdefault(
+            "socket_options",
+            HTTPConnection.default_socket_options
+            + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)],
+        )
+        super().init_poolmanager(*args, **kwargs)
+
+
 def session_with_retries(
     total_retries=5,
     backoff_factor=0.2,
@@ -58,6 +85,19 @@ def session_with_retries(
     :returns: a requests Session instance
 
     """
+    return _build_session(
+        total_retries, backoff_factor, status_forcelist, default_timeout
+    )
+
+
+def _build_session(
+    total_retries,
+    backoff_factor,
+    status_forcelist,
+    default_timeout,
+    adapter_class=HTTPAdapterWithTimeout,
+    **adapter_kwargs,
+):
     retries = Retry(
         total=total_retries,
         backoff_factor=backoff_factor,
@@ -69,10 +109,96 @@ def session_with_retries(
     # Set the User-Agent header so we can distinguish our stuff from other stuff
     session.headers.update({"User-Agent": "tecken-requests/1.0"})
 
-    adapter = HTTPAdapterWithTimeout(
-        max_retries=retries, default_timeout=default_timeout
+    adapter = adapter_class(
+        max_retries=retries, default_timeout=default_timeout, **adapter_kwargs
     )
     session.mount("http://", adapter)
     session.mount("https://", adapter)
 
     return session
+
+
+# Long-lived sessions shared by all threads of the process keyed by the arguments
+# they were created with
+_SESSIONS = {}
+_SESSIONS_LOCK = threading.Lock()
+
+
+def _reset_sessions():
+    """Forget all pooled sessions
+
+    This is called in child processes after a fork, since the connections in the
+    pools of the parent's sessions must not be shared with the child. The lock is
+    replaced, too, since it may have been held by another thread during the fork.
+
+    """
+    global _SESSIONS_LOCK
+    _SESSIONS.clear()
+    _SESSIONS_LOCK = threading.Lock()
+
+
+os.register_at_fork(after_in_child=_reset_sessions)
+
+
+def default_pool_maxsize():
+    """Returns the maximum number of connections to keep per host
+
+    This is HTTP_POOL_MAXSIZE if set. Otherwise, it's the number of threads of the
+    upload executor, so every thread can keep a connection to the same host.
+
+    """
+    if settings.HTTP_POOL_MAXSIZE:
+        return settings.HTTP_POOL_MAXSIZE
+    max_workers = settings.UPLOAD_FILE_UPLOAD_MAX_WORKERS
+    if not max_workers:
+        # This is the default size of a ThreadPoolExecutor.
+        max_workers = min(32, (os.cpu_count() or 1) + 4)
+    return max(max_workers, settings.UPLOAD_BY_DOWNLOAD_CONNECTIONS)
+
+
+def pooled_session(
+    total_retries=5,
+    backoff_factor=0.2,
+    status_forcelist=(429, 500),
+    default_timeout=5.0,
+):
+    """Returns a process-wide session that retries on HTTP 429 and 500
+
+    Unlike session_with_retries(), this returns the same session every time it's
+    called with the same arguments, so connections and TLS sessions are reused
+    across requests. The session is shared by all threads, so callers must not
+    change its state, e.g. its headers. Cookies are never stored in the session.
+
+    The connection pools of the session are sized by HTTP_POOL_CONNECTIONS and
+    HTTP_POOL_MAXSIZE, and connections use TCP keep-alive.
+
+    The arguments are the same as for session_with_retries().
+
+    :returns: a requests Session instance
+
+    """
+    key = (total_retries, backoff_factor, tuple(status_forcelist), default_timeout)
+    # Sessions are only ever added, so looking one up doesn't need the lock.
+    session = _SESSIONS.get(key)
+    if session is None:
+        with _SESSIONS_LOCK:
+            # Another thread may have created the session while this one was waiting.
+            session = _SESSIONS.get(key)
+            if session is None:
+                session = _build_session(
+                    total_retries,
+                    backoff_factor,
+                    status_forcelist,
+                    default_timeout,
+                    adapter_class=PooledHTTPAdapter,
+                    pool_connections=settings.HTTP_POOL_CONNECTIONS,
+                    pool_maxsize=default_pool_maxsize(),
+                )
+                # The session is shared by unrelated requests, so it must not carry
+                # cookies from one to the next.
+                session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+                _SESSIONS[key] = session
+                METRICS.incr("requests_session_pool", tags=["result:miss"])
+                return session
+    METRICS.incr("requests_session_pool", tags=["result:hit"])
+    return session
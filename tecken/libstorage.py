@@ -52,6 +52,27 @@ class StorageBackend:
         """
         raise NotImplementedError("exists() must be implemented by the concrete class")
 
+    def warm_up(self):
+        """Prepare the backend for handling requests.
+
+        This is called once in every web server worker before it handles requests, so
+        the first requests don't have to pay for setting up clients. Backends that don't
+        need this can leave it as is.
+
+        :raises StorageError: an unexpected backend-specific error was raised
+        """
+
+    def get_public_download_url(self, key: str) -> Optional[str]:
+        """Return the public download URL for the given key without checking storage.
+
+        :arg key: the key of the symbol file not including the prefix, i.e. the key in the format
+            ``<debug-file>/<debug-id>/<symbols-file>``.
+
+        :returns: The URL the object would be downloaded from if it exists, or None if the
+            backend has no public URL that's known in advance.
+        """
+        return None
+
     def get_object_metadata(self, key: str) -> Optional[ObjectMetadata]:
         """Return object metadata for the object with the given key.
 
@@ -66,6 +87,25 @@ class StorageBackend:
             "get_object_metadata() must be implemented by the concrete class"
         )
 
+    def read_range(self, key: str, start: int, length: int) -> Optional[bytes]:
+        """Return up to length bytes of the stored object starting at offset start.
+
+        The bytes are returned as stored, i.e. without undoing any content encoding.
+
+        :arg key: the key of the symbol file not including the prefix, i.e. the key in the format
+            ``<debug-file>/<debug-id>/<symbols-file>``.
+        :arg start: the offset of the first byte to return
+        :arg length: the maximum number of bytes to return
+
+        :returns: The bytes read if the object exists, None otherwise. Fewer than length bytes
+            are returned if the object ends before start + length.
+
+        :raises StorageError: an unexpected backend-specific error was raised
+        """
+        raise NotImplementedError(
+            "read_range() must be implemented by the concrete class"
+        )
+
     def upload(self, key: str, body: BufferedReader, metadata: ObjectMetadata):
         """Upload the object with the given key and body to the storage backend.
 
@@ -78,6 +118,34 @@ class StorageBackend:
         """
         raise NotImplementedError("upload() must be implemented by the concrete class")
 
+    def copy(
+        self,
+        source_key: str,
+        key: str,
+        metadata: ObjectMetadata,
+        original_md5_sum: str,
+        original_size: int,
+    ) -> bool:
+        """Copy the object with the given source key to the given key in storage.
+
+        The data is copied without downloading it, and the copy gets the given metadata
+        instead of the metadata of the source object. The source object is only copied if
+        its original content has the given MD5 sum and size.
+
+        :arg source_key: the key of the object to copy, not including the prefix
+        :arg key: the key of the symbol file not including the prefix, i.e. the key in the format
+            ``<debug-file>/<debug-id>/<symbols-file>``.
+        :arg metadata: An ObjectMetadata instance with the metadata.
+        :arg original_md5_sum: the expected MD5 sum of the original content of the source object
+        :arg original_size: the expected size of the original content of the source object
+
+        :returns: True if the object was copied, False if the source object doesn't exist or
+            doesn't have the expected content.
+
+        :raises StorageError: an unexpected backend-specific error was raised
+        """
+        raise NotImplementedError("copy() must be implemented by the concrete class")
+
     def initiate_upload(self, key: str, metadata: ObjectMetadata) -> str:
         """Initiate uploading an object with the given key to the storage backend.
 
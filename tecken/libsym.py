@@ -2,19 +2,24 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import zlib
 
-class SymParseError(Exception):
-    """Any kind of error when parsing a sym file."""
 
+# The lines in the header of a sym file start with one of these.
+_HEADER_LINE_PREFIXES = (b"MODULE", b"INFO")
 
-def extract_sym_header_data(file_path):
-    """Returns header data from thh sym file header.
+# The first bytes of a gzip stream.
+_GZIP_MAGIC = b"\x1f\x8b"
 
-    :arg file_path: the path to the sym file
 
-    :returns: sym info as a dict
+class SymParseError(Exception):
+    """Any kind of error when parsing a sym file."""
 
-    :raises SymParseError: any kind of sym parse error
+
+def _parse_sym_header_lines(lines):
+    """Returns header data parsed from an iterable of sym file lines.
+
+    Stops at the first line that's not part of the header.
 
     """
     data = {
@@ -24,37 +29,103 @@ def extract_sym_header_data(file_path):
         "code_id": "",
         "generator": "",
     }
-    with open(file_path, "r") as fp:
-        line = "no line yet"
-        try:
-            for line in fp:
-                if line.startswith("MODULE"):
-                    parts = line.strip().split()
-                    _, opsys, arch, debug_id, debug_filename = parts
-                    data["debug_filename"] = debug_filename
-                    data["debug_id"] = debug_id.upper()
-
-                elif line.startswith("INFO"):
-                    parts = line.strip().split()
-                    if parts[1] == "CODE_ID":
-                        # NOTE(willkg): Non-Windows module sym files don't have a code_file
-                        if len(parts) == 3:
-                            _, _, code_id = parts
-                            code_file = ""
-                        elif len(parts) == 4:
-                            _, _, code_id, code_file = parts
-
-                        data["code_file"] = code_file
-                        data["code_id"] = code_id.upper()
-
-                    elif parts[1] == "GENERATOR":
-                        _, _, generator = line.strip().split(maxsplit=2)
-                        data["generator"] = generator
-
-                else:
-                    break
-
-        except Exception as exc:
-            raise SymParseError(f"sym parse error {exc!r} with {line!r}") from exc
+    line = "no line yet"
+    try:
+        for line in lines:
+            if line.startswith("MODULE"):
+                parts = line.strip().split()
+                _, opsys, arch, debug_id, debug_filename = parts
+                data["debug_filename"] = debug_filename
+                data["debug_id"] = debug_id.upper()
+
+            elif line.startswith("INFO"):
+                parts = line.strip().split()
+                if parts[1] == "CODE_ID":
+                    # NOTE(willkg): Non-Windows module sym files don't have a code_file
+                    if len(parts) == 3:
+                        _, _, code_id = parts
+                        code_file = ""
+                    elif len(parts) == 4:
+                        _, _, code_id, code_file = parts
+
+                    data["code_file"] = code_file
+                    data["code_id"] = code_id.upper()
+
+                elif parts[1] == "GENERATOR":
+                    _, _, generator = line.strip().split(maxsplit=2)
+                    data["generator"] = generator
+
+            else:
+                break
+
+    except Exception as exc:
+        raise SymParseError(f"sym parse error {exc!r} with {line!r}") from exc
 
     return data
+
+
+def extract_sym_header_data(file_path):
+    """Returns header data from thh sym file header.
+
+    :arg file_path: the path to the sym file
+
+    :returns: sym info as a dict
+
+    :raises SymParseError: any kind of sym parse error
+
+    """
+    with open(file_path, "r") as fp:
+        return _parse_sym_header_lines(fp)
+
+
+def extract_sym_header_data_from_bytes(head):
+    """Returns header data from the first bytes of a sym file.
+
+    This is for when only the beginning of the sym file is available, e.g. when it was
+    read from storage with a range request. A trailing incomplete line is ignored.
+
+    :arg head: the first bytes of the (uncompressed) sym file
+
+    :returns: sym info as a dict
+
+    :raises SymParseError: any kind of sym parse error
+
+    """
+    lines = head.decode("utf-8", errors="replace").splitlines(keepends=True)
+    if lines and not lines[-1].endswith("\n"):
+        lines.pop()
+    return _parse_sym_header_lines(lines)
+
+
+def read_sym_header(chunks):
+    """Returns the beginning of a sym file up to and including the first line after
+    the header.
+
+    Chunks are only consumed until that line is complete, so a lazy iterable can be
+    used to avoid reading the rest of a large file. Gzip-compressed data is detected
+    and decompressed as it's read.
+
+    :arg chunks: iterable of bytes objects with consecutive parts of the sym file
+
+    :returns: the header as bytes; all of the data if the header doesn't end
+
+    :raises SymParseError: if the gzip data is invalid
+
+    """
+    decompressor = None
+    head = bytearray()
+    line_start = 0
+    for i, chunk in enumerate(chunks):
+        if i == 0 and chunk.startswith(_GZIP_MAGIC):
+            decompressor = zlib.decompressobj(wbits=zlib.MAX_WBITS | 16)
+        if decompressor is not None:
+            try:
+                chunk = decompressor.decompress(chunk)
+            except zlib.error as exc:
+                raise SymParseError(f"gzip error {exc!r}") from exc
+        head += chunk
+        while (line_end := head.find(b"\n", line_start)) != -1:
+            if not head.startswith(_HEADER_LINE_PREFIXES, line_start):
+                return bytes(head[: line_end + 1])
+            line_start = line_end + 1
+    return bytes(head)
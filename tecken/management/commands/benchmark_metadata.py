@@ -0,0 +1,133 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import base64
+from io import BytesIO
+import statistics
+import time
+from typing import Optional
+from urllib.parse import quote
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tecken.base.symbolstorage import symbol_storage
+from tecken.ext.gcs.storage import GCSStorage
+from tecken.libstorage import ObjectMetadata
+
+
+BENCHMARK_KEY = "benchmark.pdb/0000000000000000000000000000000000/benchmark.sym"
+BENCHMARK_BODY = (
+    b"MODULE windows x86 0000000000000000000000000000000000 benchmark.pdb\n"
+)
+
+
+def get_object_metadata_from_blob(
+    backend: GCSStorage, key: str
+) -> Optional[ObjectMetadata]:
+    """Return object metadata by loading the full Blob, like GCSStorage used to."""
+    gcs_key = f"{backend.prefix}/{key}"
+    with backend._get_bucket() as bucket:
+        blob = bucket.get_blob(gcs_key, timeout=backend.timeout)
+    if not blob:
+        return None
+    gcs_metadata = blob.metadata or {}
+    original_content_length = gcs_metadata.get("original_size")
+    if original_content_length is None:
+        original_content_length = blob.size
+    else:
+        original_content_length = int(original_content_length)
+    original_md5_sum = gcs_metadata.get("original_md5_hash")
+    if original_md5_sum is None and blob.md5_hash:
+        original_md5_sum = base64.b64decode(blob.md5_hash).hex()
+    if backend.public_url:
+        download_url = f"{backend.public_url}/{quote(gcs_key)}"
+    else:
+        download_url = blob.public_url
+    return ObjectMetadata(
+        download_url=download_url,
+        content_type=blob.content_type,
+        content_length=blob.size,
+        content_encoding=blob.content_encoding,
+        original_content_length=original_content_length,
+        original_md5_sum=original_md5_sum,
+        last_modified=blob.custom_time or blob.updated,
+    )
+
+
+def time_calls(fn, iterations: int) -> list[float]:
+    """Call fn the given number of times and return the duration of each call in ms."""
+    durations = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        fn()
+        durations.append((time.perf_counter() - start) * 1000)
+    return durations
+
+
+class Command(BaseCommand):
+    """Compare fetching object metadata with a JSON API projection and with a Blob.
+
+    GCSStorage.get_object_metadata() requests only the fields of the object resource it
+    needs. This times it against loading the full Blob with bucket.get_blob(), which it
+    used to do, on the same object in the regular upload backend.
+
+    Unless a key is passed, a small object is uploaded for the benchmark first. This is
+    meant to be run against the GCS emulator in the local development environment.
+
+    """
+
+    help = "Benchmark fetching object metadata from storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=200,
+            help="Number of times to fetch the metadata with each method.",
+        )
+        parser.add_argument(
+            "--key",
+            default=None,
+            help="Key of an existing object to use instead of uploading one.",
+        )
+
+    def handle(self, *args, **options):
+        backend = symbol_storage().get_upload_backend(False)
+        if not isinstance(backend, GCSStorage):
+            raise CommandError(f"{backend!r} is not a GCS backend")
+
+        key = options["key"]
+        if key is None:
+            key = BENCHMARK_KEY
+            metadata = ObjectMetadata(
+                content_type="text/plain", content_length=len(BENCHMARK_BODY)
+            )
+            backend.upload(key, BytesIO(BENCHMARK_BODY), metadata)
+
+        lean = backend.get_object_metadata(key)
+        if lean is None:
+            raise CommandError(f"{key} does not exist in {backend!r}")
+        if lean != get_object_metadata_from_blob(backend, key):
+            raise CommandError("The two methods returned different metadata")
+
+        iterations = options["iterations"]
+        self.stdout.write(f"benchmark_metadata: {iterations} iterations of {key}")
+        results = {
+            "projection": time_calls(
+                lambda: backend.get_object_metadata(key), iterations
+            ),
+            "blob": time_calls(
+                lambda: get_object_metadata_from_blob(backend, key), iterations
+            ),
+        }
+        for name, durations in results.items():
+            p95 = statistics.quantiles(durations, n=20)[-1]
+            self.stdout.write(
+                f">>> {name}: mean={statistics.mean(durations):.2f}ms "
+                f"median={statistics.median(durations):.2f}ms p95={p95:.2f}ms"
+            )
+        speedup = statistics.mean(results["blob"]) / statistics.mean(
+            results["projection"]
+        )
+        self.stdout.write(f">>> speedup: {speedup:.2f}x")
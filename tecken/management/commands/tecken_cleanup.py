@@ -16,6 +16,7 @@ class Command(BaseCommand):
 
     * remove_stale_contenttypes
     * clearsessions - remove expired sessions
+    * managepartitions - create upcoming and drop expired fileupload partitions
     * clearuploads - remove database records for expired uploads
     """
 
@@ -32,6 +33,10 @@ class Command(BaseCommand):
         with METRICS.timer("cleanup.remove_stale_contenttypes_timing"):
             call_command("remove_stale_contenttypes")
 
+        # Create upcoming fileupload partitions and drop expired ones
+        self.stdout.write("\n>>> running managepartitions")
+        call_command("managepartitions")
+
         # Clear expired upload and fileupload records
         self.stdout.write("\n>>> running clearuploads")
         call_command("clearuploads")
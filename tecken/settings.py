@@ -445,6 +445,44 @@ STORAGE_READ_TIMEOUT = _config(
     parser=int,
     doc="Object storage read timeout in seconds.",
 )
+STORAGE_CLIENT_POOL_SIZE = _config(
+    "STORAGE_CLIENT_POOL_SIZE",
+    default="0",
+    parser=int,
+    doc=(
+        "Object storage clients are shared by all threads of a process. This setting "
+        "determines the number of idle clients kept per storage endpoint, which are "
+        "created at startup. Setting this to 0 uses HTTP_POOL_MAXSIZE or its default."
+    ),
+)
+
+STORAGE_ADAPTIVE_CONCURRENCY = _config(
+    "STORAGE_ADAPTIVE_CONCURRENCY",
+    default="false",
+    parser=bool,
+    doc=(
+        "Whether to adaptively limit the number of concurrent object storage calls "
+        "per storage endpoint. The limit grows while latency is steady and shrinks "
+        "when storage responds with 429 or 503 or latency spikes."
+    ),
+)
+
+STORAGE_CONCURRENCY_INITIAL_LIMIT = _config(
+    "STORAGE_CONCURRENCY_INITIAL_LIMIT",
+    default="10",
+    parser=int,
+    doc="The initial adaptive limit of concurrent object storage calls.",
+)
+
+STORAGE_CONCURRENCY_MAX_LIMIT = _config(
+    "STORAGE_CONCURRENCY_MAX_LIMIT",
+    default="0",
+    parser=int,
+    doc=(
+        "The maximum adaptive limit of concurrent object storage calls. Setting this "
+        "to 0 uses HTTP_POOL_MAXSIZE or its default."
+    ),
+)
 
 
 UPLOAD_FILE_UPLOAD_MAX_WORKERS = _config(
@@ -458,6 +496,95 @@ UPLOAD_FILE_UPLOAD_MAX_WORKERS = _config(
     ),
 )
 
+UPLOAD_CONTENT_DEDUPLICATION = _config(
+    "UPLOAD_CONTENT_DEDUPLICATION",
+    default="false",
+    parser=bool,
+    doc=(
+        "Whether uploaded files whose content is already stored under a different key "
+        "are copied in storage instead of uploaded again. Where content is stored is "
+        "looked up by its MD5 hash and size, and remembered for "
+        "UPLOAD_CONTENT_DEDUPLICATION_TIMEOUT seconds after it was uploaded."
+    ),
+)
+
+UPLOAD_CONTENT_DEDUPLICATION_TIMEOUT = _config(
+    "UPLOAD_CONTENT_DEDUPLICATION_TIMEOUT",
+    default=str(60 * 60 * 24 * 30),
+    parser=int,
+    doc=(
+        "Number of seconds the key an uploaded file is stored under is remembered for "
+        "copying files with the same content when UPLOAD_CONTENT_DEDUPLICATION is "
+        "enabled."
+    ),
+)
+
+UPLOAD_FILE_UPLOAD_MAX_WORKERS_PER_REQUEST = _config(
+    "UPLOAD_FILE_UPLOAD_MAX_WORKERS_PER_REQUEST",
+    default="0",
+    parser=int,
+    doc=(
+        "The thread pool for upload requests takes turns between the requests with "
+        "queued files, so small uploads don't wait behind large ones. This setting "
+        "additionally limits the number of threads a single request can use at the "
+        "same time. Setting this to 0 doesn't limit it."
+    ),
+)
+
+HTTP_POOL_CONNECTIONS = _config(
+    "HTTP_POOL_CONNECTIONS",
+    default="10",
+    parser=int,
+    doc=(
+        "Outgoing HTTP requests use long-lived sessions shared by all threads of a "
+        "process. This setting determines the number of hosts each session keeps a "
+        "connection pool for."
+    ),
+)
+
+HTTP_POOL_MAXSIZE = _config(
+    "HTTP_POOL_MAXSIZE",
+    default="0",
+    parser=int,
+    doc=(
+        "The maximum number of connections to a single host the shared HTTP sessions "
+        "keep open. Setting this to 0 uses the size of the upload thread pool or "
+        "UPLOAD_BY_DOWNLOAD_CONNECTIONS, whichever is larger."
+    ),
+)
+
+UPLOAD_PREWARM_DOWNLOAD_CACHES = _config(
+    "UPLOAD_PREWARM_DOWNLOAD_CACHES",
+    default="false",
+    parser=bool,
+    doc=(
+        "Whether to store the syminfo lookup results for the code files and code ids "
+        "of uploaded sym files in the cache once an upload is complete, so the first "
+        "downloads don't miss the cache."
+    ),
+)
+
+UPLOAD_TIMINGS_MAX_FILES = _config(
+    "UPLOAD_TIMINGS_MAX_FILES",
+    default="100",
+    parser=int,
+    doc=(
+        "Number of files whose timings are recorded with an upload. The files that "
+        "took the longest are recorded."
+    ),
+)
+
+UPLOAD_FILE_UPLOAD_BULK_CREATE_BATCH_SIZE = _config(
+    "UPLOAD_FILE_UPLOAD_BULK_CREATE_BATCH_SIZE",
+    default="500",
+    parser=int,
+    doc=(
+        "The file upload records for an upload are inserted into the database "
+        "together once all files are uploaded. This setting determines the maximum "
+        "number of records per INSERT statement."
+    ),
+)
+
 UPLOAD_TEMPDIR = _config(
     "UPLOAD_TEMPDIR",
     default="/tmp/uploads",
@@ -657,6 +784,206 @@ ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = _config(
     ),
 )
 
+UPLOAD_BY_DOWNLOAD_STREAMING = _config(
+    "UPLOAD_BY_DOWNLOAD_STREAMING",
+    default="true",
+    parser=bool,
+    doc=(
+        'When you "upload by download" a zip archive from a server supporting range '
+        "requests, read the archive listing first and upload each file as soon as it "
+        "has been downloaded, rather than downloading the whole archive first."
+    ),
+)
+
+UPLOAD_BY_DOWNLOAD_CONNECTIONS = _config(
+    "UPLOAD_BY_DOWNLOAD_CONNECTIONS",
+    default="4",
+    parser=int,
+    doc=(
+        'When you "upload by download" from a server supporting range requests, the '
+        "maximum number of concurrent range requests used to download the file."
+    ),
+)
+
+UPLOAD_BY_DOWNLOAD_SEGMENT_SIZE = _config(
+    "UPLOAD_BY_DOWNLOAD_SEGMENT_SIZE",
+    default=str(8 * 1024 * 1024),
+    parser=int,
+    doc=(
+        'When you "upload by download" from a server supporting range requests, the '
+        "size in bytes of the range downloaded by each request."
+    ),
+)
+
+UPLOAD_BY_DOWNLOAD_REDIRECTS_CACHE_TIMEOUT = _config(
+    "UPLOAD_BY_DOWNLOAD_REDIRECTS_CACHE_TIMEOUT",
+    default="60",
+    parser=int,
+    doc=(
+        'When you "upload by download" from a URL that redirects, the final URL is '
+        "cached for this many seconds, so uploads of the same URL skip the redirect "
+        "chain. Set to 0 to disable."
+    ),
+)
+
+UPLOAD_BY_DOWNLOAD_SKIP_HEAD = _config(
+    "UPLOAD_BY_DOWNLOAD_SKIP_HEAD",
+    default="false",
+    parser=bool,
+    doc=(
+        'When you "upload by download", get the file size from the headers of the '
+        "GET request downloading the file instead of HEAD requests beforehand. This "
+        "saves requests, but the file is always downloaded with a single request."
+    ),
+)
+
+DOWNLOAD_OPTIMISTIC_REDIRECT = _config(
+    "DOWNLOAD_OPTIMISTIC_REDIRECT",
+    default="false",
+    parser=bool,
+    doc=(
+        "Whether to redirect downloads of symbols files known to exist in the first "
+        "download backend straight to its public URL without looking them up in "
+        "storage. Files are known to exist if they were uploaded or found in storage "
+        "within DOWNLOAD_KNOWN_KEYS_TIMEOUT seconds. This only has an effect if the "
+        "backend has a public URL."
+    ),
+)
+
+DOWNLOAD_KNOWN_KEYS_TIMEOUT = _config(
+    "DOWNLOAD_KNOWN_KEYS_TIMEOUT",
+    default=str(60 * 60 * 24),
+    parser=int,
+    doc=(
+        "Number of seconds a symbols file is known to exist after it was uploaded or "
+        "found in storage when DOWNLOAD_OPTIMISTIC_REDIRECT is enabled."
+    ),
+)
+
+DOWNLOAD_SINGLE_FLIGHT = _config(
+    "DOWNLOAD_SINGLE_FLIGHT",
+    default="false",
+    parser=bool,
+    doc=(
+        "Whether concurrent downloads of the same symbols file in a process share a "
+        "single storage lookup and code id lookup. This only has an effect if a "
+        "process serves several requests at once, e.g. with threaded gunicorn "
+        "workers, or together with DOWNLOAD_SINGLE_FLIGHT_SHARED."
+    ),
+)
+
+DOWNLOAD_SINGLE_FLIGHT_SHARED = _config(
+    "DOWNLOAD_SINGLE_FLIGHT_SHARED",
+    default="false",
+    parser=bool,
+    doc=(
+        "Whether concurrent lookups for the same symbols file are also shared across "
+        "processes, using the cache as a lock. Requires DOWNLOAD_SINGLE_FLIGHT."
+    ),
+)
+
+DOWNLOAD_SINGLE_FLIGHT_TIMEOUT = _config(
+    "DOWNLOAD_SINGLE_FLIGHT_TIMEOUT",
+    default="5",
+    parser=int,
+    doc=(
+        "Number of seconds a download waits for the lookup of another request for "
+        "the same symbols file before looking it up itself."
+    ),
+)
+
+SYMINFO_CACHE_FRESH_TIMEOUT = _config(
+    "SYMINFO_CACHE_FRESH_TIMEOUT",
+    default="600",
+    parser=int,
+    doc=(
+        "Number of seconds the cached result of looking up a code file and code id "
+        "is used as it is. After that, it's refreshed in the background while the "
+        "cached result is still used."
+    ),
+)
+
+SYMINFO_CACHE_TIMEOUT = _config(
+    "SYMINFO_CACHE_TIMEOUT",
+    default=str(60 * 60 * 24),
+    parser=int,
+    doc=(
+        "Number of seconds the result of looking up a code file and code id is kept "
+        "in the cache for refreshing it in the background. After that, it's looked "
+        "up again while the client waits."
+    ),
+)
+
+SYMINFO_NEGATIVE_CACHE_FRESH_TIMEOUT = _config(
+    "SYMINFO_NEGATIVE_CACHE_FRESH_TIMEOUT",
+    default="60",
+    parser=int,
+    doc=(
+        "Like SYMINFO_CACHE_FRESH_TIMEOUT, but for code files and code ids that "
+        "weren't found."
+    ),
+)
+
+SYMINFO_NEGATIVE_CACHE_TIMEOUT = _config(
+    "SYMINFO_NEGATIVE_CACHE_TIMEOUT",
+    default="600",
+    parser=int,
+    doc=(
+        "Like SYMINFO_CACHE_TIMEOUT, but for code files and code ids that weren't "
+        "found. Uploading a file evicts the cached result for its code file and code "
+        "id."
+    ),
+)
+
+DOWNLOAD_HIT_CACHE_MAX_AGE = _config(
+    "DOWNLOAD_HIT_CACHE_MAX_AGE",
+    default=str(60 * 60 * 24),
+    parser=int,
+    doc=(
+        "The max-age in seconds of the Cache-Control header of redirects to symbols "
+        "files in regular storage. Symbols files are addressed by their debug id, so "
+        "this can be long. Setting this to 0 disables caching."
+    ),
+)
+
+DOWNLOAD_MISS_CACHE_MAX_AGE = _config(
+    "DOWNLOAD_MISS_CACHE_MAX_AGE",
+    default="60",
+    parser=int,
+    doc=(
+        "The max-age in seconds of the Cache-Control header of responses for symbols "
+        "files that weren't found in regular storage. A file uploaded later isn't "
+        "visible to caches for this long. Setting this to 0 disables caching."
+    ),
+)
+
+DOWNLOAD_TRY_HIT_CACHE_MAX_AGE = _config(
+    "DOWNLOAD_TRY_HIT_CACHE_MAX_AGE",
+    default=str(60 * 60),
+    parser=int,
+    doc=(
+        "Like DOWNLOAD_HIT_CACHE_MAX_AGE, but for downloads including try storage. Try "
+        "symbols expire, so this should be shorter."
+    ),
+)
+
+DOWNLOAD_TRY_MISS_CACHE_MAX_AGE = _config(
+    "DOWNLOAD_TRY_MISS_CACHE_MAX_AGE",
+    default="60",
+    parser=int,
+    doc="Like DOWNLOAD_MISS_CACHE_MAX_AGE, but for downloads including try storage.",
+)
+
+DOWNLOAD_SURROGATE_KEYS = _config(
+    "DOWNLOAD_SURROGATE_KEYS",
+    default="false",
+    parser=bool,
+    doc=(
+        "Whether to add a Surrogate-Key header with the symbols file key to download "
+        "responses, so a CDN can purge all cached responses for a key."
+    ),
+)
+
 DOWNLOAD_FILE_EXTENSIONS_ALLOWED = _config(
     "DOWNLOAD_FILE_EXTENSIONS_ALLOWED",
     default=".sym,.dl_,.ex_,.pd_,.dbg.gz,.tar.bz2",
@@ -712,3 +1039,33 @@ UPLOAD_V2_MAX_FILES_PER_REQUEST = _config(
     default="1024",
     doc="The maximum number of files in a upload v2 request.",
 )
+
+UPLOAD_MANIFEST_MAX_FILES = _config(
+    "UPLOAD_MANIFEST_MAX_FILES",
+    parser=int,
+    default="20000",
+    doc=(
+        "The maximum number of files in an upload manifest. Manifests list all members "
+        "of a symbols ZIP file, which often has thousands of them."
+    ),
+)
+
+SYM_HEADER_READ_SIZE = _config(
+    "SYM_HEADER_READ_SIZE",
+    parser=int,
+    default="1024",
+    doc=(
+        "The number of bytes per range read when reading the header of a sym file "
+        "in storage, e.g. when completing a upload v2 request."
+    ),
+)
+
+SYM_HEADER_MAX_READ_SIZE = _config(
+    "SYM_HEADER_MAX_READ_SIZE",
+    parser=int,
+    default="65536",
+    doc=(
+        "The maximum number of bytes read from a sym file in storage when looking "
+        "for the end of its header."
+    ),
+)
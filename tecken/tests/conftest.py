@@ -118,15 +118,15 @@ def clear_gcs_storage(self: GCSStorage):
     """Make sure the GCS bucket exists and delete all files under the prefix."""
     # NOTE(smarnach): This gets patched into GCSStorage as a method. I don't want this to exist in
     # production code, since it should never get called there.
-    client = self._get_client()
-    try:
-        client.create_bucket(self.bucket)
-    except Conflict:
-        # Bucket already exists.
-        pass
-    bucket = self._get_bucket()
-    blobs = bucket.list_blobs(prefix=self.prefix, fields="items(name)")
-    bucket.delete_blobs(list(blobs))
+    with self._get_client() as client:
+        try:
+            client.create_bucket(self.bucket)
+        except Conflict:
+            # Bucket already exists.
+            pass
+        bucket = client.bucket(self.bucket)
+        blobs = bucket.list_blobs(prefix=self.prefix, fields="items(name)")
+        bucket.delete_blobs(list(blobs))
 
 
 GCSStorage.clear = clear_gcs_storage
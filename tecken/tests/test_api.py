@@ -671,6 +671,7 @@ def test_upload(client):
         size=123_456,
         skipped_keys=["foo"],
         ignored_keys=["bar"],
+        timings={"total_ms": 12.5, "files": []},
     )
     FileUpload.objects.create(upload=upload, size=1234, key="foo.sym")
     url = reverse("api:upload", args=(upload.id,))
@@ -687,6 +688,7 @@ def test_upload(client):
     assert result["upload"]["id"] == upload.id
     assert result["upload"]["user"]["email"] == upload.user.email
     assert result["upload"]["related"] == []
+    assert result["upload"]["timings"] == {"total_ms": 12.5, "files": []}
     (first_file_upload,) = result["upload"]["file_uploads"]
     assert first_file_upload["size"] == 1234
 
@@ -31,3 +31,18 @@ def test_invalid_keys(key):
 )
 def test_valid_keys(key):
     assert utils.validate_key(key)
+
+
+@pytest.mark.parametrize(
+    "allowed_hosts, expected",
+    [
+        (["web", "localhost"], "web"),
+        ([".example.com"], "example.com"),
+        (["*", "web"], "web"),
+        (["*"], "localhost"),
+        ([], "localhost"),
+    ],
+)
+def test_allowed_host(settings, allowed_hosts, expected):
+    settings.ALLOWED_HOSTS = allowed_hosts
+    assert utils.allowed_host() == expected
@@ -2,15 +2,23 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from concurrent.futures import ThreadPoolExecutor
+import datetime
+from io import StringIO
 import os
+import threading
+import time
 from urllib.parse import urlparse
 
+from django.core.cache import cache
+from django.core.management import call_command
 from django.urls import reverse
+from django.utils import timezone
 import requests
 
 from tecken.download import views
 from tecken.tests.utils import UPLOADS
-from tecken.upload.models import FileUpload
+from tecken.upload.models import FileUpload, Upload
 
 import pytest
 
@@ -373,3 +381,412 @@ def test_head_code_id_lookup(client, db, metricsmock, symbol_storage):
 )
 def test_is_maybe_codeinfo(metricsmock, params, expected):
     assert views.is_maybe_codeinfo(*params) == expected
+
+
+def test_client_optimistic_redirect(client, db, symbol_storage, metricsmock, settings):
+    settings.DOWNLOAD_OPTIMISTIC_REDIRECT = True
+    upload = UPLOADS["ssltunnel/8A07C88A3DA44E20A3490D88791183060/ssltunnel.sym"]
+    upload.upload(symbol_storage)
+    url = reverse(
+        "download:download_symbol",
+        args=(upload.debug_file, upload.debug_id, upload.sym_file),
+    )
+    backend = symbol_storage.get_upload_backend(False)
+    public_url = backend.get_public_download_url(upload.key)
+
+    # The first download looks up the file in storage, unless the backend has a public
+    # URL and the file is known to exist.
+    response = client.get(url)
+    assert response.status_code == 302
+    metricsmock.clear_records()
+
+    response = client.get(url)
+    assert response.status_code == 302
+    if public_url:
+        assert response["location"] == public_url
+        metricsmock.assert_incr(
+            "tecken.download_optimistic_redirect", tags=["result:hit", "host:testnode"]
+        )
+        metricsmock.assert_not_timing("tecken.symboldownloader_exists")
+    else:
+        metricsmock.assert_not_incr("tecken.download_optimistic_redirect")
+        metricsmock.assert_timing("tecken.symboldownloader_exists")
+
+
+def test_client_optimistic_redirect_unknown(
+    client, db, symbol_storage, metricsmock, settings
+):
+    settings.DOWNLOAD_OPTIMISTIC_REDIRECT = True
+    upload = UPLOADS["ssltunnel/8A07C88A3DA44E20A3490D88791183060/ssltunnel.sym"]
+    url = reverse(
+        "download:download_symbol",
+        args=(upload.debug_file, upload.debug_id, upload.sym_file),
+    )
+
+    # Files that aren't known to exist are looked up in storage.
+    response = client.get(url)
+    assert response.status_code == 404
+    metricsmock.assert_timing("tecken.symboldownloader_exists")
+
+
+def test_client_cache_headers(client, db, symbol_storage, settings):
+    settings.DOWNLOAD_HIT_CACHE_MAX_AGE = 1000
+    settings.DOWNLOAD_MISS_CACHE_MAX_AGE = 10
+    settings.DOWNLOAD_TRY_HIT_CACHE_MAX_AGE = 100
+    settings.DOWNLOAD_TRY_MISS_CACHE_MAX_AGE = 0
+    upload = UPLOADS["ssltunnel/8A07C88A3DA44E20A3490D88791183060/ssltunnel.sym"]
+    upload.upload(symbol_storage)
+    url = reverse(
+        "download:download_symbol",
+        args=(upload.debug_file, upload.debug_id, upload.sym_file),
+    )
+    not_found_url = reverse(
+        "download:download_symbol",
+        args=("xil.pdb", "55F4EC8C2F41492B9369D6B9A059577A1", "xil.sym"),
+    )
+
+    response = client.get(url)
+    assert response.status_code == 302
+    assert response["Cache-Control"] == "public, max-age=1000"
+    assert "Surrogate-Key" not in response
+    response = client.head(url)
+    assert response.status_code == 200
+    assert response["Cache-Control"] == "public, max-age=1000"
+    response = client.get(url, {"try": 1})
+    assert response["Cache-Control"] == "public, max-age=100"
+
+    response = client.get(not_found_url)
+    assert response.status_code == 404
+    assert response["Cache-Control"] == "public, max-age=10"
+    response = client.get(not_found_url, {"try": 1})
+    assert response["Cache-Control"] == "no-cache"
+
+    # Responses with debug information aren't cached.
+    response = client.get(url, HTTP_DEBUG="true")
+    assert "Cache-Control" not in response
+
+
+def test_client_surrogate_key(client, db, symbol_storage, settings):
+    settings.DOWNLOAD_SURROGATE_KEYS = True
+    upload = UPLOADS["ssltunnel/8A07C88A3DA44E20A3490D88791183060/ssltunnel.sym"]
+    upload.upload(symbol_storage)
+    url = reverse(
+        "download:download_symbol",
+        args=(upload.debug_file, upload.debug_id, upload.sym_file),
+    )
+
+    response = client.get(url)
+    assert response.status_code == 302
+    assert response["Surrogate-Key"] == upload.key
+
+
+def test_client_conditional_request(client, db, symbol_storage):
+    upload = UPLOADS["ssltunnel/8A07C88A3DA44E20A3490D88791183060/ssltunnel.sym"]
+    upload.upload(symbol_storage)
+    url = reverse(
+        "download:download_symbol",
+        args=(upload.debug_file, upload.debug_id, upload.sym_file),
+    )
+
+    response = client.get(url)
+    assert response.status_code == 302
+    etag = response["ETag"]
+
+    response = client.get(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+    assert response["ETag"] == etag
+    assert "Cache-Control" in response
+    response = client.head(url, HTTP_IF_NONE_MATCH=etag)
+    assert response.status_code == 304
+
+    response = client.get(url, HTTP_IF_NONE_MATCH='"something-else"')
+    assert response.status_code == 302
+
+
+def test_single_flight_concurrent_calls(settings, metricsmock):
+    settings.DOWNLOAD_SINGLE_FLIGHT = True
+    calls = []
+    started = threading.Event()
+    release = threading.Event()
+
+    def lookup(value):
+        calls.append(value)
+        started.set()
+        release.wait(5)
+        return value * 2
+
+    with ThreadPoolExecutor(max_workers=5) as pool:
+        leader = pool.submit(views.single_flight, "key", lookup, 21)
+        started.wait(5)
+        waiters = [
+            pool.submit(views.single_flight, "key", lookup, 21) for _ in range(4)
+        ]
+        # Give the waiters a moment to join the lookup in flight.
+        time.sleep(0.1)
+        release.set()
+        results = [leader.result()] + [waiter.result() for waiter in waiters]
+
+    assert results == [42] * 5
+    assert calls == [21]
+    records = metricsmock.filter_records("incr", stat="tecken.download_single_flight")
+    assert len(records) == 4
+    assert views._FLIGHTS == {}
+
+
+def test_single_flight_failure(settings, metricsmock):
+    settings.DOWNLOAD_SINGLE_FLIGHT = True
+    started = threading.Event()
+    release = threading.Event()
+
+    def lookup():
+        started.set()
+        release.wait(5)
+        raise ValueError("failed")
+
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        leader = pool.submit(views.single_flight, "key", lookup)
+        started.wait(5)
+        waiter = pool.submit(views.single_flight, "key", lambda: "ok")
+        # Give the waiter a moment to join the lookup in flight.
+        time.sleep(0.1)
+        release.set()
+        with pytest.raises(ValueError):
+            leader.result()
+        # The waiter does its own lookup.
+        assert waiter.result() == "ok"
+    assert views._FLIGHTS == {}
+    metricsmock.assert_incr(
+        "tecken.download_single_flight", tags=["result:failed", "host:testnode"]
+    )
+    # The next call does its own lookup.
+    assert views.single_flight("key", lambda: "ok") == "ok"
+
+
+def test_single_flight_disabled(settings):
+    settings.DOWNLOAD_SINGLE_FLIGHT = False
+    assert views.single_flight("key", lambda: "ok") == "ok"
+    assert views._FLIGHTS == {}
+
+
+def test_single_flight_shared(settings, metricsmock):
+    settings.DOWNLOAD_SINGLE_FLIGHT = True
+    settings.DOWNLOAD_SINGLE_FLIGHT_SHARED = True
+    settings.DOWNLOAD_SINGLE_FLIGHT_TIMEOUT = 1
+
+    # No other process has the lookup in flight.
+    assert views.single_flight("key", lambda: "mine") == "mine"
+    assert cache.get("single_flight_lock::key") is None
+
+    # Another process has the lookup in flight and stored its result, possibly None.
+    cache.set("single_flight_lock::key", True)
+    cache.set("single_flight_result::key", [None])
+    assert views.single_flight("key", lambda: "mine") is None
+    metricsmock.assert_incr(
+        "tecken.download_single_flight", tags=["result:shared", "host:testnode"]
+    )
+
+    # The other process doesn't finish in time.
+    cache.delete("single_flight_result::key")
+    assert views.single_flight("key", lambda: "mine") == "mine"
+    metricsmock.assert_incr(
+        "tecken.download_single_flight", tags=["result:timeout", "host:testnode"]
+    )
+
+    # The lookup of the other process failed, so there's no need to wait.
+    metricsmock.clear_records()
+    cache.set("single_flight_result::key", [])
+    start = time.monotonic()
+    assert views.single_flight("key", lambda: "mine") == "mine"
+    assert time.monotonic() - start < 0.5
+    metricsmock.assert_incr(
+        "tecken.download_single_flight", tags=["result:failed", "host:testnode"]
+    )
+
+
+def test_single_flight_shared_failure(settings):
+    settings.DOWNLOAD_SINGLE_FLIGHT = True
+    settings.DOWNLOAD_SINGLE_FLIGHT_SHARED = True
+
+    def lookup():
+        raise ValueError("failed")
+
+    with pytest.raises(ValueError):
+        views.single_flight("key", lookup)
+    # The failure is stored for the other processes waiting for the lookup.
+    assert cache.get("single_flight_result::key") == []
+    assert cache.get("single_flight_lock::key") is None
+
+
+def test_prewarm_syminfo_cache(client, db, metricsmock, symbol_storage):
+    upload = UPLOADS["ssltunnel/8A07C88A3DA44E20A3490D88791183060/ssltunnel.sym"]
+    upload.upload(symbol_storage)
+    upload_obj = Upload(size=100, try_symbols=True)
+    file_uploads = [
+        FileUpload(key="flag/deadbeef/flag.jpeg", size=100),
+        FileUpload(
+            upload=upload_obj,
+            key=upload.key,
+            size=100,
+            debug_filename=upload.debug_file,
+            debug_id=upload.debug_id,
+            code_file="ssltunnel.exe",
+            code_id="651C9AF99241000",
+        ),
+    ]
+    assert views.prewarm_syminfo_cache(file_uploads) == 1
+
+    # The lookup is served from the cache, even though there's no fileupload record.
+    url = reverse(
+        "download:download_symbol_try",
+        args=("ssltunnel.exe", "651C9AF99241000", upload.sym_file),
+    )
+    response = client.get(url)
+    assert response.status_code == 302
+    parsed = urlparse(response["location"])
+    assert (
+        parsed.path == f"/try/{upload.debug_file}/{upload.debug_id}/{upload.sym_file}"
+    )
+    metricsmock.assert_incr(
+        "tecken.syminfo.lookup.cached", tags=["result:true", "host:testnode"]
+    )
+
+
+def test_cached_lookup_by_syminfo_stale(db, metricsmock, settings):
+    settings.SYMINFO_CACHE_FRESH_TIMEOUT = 0
+    FileUpload.objects.create(
+        bucket_name="publicbucket",
+        key="xul.pdb/44E4EC8C2F41492B9369D6B9A059577C2/xul.sym",
+        size=100,
+        debug_filename="xul.pdb",
+        debug_id="44E4EC8C2F41492B9369D6B9A059577C2",
+        code_file="xul.dll",
+        code_id="5E4B3A5B2A1000",
+        created_at=timezone.now(),
+    )
+    data = views.cached_lookup_by_syminfo("xul.dll", "5E4B3A5B2A1000")
+    assert data["debug_filename"] == "xul.pdb"
+    metricsmock.assert_incr(
+        "tecken.syminfo.lookup.cached", tags=["result:false", "host:testnode"]
+    )
+
+    # The stale result is returned and refreshed. The executor runs synchronously in
+    # tests, so the refreshed result is in the cache right away.
+    FileUpload.objects.filter(code_file="xul.dll").update(debug_filename="xul2.pdb")
+    metricsmock.clear_records()
+    data = views.cached_lookup_by_syminfo("xul.dll", "5E4B3A5B2A1000")
+    assert data["debug_filename"] == "xul.pdb"
+    metricsmock.assert_incr(
+        "tecken.syminfo.lookup.cached", tags=["result:stale", "host:testnode"]
+    )
+    entry = cache.get(views._syminfo_cache_key("xul.dll", "5E4B3A5B2A1000"))
+    assert entry["data"]["debug_filename"] == "xul2.pdb"
+
+    # Stale results are only refreshed once at a time.
+    FileUpload.objects.filter(code_file="xul.dll").update(debug_filename="xul3.pdb")
+    data = views.cached_lookup_by_syminfo("xul.dll", "5E4B3A5B2A1000")
+    assert data["debug_filename"] == "xul2.pdb"
+    entry = cache.get(views._syminfo_cache_key("xul.dll", "5E4B3A5B2A1000"))
+    assert entry["data"]["debug_filename"] == "xul2.pdb"
+
+
+def test_cached_lookup_by_syminfo_negative_timeouts(db, settings):
+    settings.SYMINFO_NEGATIVE_CACHE_FRESH_TIMEOUT = 10
+    settings.SYMINFO_NEGATIVE_CACHE_TIMEOUT = 20
+    key = views._syminfo_cache_key("xul.dll", "5E4B3A5B2A1000")
+    before = time.time()
+    assert views.cached_lookup_by_syminfo("xul.dll", "5E4B3A5B2A1000") is None
+    entry = cache.get(key)
+    assert entry["data"] is None
+    assert before + 10 <= entry["fresh_until"] <= time.time() + 10
+    assert 19 <= cache.ttl(key) <= 20
+
+
+def test_evict_syminfo_cache(db):
+    assert views.cached_lookup_by_syminfo("xul.dll", "5E4B3A5B2A1000") is None
+    key = views._syminfo_cache_key("xul.dll", "5E4B3A5B2A1000")
+    assert cache.get(key) is not None
+
+    file_uploads = [
+        FileUpload(key="flag/deadbeef/flag.jpeg", size=100),
+        FileUpload(
+            key="xul.pdb/44E4EC8C2F41492B9369D6B9A059577C2/xul.sym",
+            size=100,
+            code_file="xul.dll",
+            code_id="5E4B3A5B2A1000",
+        ),
+    ]
+    views.evict_syminfo_cache(file_uploads)
+    assert cache.get(key) is None
+
+
+def test_prewarmdownloadcaches(client, db, metricsmock, symbol_storage, settings):
+    settings.DOWNLOAD_OPTIMISTIC_REDIRECT = True
+    upload = UPLOADS["ssltunnel/8A07C88A3DA44E20A3490D88791183060/ssltunnel.sym"]
+    upload.upload(symbol_storage)
+    # Only uploading records the file as known to exist, so start from scratch.
+    cache.clear()
+    FileUpload.objects.create(
+        bucket_name="publicbucket",
+        key=upload.key,
+        size=100,
+        debug_filename=upload.debug_file,
+        debug_id=upload.debug_id,
+        code_file="ssltunnel.exe",
+        code_id="651C9AF99241000",
+        created_at=timezone.now(),
+    )
+    FileUpload.objects.create(
+        bucket_name="publicbucket",
+        key="missing.pdb/0000000000000000000000000000000A1/missing.sym",
+        size=100,
+        created_at=timezone.now(),
+    )
+    FileUpload.objects.create(
+        bucket_name="publicbucket",
+        key="old.pdb/0000000000000000000000000000000A1/old.sym",
+        size=100,
+        created_at=timezone.now() - datetime.timedelta(days=30),
+    )
+
+    stdout = StringIO()
+    call_command("prewarmdownloadcaches", stdout=stdout)
+    assert ">>> keys=2, found=1, missing=1, syminfo=1" in stdout.getvalue()
+    metricsmock.assert_timing("tecken.prewarmdownloadcaches.timing")
+
+    metricsmock.clear_records()
+    response = client.get(
+        reverse(
+            "download:download_symbol",
+            args=("ssltunnel.exe", "651C9AF99241000", upload.sym_file),
+        )
+    )
+    assert response.status_code == 302
+    metricsmock.assert_incr(
+        "tecken.syminfo.lookup.cached", tags=["result:true", "host:testnode"]
+    )
+
+    backend = symbol_storage.get_upload_backend(False)
+    if backend.get_public_download_url(upload.key):
+        response = client.get(
+            reverse(
+                "download:download_symbol",
+                args=(upload.debug_file, upload.debug_id, upload.sym_file),
+            )
+        )
+        assert response.status_code == 302
+        metricsmock.assert_incr(
+            "tecken.download_optimistic_redirect", tags=["result:hit", "host:testnode"]
+        )
+
+
+def test_benchmark_download(db, symbol_storage, settings):
+    # Outside the tests, "testserver" isn't an allowed host.
+    settings.ALLOWED_HOSTS = ["web", "localhost"]
+    stdout = StringIO()
+    call_command("benchmark_download", files=3, requests=50, stdout=stdout)
+    output = stdout.getvalue()
+    assert "benchmark_download: 50 requests, 3 files, concurrency 1" in output
+    for outcome in ("hit", "miss", "code_id", "try_hit", "try_miss"):
+        assert f">>> {outcome}: requests=" in output
+    assert output.count(" errors=0 ") == 5
+    assert ">>> total: requests=50 " in output
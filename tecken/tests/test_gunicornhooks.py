@@ -14,3 +14,10 @@ def test_worker_abort_emits_metric(metricsmock):
     metricsmock.assert_incr(
         "tecken.gunicorn_worker_abort", value=1, tags=["host:testnode"]
     )
+
+
+def test_post_worker_init_warms_up_storage(symbol_storage):
+    gunicornhooks.post_worker_init(None)
+
+    for backend in symbol_storage.backends:
+        assert backend.client_pool.idle.qsize() == backend.client_pool.size
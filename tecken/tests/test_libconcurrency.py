@@ -0,0 +1,123 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import threading
+
+import pytest
+
+from tecken.libconcurrency import AIMDLimiter, Overloaded
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    fake_clock = FakeClock()
+    monkeypatch.setattr("tecken.libconcurrency.time.monotonic", fake_clock)
+    return fake_clock
+
+
+def test_limiter_grows_while_saturated(clock, metricsmock):
+    limiter = AIMDLimiter("test", initial_limit=2, max_limit=3)
+    for _ in range(4):
+        with limiter.limit(), limiter.limit():
+            clock.now += 0.1
+    assert limiter.current_limit == 3
+    assert limiter.in_flight == 0
+    assert limiter.state() == {"limit": 3, "in_flight": 0, "average_latency_ms": 100.0}
+
+    records = metricsmock.filter_records(
+        "gauge", stat="tecken.storage_concurrency_limit"
+    )
+    assert [record.value for record in records] == [2, 3]
+    assert records[0].tags[0] == "limiter:test"
+
+
+def test_limiter_doesnt_grow_unused_limit(clock):
+    limiter = AIMDLimiter("test", initial_limit=4, max_limit=10)
+    for _ in range(20):
+        with limiter.limit():
+            clock.now += 0.1
+    assert limiter.current_limit == 4
+
+
+def test_limiter_backs_off_on_overload(clock, metricsmock):
+    limiter = AIMDLimiter(
+        "test", initial_limit=10, max_limit=10, overload_exceptions=(ValueError,)
+    )
+    with pytest.raises(ValueError):
+        with limiter.limit():
+            raise ValueError("slow down")
+    assert limiter.current_limit == 9
+    clock.now += 1
+    with pytest.raises(Overloaded):
+        with limiter.limit():
+            raise Overloaded()
+    assert limiter.current_limit == 8
+    # Other errors don't make the limiter back off.
+    with pytest.raises(KeyError):
+        with limiter.limit():
+            raise KeyError("missing")
+    assert limiter.current_limit == 8
+    assert limiter.in_flight == 0
+
+    records = metricsmock.filter_records(
+        "incr", stat="tecken.storage_concurrency_backoff"
+    )
+    assert len(records) == 2
+    assert all(record.tags[1] == "reason:overload" for record in records)
+
+
+def test_limiter_backs_off_once_on_latency_spike(clock, metricsmock):
+    limiter = AIMDLimiter("test", initial_limit=10, max_limit=10)
+    for _ in range(5):
+        with limiter.limit():
+            clock.now += 0.1
+
+    # All calls in flight during the spike only back off once.
+    started = [limiter.acquire() for _ in range(5)]
+    clock.now += 1
+    for started_at in started:
+        limiter.release(started_at)
+    assert limiter.current_limit == 9
+    records = metricsmock.filter_records(
+        "incr", stat="tecken.storage_concurrency_backoff"
+    )
+    assert [record.tags[1] for record in records] == ["reason:latency"]
+
+    # Slow calls that don't track latency don't back off.
+    with limiter.limit(track_latency=False):
+        clock.now += 10
+    assert limiter.current_limit == 9
+
+
+def test_limiter_min_limit(clock):
+    limiter = AIMDLimiter("test", initial_limit=1, max_limit=10)
+    with pytest.raises(Overloaded):
+        with limiter.limit():
+            raise Overloaded()
+    assert limiter.current_limit == 1
+
+
+def test_limiter_blocks_at_limit():
+    limiter = AIMDLimiter("test", initial_limit=1, max_limit=1)
+    entered = threading.Event()
+
+    def call():
+        with limiter.limit():
+            entered.set()
+
+    with limiter.limit():
+        thread = threading.Thread(target=call)
+        thread.start()
+        assert not entered.wait(0.1)
+    assert entered.wait(5)
+    thread.join()
+    assert limiter.in_flight == 0
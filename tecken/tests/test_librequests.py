@@ -0,0 +1,79 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tecken import librequests
+from tecken.librequests import (
+    PooledHTTPAdapter,
+    default_pool_maxsize,
+    pooled_session,
+    session_with_retries,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_sessions():
+    librequests._reset_sessions()
+    yield
+    librequests._reset_sessions()
+
+
+def test_session_with_retries_is_new_every_time():
+    assert session_with_retries() is not session_with_retries()
+
+
+def test_pooled_session_is_shared(metricsmock):
+    session = pooled_session()
+    assert pooled_session() is session
+    assert pooled_session(default_timeout=(5, 300)) is not session
+
+    records = metricsmock.filter_records("incr", stat="tecken.requests_session_pool")
+    assert [record.tags[0] for record in records] == [
+        "result:miss",
+        "result:hit",
+        "result:miss",
+    ]
+
+
+def test_pooled_session_threads():
+    with ThreadPoolExecutor(max_workers=8) as pool:
+        sessions = list(pool.map(lambda _: pooled_session(), range(32)))
+    assert all(session is sessions[0] for session in sessions)
+
+
+def test_pooled_session_pool_size(settings):
+    settings.HTTP_POOL_CONNECTIONS = 3
+    settings.HTTP_POOL_MAXSIZE = 7
+    adapter = pooled_session().get_adapter("https://example.com/")
+    assert isinstance(adapter, PooledHTTPAdapter)
+    assert adapter._pool_connections == 3
+    assert adapter._pool_maxsize == 7
+
+
+def test_default_pool_maxsize(settings):
+    settings.HTTP_POOL_MAXSIZE = 0
+    settings.UPLOAD_FILE_UPLOAD_MAX_WORKERS = 20
+    settings.UPLOAD_BY_DOWNLOAD_CONNECTIONS = 4
+    assert default_pool_maxsize() == 20
+    settings.UPLOAD_BY_DOWNLOAD_CONNECTIONS = 50
+    assert default_pool_maxsize() == 50
+
+
+def test_pooled_session_ignores_cookies(requestsmock):
+    requestsmock.get(
+        "https://example.com/", text="ok", headers={"Set-Cookie": "secret=1; Path=/"}
+    )
+    session = pooled_session()
+    session.get("https://example.com/")
+    assert not session.cookies
+
+
+def test_pooled_session_reset_after_fork():
+    session = pooled_session()
+    # This is what happens in a child process after a fork.
+    librequests._reset_sessions()
+    assert pooled_session() is not session
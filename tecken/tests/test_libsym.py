@@ -2,9 +2,16 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+import gzip
+
 import pytest
 
-from tecken.libsym import extract_sym_header_data, SymParseError
+from tecken.libsym import (
+    extract_sym_header_data,
+    extract_sym_header_data_from_bytes,
+    read_sym_header,
+    SymParseError,
+)
 
 
 class Test_extract_sym_header_data:
@@ -118,3 +125,70 @@ PUBLIC 1020 0 <.plt ELF section in basic.dbg>
         )
         with pytest.raises(SymParseError):
             extract_sym_header_data(str(sym_path))
+
+
+class Test_extract_sym_header_data_from_bytes:
+    HEAD = b"""\
+MODULE windows x86_64 A7B74D36BC7FECE04C4C44205044422E1 js.pdb
+INFO CODE_ID 66BCC3E020DC000 js.exe
+INFO GENERATOR mozilla/dump_syms 2.3.3
+FILE 0 hg:hg.mozilla.org/releases/mozilla-beta:build/pure_virtual/pure_virtual.c:2107f27bbb2a2d2adc4cd4a4ae9bed8234b88d5d
+"""
+
+    def test_header(self):
+        data = extract_sym_header_data_from_bytes(self.HEAD)
+        assert data == {
+            "debug_filename": "js.pdb",
+            "debug_id": "A7B74D36BC7FECE04C4C44205044422E1",
+            "code_file": "js.exe",
+            "code_id": "66BCC3E020DC000",
+            "generator": "mozilla/dump_syms 2.3.3",
+        }
+
+    def test_truncated_line_is_ignored(self):
+        """Verify a header line cut off at the end of the bytes isn't parsed"""
+        head = self.HEAD[: self.HEAD.index(b"66BCC3E0") + 4]
+        data = extract_sym_header_data_from_bytes(head)
+        assert data == {
+            "debug_filename": "js.pdb",
+            "debug_id": "A7B74D36BC7FECE04C4C44205044422E1",
+            "code_file": "",
+            "code_id": "",
+            "generator": "",
+        }
+
+    def test_sym_parse_error(self):
+        with pytest.raises(SymParseError):
+            extract_sym_header_data_from_bytes(b"MODULE Linux x86_64\nFILE 0 a.c\n")
+
+
+class Test_read_sym_header:
+    SYM = b"""\
+MODULE Linux x86_64 20AD60B0B4C68177552708AA192E77390 basic.full
+INFO CODE_ID B060AD20C6B47781552708AA192E7739FAC7C84A
+FILE 0 /home/calixte/dev/mozilla/dump_syms.calixteman/test_data/linux/basic.cpp
+PUBLIC 1000 0 _init
+"""
+    HEAD = SYM[: SYM.index(b"PUBLIC")]
+
+    @staticmethod
+    def chunked(data, size, consumed):
+        for i in range(0, len(data), size):
+            consumed.append(i)
+            yield data[i : i + size]
+
+    @pytest.mark.parametrize("compress", [False, True])
+    def test_stops_after_header(self, compress):
+        data = gzip.compress(self.SYM * 1000) if compress else self.SYM * 1000
+        consumed = []
+        head = read_sym_header(self.chunked(data, 16, consumed))
+        assert head == self.HEAD
+        # Only the chunks up to the end of the header were read
+        assert len(consumed) < len(data) // 16
+
+    def test_no_end_of_header(self):
+        assert read_sym_header([self.HEAD[:30], self.HEAD[30:60]]) == self.HEAD[:60]
+
+    def test_bad_gzip(self):
+        with pytest.raises(SymParseError):
+            read_sym_header([b"\x1f\x8bnot gzip data"])
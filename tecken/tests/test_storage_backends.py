@@ -2,12 +2,22 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
-from datetime import datetime
+from datetime import datetime, timezone
+from io import StringIO
 from urllib.parse import urlparse
 
+from django.core.management import call_command
 import pytest
 import requests
 
+from tecken.ext.gcs.storage import (
+    ClientPool,
+    get_client_pool,
+    get_concurrency_limiter,
+)
+from tecken.management.commands.benchmark_metadata import (
+    get_object_metadata_from_blob,
+)
 from tecken.libstorage import StorageError
 from tecken.tests.utils import Upload, UPLOADS
 
@@ -73,3 +83,148 @@ def test_download_url(bucket_name: str, get_storage_backend, storage_kind: str):
     bucket, _, key = parsed_url.path[1:].partition("/")
     assert bucket == bucket_name
     assert key == "v1/c%2B%2Bfilt/B2E65520F14FB5332E38A5A5189839AD0/c%2B%2Bfilt.sym"
+
+
+@pytest.mark.parametrize("storage_kind", ["gcs", "gcs-cdn"])
+def test_read_range(get_storage_backend, storage_kind: str):
+    backend = get_storage_backend(storage_kind)
+    backend.clear()
+    upload = UPLOADS["ShowSSEConfig.exe/6A4B9A365000/ShowSSEConfig.sym"]
+    upload.upload_to_backend(backend)
+
+    # The bytes are returned as stored, i.e. gzip-compressed.
+    assert backend.read_range(upload.key, 0, 100) == upload.body[:100]
+    assert backend.read_range(upload.key, 10, 20) == upload.body[10:30]
+    assert backend.read_range(upload.key, 0, len(upload.body) + 100) == upload.body
+    assert backend.read_range("does/not/exist", 0, 100) is None
+
+
+@pytest.mark.parametrize("storage_kind", ["gcs", "gcs-cdn"])
+def test_copy(get_storage_backend, storage_kind: str):
+    backend = get_storage_backend(storage_kind)
+    backend.clear()
+    upload = UPLOADS["ShowSSEConfig.exe/6A4B9A365000/ShowSSEConfig.sym"]
+    upload.upload_to_backend(backend)
+    original_size = len(upload.original_body)
+
+    assert backend.copy(
+        upload.key,
+        "copy/AAAA/copy.sym",
+        upload.metadata,
+        upload.md5_sum(),
+        original_size,
+    )
+    assert backend.read_range("copy/AAAA/copy.sym", 0, len(upload.body)) == upload.body
+    metadata = backend.get_object_metadata("copy/AAAA/copy.sym")
+    assert metadata.original_md5_sum == upload.md5_sum()
+    assert metadata.original_content_length == original_size
+
+    # The source object isn't copied if it doesn't have the expected content.
+    assert not backend.copy(
+        upload.key, "copy/BBBB/copy.sym", upload.metadata, "0" * 32, original_size
+    )
+    assert not backend.copy(
+        upload.key, "copy/BBBB/copy.sym", upload.metadata, upload.md5_sum(), 1
+    )
+    assert not backend.copy(
+        "does/not/exist", "copy/BBBB/copy.sym", upload.metadata, upload.md5_sum(), 1
+    )
+    assert backend.get_object_metadata("copy/BBBB/copy.sym") is None
+
+
+def test_client_pool(metricsmock):
+    pool = ClientPool(endpoint_url=None, size=2)
+    pool.warm_up()
+    assert pool.idle.qsize() == 2
+
+    with pool.checkout() as client1, pool.checkout() as client2:
+        assert client1 is not client2
+        # All clients share the same credentials.
+        assert client1._credentials is client2._credentials
+        with pool.checkout() as client3:
+            assert client3 not in (client1, client2)
+    # Only as many idle clients as the size of the pool are kept.
+    assert pool.idle.qsize() == 2
+
+    records = metricsmock.filter_records("incr", stat="tecken.storage_client_pool")
+    assert [record.tags[0] for record in records] == [
+        "result:hit",
+        "result:hit",
+        "result:miss",
+    ]
+
+
+def test_client_pool_shared(get_storage_backend):
+    backend = get_storage_backend("gcs")
+    try_backend = get_storage_backend("gcs", try_symbols=True)
+    assert backend.client_pool is try_backend.client_pool
+    assert backend.client_pool is get_client_pool(None)
+
+
+def test_adaptive_concurrency(get_storage_backend, settings, metricsmock):
+    settings.STORAGE_ADAPTIVE_CONCURRENCY = True
+    backend = get_storage_backend("gcs")
+    backend.clear()
+    upload = UPLOADS["c++filt/B2E65520F14FB5332E38A5A5189839AD0/c++filt.sym"]
+    upload.upload_to_backend(backend)
+    assert backend.get_object_metadata(upload.key) is not None
+    assert backend.get_object_metadata("missing/key") is None
+
+    limiter = get_concurrency_limiter(backend.endpoint_url)
+    assert limiter.in_flight == 0
+    assert limiter.average_latency is not None
+
+
+@pytest.mark.parametrize("upload", UPLOADS.values(), ids=UPLOADS.keys())
+@pytest.mark.parametrize("storage_kind", ["gcs", "gcs-cdn"])
+def test_get_object_metadata_matches_blob(
+    get_storage_backend, storage_kind: str, upload: Upload
+):
+    backend = get_storage_backend(storage_kind)
+    backend.clear()
+    upload.upload_to_backend(backend)
+
+    metadata = backend.get_object_metadata(upload.key)
+    assert metadata == get_object_metadata_from_blob(backend, upload.key)
+    assert backend.get_object_metadata("missing/key") is None
+
+
+def test_get_object_metadata_projection(get_storage_backend, requestsmock):
+    backend = get_storage_backend("gcs")
+    url = (
+        f"{backend._default_endpoint_url()}/storage/v1/b/{backend.bucket}/o/"
+        "v1%2Fxul.pdb%2FABCD%2Fxul.sym"
+    )
+    requestsmock.get(
+        url,
+        json={
+            "size": "100",
+            "md5Hash": "XUFAKrxLKna5cZ2REBfFkg==",
+            "contentType": "text/plain",
+            "updated": "2024-05-06T07:08:09.123Z",
+        },
+    )
+    metadata = backend.get_object_metadata("xul.pdb/ABCD/xul.sym")
+    assert requestsmock.last_request.qs["fields"] == [
+        "size,md5hash,contenttype,contentencoding,metadata,customtime,updated"
+    ]
+    assert metadata.content_length == 100
+    assert metadata.original_content_length == 100
+    assert metadata.original_md5_sum == "5d41402abc4b2a76b9719d911017c592"
+    assert metadata.content_type == "text/plain"
+    assert metadata.last_modified == datetime(
+        2024, 5, 6, 7, 8, 9, 123000, tzinfo=timezone.utc
+    )
+
+    requestsmock.get(url, status_code=403, json={"error": {"message": "Forbidden"}})
+    with pytest.raises(StorageError):
+        backend.get_object_metadata("xul.pdb/ABCD/xul.sym")
+
+
+def test_benchmark_metadata(symbol_storage):
+    stdout = StringIO()
+    call_command("benchmark_metadata", iterations=3, stdout=stdout)
+    output = stdout.getvalue()
+    assert ">>> projection: mean=" in output
+    assert ">>> blob: mean=" in output
+    assert ">>> speedup: " in output
@@ -24,3 +24,20 @@ def test_get_metadata_non_existing(symbol_storage):
     assert not symbol_storage.get_metadata(
         "xxx.pdb/44E4EC8C2F41492B9369D6B9A059577C2/xxx.sym"
     )
+
+
+def test_get_all_metadata(symbol_storage):
+    upload = UPLOADS["c++filt/B2E65520F14FB5332E38A5A5189839AD0/c++filt.sym"]
+    upload.upload(symbol_storage)
+    upload.upload(symbol_storage, try_storage=True)
+
+    found = symbol_storage.get_all_metadata(upload.key, try_storage=True)
+    assert [backend for backend, _ in found] == [
+        symbol_storage.upload_backend,
+        symbol_storage.try_upload_backend,
+    ]
+    assert all(metadata.content_length == len(upload.body) for _, metadata in found)
+
+    found = symbol_storage.get_all_metadata(upload.key)
+    assert [backend for backend, _ in found] == [symbol_storage.upload_backend]
+    assert symbol_storage.get_all_metadata("xxx.pdb/44E4EC8C2F4/xxx.sym") == []
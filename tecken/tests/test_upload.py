@@ -7,6 +7,7 @@ from io import BufferedReader, BytesIO, StringIO
 import logging
 import os
 from unittest import mock
+import zipfile
 
 from google.cloud import iam_credentials
 from markus.testing import AnyTagValue
@@ -15,12 +16,14 @@ from requests.exceptions import ConnectionError, RetryError
 
 from django.contrib.auth.models import Permission
 from django.core.management import call_command
+from django.db import connection
 from django.urls import reverse
 from django.utils import timezone
 
 from tecken.libstorage import ObjectMetadata, StorageBackend, StorageError
+from tecken.tests.utils import UPLOADS
 from tecken.tokens.models import Token
-from tecken.upload import client_otel, utils
+from tecken.upload import client_otel, download, utils
 from tecken.upload.forms import UploadByDownloadForm, UploadByDownloadRemoteError
 from tecken.upload.models import Upload, FileUpload
 
@@ -268,6 +271,139 @@ def test_upload_try_symbols_happy_path(
     )
 
 
+def test_upload_try_symbols_skips_regular_storage(
+    client, db, symbol_storage, tmp_path, uploaderuser, metricsmock
+):
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_try_symbols")
+    token.permissions.add(permission)
+
+    # Files that are already in regular storage aren't uploaded to try storage.
+    with open(ZIP_FILE, "rb") as fp:
+        utils.dump_and_extract(str(tmp_path), fp, ZIP_FILE)
+    with open(tmp_path / "flag/deadbeef/flag.jpeg", "rb") as fp:
+        symbol_storage.upload_backend.upload(
+            key="flag/deadbeef/flag.jpeg", body=fp, metadata=ObjectMetadata()
+        )
+
+    url = reverse("upload:upload_archive")
+    with open(ZIP_FILE, "rb") as fp:
+        response = client.post(url, {"file.zip": fp}, HTTP_AUTH_TOKEN=token.key)
+        assert response.status_code == 201
+
+    (upload,) = Upload.objects.all()
+    assert upload.try_symbols is True
+    assert upload.skipped_keys == ["flag/deadbeef/flag.jpeg"]
+    assert not symbol_storage.try_upload_backend.get_object_metadata(
+        "flag/deadbeef/flag.jpeg"
+    )
+    records = metricsmock.filter_records("incr", stat="tecken.upload_file_upload_skip")
+    assert len(records) == 1
+    assert sorted(records[0].tags) == [
+        "host:testnode",
+        "reason:same_content",
+        "storage:regular",
+    ]
+
+
+@pytest.mark.parametrize("try_storage", [False, True])
+def test_upload_manifest(client, db, symbol_storage, uploaderuser, try_storage):
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    stored, changed, new = list(UPLOADS.values())[:3]
+    stored.upload(symbol_storage)
+    changed.upload(symbol_storage)
+    files = [
+        {"key": upload.key, "size": len(upload.original_body), "md5_hash": md5_sum}
+        for upload, md5_sum in [
+            (stored, stored.md5_sum()),
+            (changed, "0" * 32),
+            (new, new.md5_sum()),
+        ]
+    ]
+    files.append({"key": "build-symbols.txt", "size": 10, "md5_hash": "0" * 32})
+
+    url = reverse("upload:upload_manifest")
+    response = client.post(
+        url,
+        {"files": files, "try": try_storage},
+        content_type="application/json",
+        HTTP_AUTH_TOKEN=token.key,
+    )
+    assert response.status_code == 200
+    # Files in regular storage don't need to be uploaded to try storage either.
+    assert response.json() == {
+        "try_symbols": try_storage,
+        "needed_keys": [changed.key, new.key],
+        "skipped_keys": [stored.key],
+        "ignored_keys": ["build-symbols.txt"],
+    }
+    # Checking the manifest doesn't create an upload.
+    assert not Upload.objects.exists()
+
+
+def test_upload_manifest_max_files(client, db, symbol_storage, uploaderuser, settings):
+    # The limit of manifests is separate from the one of upload v2 requests.
+    settings.UPLOAD_V2_MAX_FILES_PER_REQUEST = 1
+    settings.UPLOAD_MANIFEST_MAX_FILES = 2
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    files = [
+        {"key": upload.key, "size": len(upload.original_body), "md5_hash": "0" * 32}
+        for upload in list(UPLOADS.values())[:3]
+    ]
+    url = reverse("upload:upload_manifest")
+    response = client.post(
+        url,
+        {"files": files[:2]},
+        content_type="application/json",
+        HTTP_AUTH_TOKEN=token.key,
+    )
+    assert response.status_code == 200
+    assert len(response.json()["needed_keys"]) == 2
+
+    response = client.post(
+        url,
+        {"files": files},
+        content_type="application/json",
+        HTTP_AUTH_TOKEN=token.key,
+    )
+    assert response.status_code == 400
+    assert response.json() == {"error": "too many files"}
+
+
+@pytest.mark.parametrize(
+    "payload, error",
+    [
+        ("not json", "malformed JSON request body"),
+        ({"files": [{"key": "xul.sym"}]}, "malformed JSON request body"),
+        (
+            {"files": [{"key": "x%l.pdb/1A2B/xul.sym", "size": 1, "md5_hash": "0"}]},
+            "invalid key",
+        ),
+        (
+            {"files": [{"key": "xul.pdb/1A2B/xul.sym", "size": 1, "md5_hash": "0"}]},
+            "invalid MD5 hex digest",
+        ),
+    ],
+)
+def test_upload_manifest_errors(client, db, uploaderuser, payload, error):
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    url = reverse("upload:upload_manifest")
+    response = client.post(
+        url, payload, content_type="application/json", HTTP_AUTH_TOKEN=token.key
+    )
+    assert response.status_code == 400
+    assert response.json() == {"error": error}
+
+
 def test_upload_archive_one_uploaded_one_skipped(
     client, db, symbol_storage, bucket_name, tmp_path, uploaderuser
 ):
@@ -322,6 +458,160 @@ def test_upload_archive_one_uploaded_one_skipped(
     )
 
 
+def test_upload_archive_bulk_create_batches(
+    client, db, symbol_storage, uploaderuser, settings, metricsmock
+):
+    settings.UPLOAD_FILE_UPLOAD_BULK_CREATE_BATCH_SIZE = 1
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    url = reverse("upload:upload_archive")
+    with open(ZIP_FILE, "rb") as fp:
+        response = client.post(url, {"file.zip": fp}, HTTP_AUTH_TOKEN=token.key)
+        assert response.status_code == 201
+
+    (upload,) = Upload.objects.all()
+    assert upload.completed_at
+    assert sorted(FileUpload.objects.values_list("key", flat=True)) == [
+        "flag/deadbeef/flag.jpeg",
+        "xpcshell.dbg/A7D6F1BB18CD4CB48/xpcshell.sym",
+    ]
+    assert FileUpload.objects.filter(upload=upload).count() == 2
+    metricsmock.assert_timing_once("tecken.upload_save_file_uploads")
+
+
+@pytest.mark.parametrize("prewarm", [False, True])
+def test_upload_archive_prewarm_download_caches(
+    client, db, symbol_storage, uploaderuser, settings, prewarm
+):
+    settings.UPLOAD_PREWARM_DOWNLOAD_CACHES = prewarm
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    url = reverse("upload:upload_archive")
+    with mock.patch("tecken.upload.views.prewarm_syminfo_cache") as prewarm_mock:
+        with open(ZIP_FILE, "rb") as fp:
+            response = client.post(url, {"file.zip": fp}, HTTP_AUTH_TOKEN=token.key)
+            assert response.status_code == 201
+
+    if prewarm:
+        (file_uploads,) = prewarm_mock.call_args.args
+        assert sorted(file_upload.key for file_upload in file_uploads) == [
+            "flag/deadbeef/flag.jpeg",
+            "xpcshell.dbg/A7D6F1BB18CD4CB48/xpcshell.sym",
+        ]
+    else:
+        prewarm_mock.assert_not_called()
+
+
+@pytest.mark.parametrize("requested", [False, True])
+def test_upload_archive_timings(
+    client, db, symbol_storage, uploaderuser, settings, requested
+):
+    settings.UPLOAD_TIMINGS_MAX_FILES = 1
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    url = reverse("upload:upload_archive")
+    data = {"timings": "1"} if requested else {}
+    with open(ZIP_FILE, "rb") as fp:
+        response = client.post(url, {"file.zip": fp, **data}, HTTP_AUTH_TOKEN=token.key)
+        assert response.status_code == 201
+
+    (upload,) = Upload.objects.all()
+    timings = upload.timings
+    assert timings["total_ms"] >= timings["extract_ms"] > 0
+    assert timings["save_ms"] > 0
+    assert timings["bytes_in"] == 70398
+    assert timings["bytes_out"] == sum(f.size for f in FileUpload.objects.all())
+    # Only the file that took the longest is included.
+    assert timings["files_omitted"] == 1
+    (file_timings,) = timings["files"]
+    assert file_timings["key"] in (
+        "flag/deadbeef/flag.jpeg",
+        "xpcshell.dbg/A7D6F1BB18CD4CB48/xpcshell.sym",
+    )
+    assert "queue_ms" in file_timings
+    assert "exists_ms" in file_timings
+    assert "put_ms" in file_timings
+    assert file_timings["bytes_out"] > 0
+
+    upload_response = response.json()["upload"]
+    if requested:
+        assert upload_response["timings"] == timings
+    else:
+        assert "timings" not in upload_response
+
+
+@pytest.mark.parametrize(
+    "file_name, content", [("xul.sym", b"MODULE Linux x86_64 "), ("xul.dl_", b"MSCF")]
+)
+def test_upload_file_upload_deduplication(
+    tmp_path, symbol_storage, settings, metricsmock, file_name, content
+):
+    settings.UPLOAD_CONTENT_DEDUPLICATION = True
+    backend = symbol_storage.get_upload_backend(False)
+    upload = Upload()
+    content += os.urandom(1000)
+    file_path = tmp_path / file_name
+    file_path.write_bytes(content)
+
+    file_upload = utils.upload_file_upload(
+        backend, f"xul/AAAA/{file_name}", str(file_path), upload
+    )
+    copy = utils.upload_file_upload(
+        backend, f"xul/BBBB/{file_name}", str(file_path), upload
+    )
+    assert copy.size == file_upload.size
+    assert copy.compressed == file_upload.compressed
+    original_metadata = backend.get_object_metadata(f"xul/AAAA/{file_name}")
+    metadata = backend.get_object_metadata(f"xul/BBBB/{file_name}")
+    assert metadata.original_content_length == len(content)
+    assert metadata.content_length == file_upload.size
+    assert metadata.content_type == original_metadata.content_type
+    assert metadata.content_encoding == original_metadata.content_encoding
+    assert (
+        len(metricsmock.filter_records("timing", stat="tecken.upload_put_object")) == 1
+    )
+    assert (
+        len(metricsmock.filter_records("incr", stat="tecken.upload_file_upload_copy"))
+        == 1
+    )
+
+    # If the object with the same content is gone, the file is uploaded after all.
+    backend.clear()
+    copy = utils.upload_file_upload(
+        backend, f"xul/CCCC/{file_name}", str(file_path), upload
+    )
+    assert copy.size == file_upload.size
+    assert (
+        len(metricsmock.filter_records("timing", stat="tecken.upload_put_object")) == 2
+    )
+    assert backend.get_object_metadata(f"xul/CCCC/{file_name}") is not None
+
+    # If the object with the same content was replaced, the file is uploaded after all.
+    other_path = tmp_path / "other"
+    other_path.write_bytes(b"other content")
+    with open(other_path, "rb") as f:
+        backend.upload(f"xul/CCCC/{file_name}", f, ObjectMetadata())
+    utils.upload_file_upload(backend, f"xul/DDDD/{file_name}", str(file_path), upload)
+    assert (
+        len(metricsmock.filter_records("timing", stat="tecken.upload_put_object")) == 3
+    )
+    metadata = backend.get_object_metadata(f"xul/DDDD/{file_name}")
+    assert metadata.original_content_length == len(content)
+    records = metricsmock.filter_records("incr", stat="tecken.upload_stored_content")
+    assert [record.tags[0] for record in records] == [
+        "result:miss",
+        "result:hit",
+        "result:hit",
+        "result:hit",
+    ]
+
+
 def test_upload_archive_key_lookup_cached(client, db, symbol_storage, uploaderuser):
     token = Token.objects.create(user=uploaderuser)
     (permission,) = Permission.objects.filter(codename="upload_symbols")
@@ -431,9 +721,13 @@ def test_upload_archive_one_uploaded_one_errored(
     (upload,) = Upload.objects.all()
     assert upload.user == uploaderuser
     assert not upload.completed_at
+    assert upload.ignored_keys == ["build-symbols.txt"]
+    assert upload.timings
 
-    # Failed file uploads are not recorded in the database.
-    assert FileUpload.objects.all().count() == 0
+    # Failed file uploads are not recorded in the database, but the files that were
+    # uploaded before the error are.
+    (file_upload,) = FileUpload.objects.all()
+    assert file_upload.key == "flag/deadbeef/flag.jpeg"
 
 
 def test_upload_archive_with_cache_invalidation(
@@ -516,8 +810,9 @@ def test_upload_archive_by_url(
         status_code=302,
         headers={"Location": "https://bad.example.com/symbols.zip"},
     )
+    # The file is downloaded from the final URL without following the redirects again.
     requestsmock.get(
-        "https://allowed.example.com/symbols.zip",
+        "https://download.example.com/symbols.zip",
         content=zip_file_content,
         status_code=200,
     )
@@ -545,6 +840,41 @@ def test_upload_archive_by_url(
     assert FileUpload.objects.filter(upload=upload).count() == 2
 
 
+def test_upload_archive_by_url_skip_head(
+    client, db, symbol_storage, uploaderuser, settings, requestsmock
+):
+    settings.ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = ["allowed.example.com"]
+    settings.UPLOAD_BY_DOWNLOAD_SKIP_HEAD = True
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    with open(ZIP_FILE, "rb") as fp:
+        zip_file_content = fp.read()
+    requestsmock.get(
+        "https://allowed.example.com/symbols.zip",
+        content=zip_file_content,
+        status_code=200,
+        headers={"Content-Length": str(len(zip_file_content))},
+    )
+
+    response = client.post(
+        reverse("upload:upload_archive"),
+        data={"url": "https://allowed.example.com/symbols.zip"},
+        HTTP_AUTH_TOKEN=token.key,
+    )
+    assert response.status_code == 201
+    (upload,) = Upload.objects.all()
+    assert FileUpload.objects.filter(upload=upload).count() == 2
+    # The file was downloaded with a single GET request.
+    requests = [
+        request.method
+        for request in requestsmock.request_history
+        if request.hostname == "allowed.example.com"
+    ]
+    assert requests == ["GET"]
+
+
 def test_upload_archive_by_url_remote_error(
     client, db, uploaderuser, settings, requestsmock
 ):
@@ -566,6 +896,292 @@ def test_upload_archive_by_url_remote_error(
     )
 
 
+def range_response_callback(content, support_ranges=True):
+    """Return a requests_mock callback that serves range requests for content."""
+
+    def callback(request, context):
+        range_header = request.headers.get("Range")
+        if not support_ranges or not range_header:
+            context.status_code = 200
+            return content
+        start, end = range_header.removeprefix("bytes=").split("-")
+        context.status_code = 206
+        return content[int(start) : int(end) + 1]
+
+    return callback
+
+
+@pytest.mark.parametrize("support_ranges", [True, False])
+def test_upload_archive_by_url_streaming(
+    client,
+    db,
+    symbol_storage,
+    uploaderuser,
+    settings,
+    requestsmock,
+    metricsmock,
+    support_ranges,
+):
+    settings.ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = ["allowed.example.com"]
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    with open(ZIP_FILE, "rb") as fp:
+        zip_file_content = fp.read()
+
+    requestsmock.head(
+        "https://allowed.example.com/symbols.zip",
+        content=b"",
+        status_code=200,
+        headers={
+            "Content-Length": str(len(zip_file_content)),
+            "Accept-Ranges": "bytes",
+        },
+    )
+    requestsmock.get(
+        "https://allowed.example.com/symbols.zip",
+        content=range_response_callback(zip_file_content, support_ranges),
+    )
+
+    response = client.post(
+        reverse("upload:upload_archive"),
+        data={"url": "https://allowed.example.com/symbols.zip"},
+        HTTP_AUTH_TOKEN=token.key,
+    )
+    assert response.status_code == 201
+
+    (upload,) = Upload.objects.all()
+    assert upload.completed_at
+    assert FileUpload.objects.filter(upload=upload).count() == 2
+
+    range_headers = [
+        request.headers.get("Range")
+        for request in requestsmock.request_history
+        if request.method == "GET"
+    ]
+    if support_ranges:
+        # The tail with the central directory is read first, then the rest.
+        assert range_headers[0].endswith(f"-{len(zip_file_content) - 1}")
+        assert range_headers[1].startswith("bytes=0-")
+        metricsmock.assert_incr("tecken.upload_download_by_url_streaming")
+    else:
+        # The server ignored the range request, so the whole archive was downloaded.
+        assert range_headers[-1] is None
+        assert not metricsmock.filter_records(
+            "incr", stat="tecken.upload_download_by_url_streaming"
+        )
+
+
+@pytest.mark.parametrize("streaming", [True, False])
+def test_upload_archive_by_url_parallel_ranges(
+    client,
+    db,
+    symbol_storage,
+    uploaderuser,
+    settings,
+    requestsmock,
+    metricsmock,
+    streaming,
+):
+    settings.ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = ["allowed.example.com"]
+    settings.UPLOAD_BY_DOWNLOAD_STREAMING = streaming
+    settings.UPLOAD_BY_DOWNLOAD_SEGMENT_SIZE = 1000
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    with open(ZIP_FILE, "rb") as fp:
+        zip_file_content = fp.read()
+    serve_range = range_response_callback(zip_file_content)
+
+    def callback(request, context):
+        content = serve_range(request, context)
+        start = int(request.headers["Range"].removeprefix("bytes=").split("-")[0])
+        if start % settings.UPLOAD_BY_DOWNLOAD_SEGMENT_SIZE == 0:
+            # The connection drops halfway through the first request for every
+            # segment. The retry requests the rest of the segment.
+            return content[: len(content) // 2]
+        return content
+
+    requestsmock.head(
+        "https://allowed.example.com/symbols.zip",
+        content=b"",
+        status_code=200,
+        headers={
+            "Content-Length": str(len(zip_file_content)),
+            "Accept-Ranges": "bytes",
+        },
+    )
+    requestsmock.get("https://allowed.example.com/symbols.zip", content=callback)
+
+    response = client.post(
+        reverse("upload:upload_archive"),
+        data={"url": "https://allowed.example.com/symbols.zip"},
+        HTTP_AUTH_TOKEN=token.key,
+    )
+    assert response.status_code == 201
+    (upload,) = Upload.objects.all()
+    assert FileUpload.objects.filter(upload=upload).count() == 2
+
+    records = metricsmock.filter_records(
+        "histogram", stat="tecken.upload_download_by_url_ranges"
+    )
+    assert len(records) == 1
+    assert records[0].value > 1
+    metricsmock.assert_histogram_once("tecken.upload_download_by_url_throughput")
+
+
+def test_upload_archive_by_url_ranges_ignored(
+    client, db, symbol_storage, uploaderuser, settings, requestsmock, metricsmock
+):
+    settings.ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = ["allowed.example.com"]
+    settings.UPLOAD_BY_DOWNLOAD_STREAMING = False
+    settings.UPLOAD_BY_DOWNLOAD_SEGMENT_SIZE = 1000
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    with open(ZIP_FILE, "rb") as fp:
+        zip_file_content = fp.read()
+
+    # The server advertises range requests, but responds to them with the whole file.
+    requestsmock.head(
+        "https://allowed.example.com/symbols.zip",
+        content=b"",
+        status_code=200,
+        headers={
+            "Content-Length": str(len(zip_file_content)),
+            "Accept-Ranges": "bytes",
+        },
+    )
+    requestsmock.get(
+        "https://allowed.example.com/symbols.zip",
+        content=zip_file_content,
+        status_code=200,
+    )
+
+    response = client.post(
+        reverse("upload:upload_archive"),
+        data={"url": "https://allowed.example.com/symbols.zip"},
+        HTTP_AUTH_TOKEN=token.key,
+    )
+    assert response.status_code == 201
+    (upload,) = Upload.objects.all()
+    assert FileUpload.objects.filter(upload=upload).count() == 2
+
+    # The archive was downloaded with a single request after the range requests failed.
+    gets = [
+        request
+        for request in requestsmock.request_history
+        if request.method == "GET" and request.hostname == "allowed.example.com"
+    ]
+    assert "Range" in gets[0].headers
+    assert "Range" not in gets[-1].headers
+    assert not metricsmock.filter_records(
+        "histogram", stat="tecken.upload_download_by_url_ranges"
+    )
+
+
+def test_upload_archive_by_url_streaming_truncated(
+    client, db, symbol_storage, uploaderuser, settings, requestsmock
+):
+    settings.ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = ["allowed.example.com"]
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    with open(ZIP_FILE, "rb") as fp:
+        zip_file_content = fp.read()
+    serve_range = range_response_callback(zip_file_content)
+
+    def callback(request, context):
+        content = serve_range(request, context)
+        if not request.headers["Range"].endswith(f"-{len(zip_file_content) - 1}"):
+            # The connection keeps dropping halfway through the body of the archive,
+            # but not while reading the central directory at the end.
+            return content[: len(content) // 2]
+        return content
+
+    requestsmock.head(
+        "https://allowed.example.com/symbols.zip",
+        content=b"",
+        status_code=200,
+        headers={
+            "Content-Length": str(len(zip_file_content)),
+            "Accept-Ranges": "bytes",
+        },
+    )
+    requestsmock.get("https://allowed.example.com/symbols.zip", content=callback)
+
+    response = client.post(
+        reverse("upload:upload_archive"),
+        data={"url": "https://allowed.example.com/symbols.zip"},
+        HTTP_AUTH_TOKEN=token.key,
+    )
+    assert response.status_code == 500
+    assert response.json()["error"] == (
+        "Incomplete download of https://allowed.example.com/symbols.zip"
+    )
+    (upload,) = Upload.objects.all()
+    assert upload.completed_at is None
+
+
+def test_upload_archive_by_url_streaming_truncated_partial(
+    client, db, symbol_storage, uploaderuser, settings, requestsmock, monkeypatch
+):
+    settings.ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = ["allowed.example.com"]
+    settings.UPLOAD_BY_DOWNLOAD_SEGMENT_SIZE = 100
+    # Read less than the whole sample archive with the central directory, so the
+    # symbols files are downloaded in segments.
+    monkeypatch.setattr(download, "_TAIL_SIZE", 1000)
+    token = Token.objects.create(user=uploaderuser)
+    (permission,) = Permission.objects.filter(codename="upload_symbols")
+    token.permissions.add(permission)
+
+    with open(ZIP_FILE, "rb") as fp:
+        zip_file_content = fp.read()
+    with zipfile.ZipFile(ZIP_FILE) as zf:
+        sym_offset = zf.getinfo(
+            "xpcshell.dbg/A7D6F1BB18CD4CB48/xpcshell.sym"
+        ).header_offset
+    serve_range = range_response_callback(zip_file_content)
+
+    def callback(request, context):
+        content = serve_range(request, context)
+        start, end = request.headers["Range"].removeprefix("bytes=").split("-")
+        if int(start) >= sym_offset and int(end) < len(zip_file_content) - 1:
+            # The connection keeps dropping after the first file was downloaded.
+            return content[: len(content) // 2]
+        return content
+
+    requestsmock.head(
+        "https://allowed.example.com/symbols.zip",
+        content=b"",
+        status_code=200,
+        headers={
+            "Content-Length": str(len(zip_file_content)),
+            "Accept-Ranges": "bytes",
+        },
+    )
+    requestsmock.get("https://allowed.example.com/symbols.zip", content=callback)
+
+    response = client.post(
+        reverse("upload:upload_archive"),
+        data={"url": "https://allowed.example.com/symbols.zip"},
+        HTTP_AUTH_TOKEN=token.key,
+    )
+    assert response.status_code == 500
+    # The files uploaded before the download failed are recorded.
+    (upload,) = Upload.objects.all()
+    assert upload.completed_at is None
+    assert upload.ignored_keys == ["build-symbols.txt"]
+    assert upload.timings is not None
+    (file_upload,) = FileUpload.objects.all()
+    assert file_upload.upload == upload
+    assert file_upload.key == "flag/deadbeef/flag.jpeg"
+
+
 def test_upload_client_bad_request(client, db, uploaderuser, settings):
     url = reverse("upload:upload_archive")
     response = client.get(url)
@@ -820,6 +1436,102 @@ def test_UploadByDownloadForm_redirection_exhaustion(requestsmock, settings):
     assert "Too many redirects" in validation_errors[0].message
 
 
+def test_UploadByDownloadForm_redirects_cached(requestsmock, settings, metricsmock):
+    settings.ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = ["allowed.example.com"]
+
+    requestsmock.head(
+        "https://allowed.example.com/symbols.zip",
+        text="Found",
+        status_code=302,
+        headers={"Location": "https://download.example.com/symbols.zip"},
+    )
+    requestsmock.head(
+        "https://download.example.com/symbols.zip",
+        content=b"content",
+        status_code=200,
+        headers={"Content-Length": "1234"},
+    )
+
+    for _ in range(2):
+        form = UploadByDownloadForm({"url": "https://allowed.example.com/symbols.zip"})
+        assert form.is_valid()
+        assert form.cleaned_data["upload"]["final_url"] == (
+            "https://download.example.com/symbols.zip"
+        )
+        assert form.cleaned_data["upload"]["redirect_urls"] == [
+            "https://download.example.com/symbols.zip"
+        ]
+
+    # The second time, the redirect is resolved from the cache.
+    head_urls = [request.url for request in requestsmock.request_history]
+    assert head_urls == [
+        "https://allowed.example.com/symbols.zip",
+        "https://download.example.com/symbols.zip",
+        "https://download.example.com/symbols.zip",
+    ]
+    metricsmock.assert_incr(
+        "tecken.upload_download_redirects_cache", tags=["result:hit", "host:testnode"]
+    )
+
+
+def test_UploadByDownloadForm_skip_head(requestsmock, settings):
+    settings.ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = ["allowed.example.com"]
+    settings.UPLOAD_BY_DOWNLOAD_SKIP_HEAD = True
+
+    requestsmock.get(
+        "https://allowed.example.com/symbols.zip",
+        text="Found",
+        status_code=302,
+        headers={"Location": "https://download.example.com/symbols.zip"},
+    )
+    # Relative redirects are resolved against the URL that redirected.
+    requestsmock.get(
+        "https://download.example.com/symbols.zip",
+        text="Found",
+        status_code=302,
+        headers={"Location": "/files/symbols.zip"},
+    )
+    requestsmock.get(
+        "https://download.example.com/files/symbols.zip",
+        content=b"content",
+        status_code=200,
+        headers={"Content-Length": "7"},
+    )
+
+    form = UploadByDownloadForm({"url": "https://allowed.example.com/symbols.zip"})
+    assert form.is_valid()
+    assert form.cleaned_data["upload"]["size"] == 7
+    assert form.cleaned_data["upload"]["final_url"] == (
+        "https://download.example.com/files/symbols.zip"
+    )
+    assert form.cleaned_data["upload"]["redirect_urls"] == [
+        "https://download.example.com/symbols.zip",
+        "https://download.example.com/files/symbols.zip",
+    ]
+    assert form.cleaned_data["upload"]["response"].content == b"content"
+    assert all(request.method == "GET" for request in requestsmock.request_history)
+
+
+def test_UploadByDownloadForm_skip_head_too_many_redirects(requestsmock, settings):
+    settings.ALLOW_UPLOAD_BY_DOWNLOAD_DOMAINS = ["allowed.example.com"]
+    settings.UPLOAD_BY_DOWNLOAD_SKIP_HEAD = True
+
+    requestsmock.get(
+        "https://allowed.example.com/symbols.zip",
+        text="Found",
+        status_code=302,
+        headers={"Location": "https://allowed.example.com/symbols.zip"},
+    )
+
+    form = UploadByDownloadForm({"url": "https://allowed.example.com/symbols.zip"})
+    assert not form.is_valid()
+    assert form.errors["__all__"] == [
+        "Too many redirects trying to open https://allowed.example.com/symbols.zip"
+    ]
+    # The first request and five redirects
+    assert requestsmock.call_count == 6
+
+
 def test_clearuploads_records(db, fakeuser):
     """clearuploads deletes appropriate records"""
     today = timezone.now()
@@ -929,6 +1641,125 @@ def test_clearuploads_records_dry_run(db, fakeuser):
     ]
 
 
+def test_managepartitions_creates_partitions(db, fakeuser):
+    """managepartitions creates monthly partitions after the existing ones"""
+    from tecken.upload.management.commands.managepartitions import get_partitions
+
+    now = timezone.now()
+    in_two_months = now + datetime.timedelta(days=62)
+    upload = Upload.objects.create(user=fakeuser, filename="reg.zip", size=100)
+    # This lands in the default partition until a partition for it exists.
+    file_upload = FileUpload.objects.create(
+        upload=upload, key="a.sym", size=100, created_at=in_two_months
+    )
+
+    stdout = StringIO()
+    call_command("managepartitions", stdout=stdout)
+    assert "DRY RUN" not in stdout.getvalue()
+
+    partitions = get_partitions()
+    names = [name for name, _, _ in partitions]
+    assert "upload_fileupload_legacy" in names
+    assert f"upload_fileupload_p{in_two_months:%Y_%m}" in names
+    # Partitions are contiguous and don't overlap
+    partitions.sort(key=lambda p: p[2])
+    for (_, _, upper), (_, lower, _) in zip(partitions, partitions[1:], strict=False):
+        assert upper == lower
+
+    # The row got moved out of the default partition and is still there
+    assert FileUpload.objects.get(id=file_upload.id).key == "a.sym"
+
+    # Running it again is a no-op
+    stdout = StringIO()
+    call_command("managepartitions", stdout=stdout)
+    assert ">>> create" not in stdout.getvalue()
+
+
+def test_managepartitions_drops_expired_partitions(db, fakeuser):
+    """managepartitions drops partitions older than the retention period"""
+    upload = Upload.objects.create(user=fakeuser, filename="reg.zip", size=100)
+    FileUpload.objects.create(upload=upload, key="old.sym", size=100)
+    call_command("managepartitions", stdout=StringIO())
+
+    future = timezone.now() + datetime.timedelta(days=365 * 2 + 62)
+    FileUpload.objects.create(upload=upload, key="new.sym", size=100, created_at=future)
+    with mock.patch("django.utils.timezone.now") as mock_now:
+        mock_now.return_value = future
+        # The test runs in a transaction, so deferred foreign key checks need to run
+        # before Postgres lets us drop a partition.
+        with connection.cursor() as cursor:
+            cursor.execute("SET CONSTRAINTS ALL IMMEDIATE")
+        stdout = StringIO()
+        call_command("managepartitions", stdout=stdout)
+
+    assert ">>> drop upload_fileupload_legacy" in stdout.getvalue()
+    file_keys = list(FileUpload.objects.values_list("key", flat=True))
+    assert file_keys == ["new.sym"]
+
+
+def test_managepartitions_dry_run(db):
+    """managepartitions dry_run doesn't change partitions"""
+    from tecken.upload.management.commands.managepartitions import get_partitions
+
+    partitions = get_partitions()
+    stdout = StringIO()
+    call_command("managepartitions", dry_run=True, stdout=stdout)
+
+    assert "DRY RUN" in stdout.getvalue()
+    assert ">>> create" in stdout.getvalue()
+    assert get_partitions() == partitions
+
+
+def test_backfillsyminfo(db, fakeuser, symbol_storage, metricsmock):
+    """backfillsyminfo fills in sym header data from storage"""
+    upload_obj = Upload.objects.create(user=fakeuser, size=100)
+    bucket = symbol_storage.get_upload_backend(False).bucket
+    sym_keys = [key for key in UPLOADS if key.endswith(".sym")]
+    for key in sym_keys:
+        UPLOADS[key].upload(symbol_storage)
+        FileUpload.objects.create(
+            upload=upload_obj, bucket_name=bucket, key=key, size=100
+        )
+    FileUpload.objects.create(
+        upload=upload_obj, bucket_name=bucket, key="xul.pdb/ABC/xul.sym", size=100
+    )
+
+    stdout = StringIO()
+    call_command("backfillsyminfo", concurrency=2, batch_size=2, stdout=stdout)
+
+    assert f"updated={len(sym_keys)}, failed=1" in stdout.getvalue()
+    file_upload = FileUpload.objects.get(
+        key="qipcap64.pdb/293A285ED25871934C4C44205044422E1/qipcap64.sym"
+    )
+    assert file_upload.debug_filename == "qipcap64.pdb"
+    assert file_upload.debug_id == "293A285ED25871934C4C44205044422E1"
+    assert file_upload.code_file == "qipcap64.dll"
+    assert file_upload.code_id == "6A4806059000"
+    assert file_upload.generator == "mozilla/dump_syms 2.2.0"
+    assert FileUpload.objects.get(key="xul.pdb/ABC/xul.sym").debug_id is None
+    metricsmock.assert_incr("tecken.backfillsyminfo.failed", value=1)
+
+
+def test_backfillsyminfo_dry_run(db, fakeuser, symbol_storage):
+    """backfillsyminfo dry_run doesn't update records"""
+    upload_obj = Upload.objects.create(user=fakeuser, size=100)
+    upload = UPLOADS["ssltunnel/8A07C88A3DA44E20A3490D88791183060/ssltunnel.sym"]
+    upload.upload(symbol_storage)
+    FileUpload.objects.create(
+        upload=upload_obj,
+        bucket_name=symbol_storage.get_upload_backend(False).bucket,
+        key=upload.key,
+        size=100,
+    )
+
+    stdout = StringIO()
+    call_command("backfillsyminfo", dry_run=True, stdout=stdout)
+
+    assert "DRY RUN" in stdout.getvalue()
+    assert "updated=1, failed=0" in stdout.getvalue()
+    assert FileUpload.objects.get(key=upload.key).debug_id is None
+
+
 class Test_remove_orphaned_files:
     def test_no_watchdir(self, db, settings, caplog):
         caplog.set_level(logging.INFO)
@@ -1236,3 +2067,39 @@ def test_upload_auth_info_no_otel(client, db, uploaderuser):
         "token_expires_at": int(token.expires_at.timestamp()),
         "upload_api_version": 1,
     }
+
+
+def test_benchmark_upload(db, symbol_storage, settings):
+    # The settings of the local dev environment, where the command is run
+    settings.ALLOWED_HOSTS = ["web", "localhost"]
+    settings.LOCAL_DEV_ENV = True
+    stdout = StringIO()
+    call_command(
+        "benchmark_upload",
+        files=4,
+        file_size=1024,
+        duplicates=1,
+        uploaded_ratio=0.5,
+        stdout=stdout,
+    )
+    output = stdout.getvalue()
+    assert "4 files of 1024 bytes, 1 duplicates, 50% already uploaded" in output
+    assert ">>> v1 extract: count=1 " in output
+    # Duplicates are extracted once, and two of the files were uploaded before.
+    assert ">>> v1 exists: count=4 " in output
+    assert ">>> v1 put: count=2 " in output
+    assert ">>> v1 db_insert: count=1 " in output
+    assert ">>> v1 total: uploads=1 " in output
+    # Only the uploaded files are completed.
+    assert ">>> v2 read_sym_header: count=2 " in output
+    assert ">>> v2 client_put: count=2 " in output
+    assert ">>> v2 total: uploads=1 " in output
+
+
+def test_benchmark_upload_output(tmp_path):
+    path = tmp_path / "symbols.zip"
+    call_command("benchmark_upload", files=3, duplicates=1, output=str(path))
+    with zipfile.ZipFile(path) as zf:
+        names = zf.namelist()
+        assert len(names) == 4
+        assert zf.read(names[0]).startswith(b"MODULE windows x86_64 ")
@@ -0,0 +1,190 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import functools
+import itertools
+import os
+import threading
+
+from django.contrib.auth.models import User
+from django.urls import reverse
+import pytest
+
+from tecken.upload.executor import (
+    FairThreadPoolExecutor,
+    scheduling_group,
+    task_name,
+)
+
+
+def upload_something(value, factor=1):
+    return value * factor
+
+
+def test_task_name():
+    assert task_name(upload_something) == "upload_something"
+    partial = functools.partial(functools.partial(upload_something, factor=2))
+    assert task_name(partial) == "upload_something"
+
+
+def test_instrumented_executor(metricsmock):
+    pool = FairThreadPoolExecutor(max_workers=2)
+    try:
+        assert pool.submit(upload_something, 2, factor=3).result() == 6
+        partial = functools.partial(upload_something, factor=2)
+        assert list(pool.map(partial, [1, 2])) == [2, 4]
+        state = pool.state()
+        assert state["max_workers"] == 2
+        assert 1 <= state["threads"] <= 2
+        assert state["queued"] == 0
+        assert state["active"] == 0
+        assert state["completed"] == 3
+        assert state["submitted"] == {"upload_something": 3}
+    finally:
+        pool.shutdown()
+
+    for stat in ("upload_executor_wait", "upload_executor_run"):
+        records = metricsmock.filter_records("timing", stat=f"tecken.{stat}")
+        assert len(records) == 3
+        assert all(record.tags[0] == "task:upload_something" for record in records)
+    for stat in ("upload_executor_queue_depth", "upload_executor_active"):
+        values = [
+            record.value
+            for record in metricsmock.filter_records("gauge", stat=f"tecken.{stat}")
+        ]
+        # Gauges are only emitted when their value changes.
+        assert values
+        assert all(a != b for a, b in itertools.pairwise(values))
+        assert values[-1] == 0
+
+
+def test_instrumented_executor_state_while_busy(metricsmock):
+    pool = FairThreadPoolExecutor(max_workers=1)
+    started = threading.Event()
+    release = threading.Event()
+
+    def block():
+        started.set()
+        release.wait(5)
+
+    try:
+        futures = [pool.submit(block), pool.submit(block)]
+        started.wait(5)
+        state = pool.state()
+        assert state["active"] == 1
+        assert state["queued"] == 1
+        assert state["threads"] == 1
+    finally:
+        release.set()
+        for future in futures:
+            future.result()
+        pool.shutdown()
+    assert pool.state()["completed"] == 2
+
+    def gauge_values(stat):
+        return [
+            record.value
+            for record in metricsmock.filter_records("gauge", stat=f"tecken.{stat}")
+        ]
+
+    assert gauge_values("upload_executor_queue_depth") == [0, 1, 0]
+    assert gauge_values("upload_executor_active") == [1, 0]
+
+
+def test_fair_executor_takes_turns():
+    pool = FairThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+    order = []
+
+    def run(name):
+        if name == "big1":
+            release.wait(5)
+        order.append(name)
+
+    try:
+        with scheduling_group():
+            big = [pool.submit(run, f"big{i}") for i in range(1, 6)]
+        with scheduling_group():
+            small = [pool.submit(run, f"small{i}") for i in range(1, 3)]
+        assert pool.state()["groups"] == 2
+        release.set()
+        for future in big + small:
+            future.result()
+    finally:
+        pool.shutdown()
+
+    # The small group doesn't wait until all tasks of the big group are done.
+    assert order == ["big1", "big2", "small1", "big3", "small2", "big4", "big5"]
+
+
+def test_fair_executor_max_workers_per_group():
+    pool = FairThreadPoolExecutor(max_workers=3, max_workers_per_group=2)
+    release = threading.Event()
+    running = []
+
+    def block(name):
+        running.append(name)
+        release.wait(5)
+
+    try:
+        with scheduling_group():
+            futures = [pool.submit(block, f"big{i}") for i in range(3)]
+        state = pool.state()
+        assert state["active"] == 2
+        assert state["queued"] == 1
+
+        # A thread is still free for other groups.
+        with scheduling_group():
+            futures.append(pool.submit(block, "small"))
+        assert pool.state()["active"] == 3
+        release.set()
+        for future in futures:
+            future.result()
+    finally:
+        pool.shutdown()
+    assert sorted(running) == ["big0", "big1", "big2", "small"]
+
+
+def test_fair_executor_errors_and_cancel():
+    pool = FairThreadPoolExecutor(max_workers=1)
+    release = threading.Event()
+
+    def fail():
+        release.wait(5)
+        raise ValueError("boom")
+
+    try:
+        failing = pool.submit(fail)
+        queued = pool.submit(upload_something, 1)
+        assert queued.cancel()
+        release.set()
+        with pytest.raises(ValueError):
+            failing.result()
+    finally:
+        pool.shutdown()
+    assert queued.cancelled()
+    state = pool.state()
+    assert state["queued"] == 0
+    assert state["active"] == 0
+    assert state["completed"] == 2
+    with pytest.raises(RuntimeError):
+        pool.submit(upload_something, 1)
+
+
+def test_executor_status(client, db):
+    url = reverse("siteadmin:executor_status")
+    response = client.get(url)
+    assert response.status_code == 302
+
+    user = User.objects.create(username="staff", email="staff@example.com")
+    client.force_login(user)
+    response = client.get(url)
+    assert response.status_code == 302
+
+    user.is_staff = True
+    user.save()
+    response = client.get(url)
+    assert response.status_code == 200
+    # The tests run uploads synchronously.
+    assert response.json() == {"pid": os.getpid(), "executor": {"synchronous": True}}
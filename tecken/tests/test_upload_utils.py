@@ -7,11 +7,13 @@ from pathlib import Path
 
 import pytest
 
+from tecken.libstorage import ObjectMetadata, StorageBackend
 from tecken.upload.utils import (
     dump_and_extract,
     get_key_content_type,
     is_sym_file,
     should_compressed_key,
+    should_upload,
 )
 
 
@@ -90,3 +92,46 @@ def test_should_compressed_key(settings, key, expected):
 def test_get_key_content_type(settings, key, expected):
     settings.MIME_OVERRIDES = {"html": "text/html"}
     assert get_key_content_type(key) == expected
+
+
+def test_should_upload(metricsmock):
+    regular_backend = StorageBackend()
+    regular_backend.try_symbols = False
+    try_backend = StorageBackend()
+    try_backend.try_symbols = True
+    key = "xul.pdb/ABCD/xul.sym"
+    stored = ObjectMetadata(
+        content_encoding="gzip",
+        content_length=40,
+        original_content_length=100,
+        original_md5_sum="abc",
+    )
+    # The original size and hash of legacy files default to the compressed ones.
+    legacy = ObjectMetadata(
+        content_encoding="gzip",
+        content_length=40,
+        original_content_length=40,
+        original_md5_sum="def",
+    )
+
+    assert should_upload(key, [], 100, "abc")
+    assert should_upload(key, [(try_backend, stored)], 100, "xyz")
+    assert should_upload(key, [(try_backend, stored)], 101, "abc")
+    assert not should_upload(
+        key, [(regular_backend, legacy), (try_backend, stored)], 100, "abc"
+    )
+    assert should_upload(key, [(regular_backend, legacy)], 100, "abc")
+    assert should_upload(
+        key, [(regular_backend, legacy)], 100, "abc", compressed_size=41
+    )
+    assert not should_upload(
+        key, [(regular_backend, legacy)], 100, "abc", compressed_size=40
+    )
+    # Only legacy files are compared by their compressed size.
+    assert should_upload(key, [(try_backend, stored)], 100, "xyz", compressed_size=40)
+
+    records = metricsmock.filter_records("incr", stat="tecken.upload_file_upload_skip")
+    assert [sorted(record.tags)[1:] for record in records] == [
+        ["reason:same_content", "storage:try"],
+        ["reason:legacy_compressed_size", "storage:regular"],
+    ]
@@ -8,15 +8,19 @@ from typing import Any
 from django.contrib.auth.models import Permission, User
 from django.test import Client
 from django.urls import reverse
+from django.utils import timezone
 from markus.testing import AnyTagValue, MetricsMock
 import msgspec
 import pytest
 from pytest_django.fixtures import SettingsWrapper
 
 from tecken.base.symbolstorage import SymbolStorage
+from tecken.libsym import extract_sym_header_data_from_bytes
 from tecken.tests.utils import UPLOADS
 from tecken.tokens.models import Token
-from tecken.upload.views import FileSpecRequest, UploadRequest
+from tecken.upload import views
+from tecken.upload.models import FileUpload, Upload
+from tecken.upload.views import FileSpecRequest, UploadCompleteRequest, UploadRequest
 
 
 def perform_uploads(
@@ -33,6 +37,16 @@ def perform_uploads(
     return response.json()
 
 
+def complete_upload(client: Client, token: Token, upload_id: int, keys: list[str]):
+    """Perform an upload v2 completion request using the Django test client."""
+    return client.post(
+        reverse("upload:upload_v2_complete", args=(upload_id,)),
+        data=msgspec.json.encode(UploadCompleteRequest(keys=keys)),
+        content_type="application/json",
+        headers={"Auth-Token": token.key},
+    )
+
+
 def create_token(user: User, try_storage: bool) -> Token:
     """Create an upload token for the given user."""
     token = Token.objects.create(user=user)
@@ -163,7 +177,12 @@ def test_upload_v2_skips(
         tags=[f"try:{not try_storage}", AnyTagValue("bucket")],
     )
     assert_incr_count(metricsmock, "upload_file_upload_error", 0)
-    assert_incr_count(metricsmock, "upload_file_upload_skip", len(UPLOADS))
+    assert_incr_count(
+        metricsmock,
+        "upload_file_upload_skip",
+        len(UPLOADS),
+        tags=["reason:same_content", AnyTagValue("storage")],
+    )
     assert_incr_count(metricsmock, "upload_file_upload_upload", 0)
 
 
@@ -255,3 +274,354 @@ def test_upload_v2_too_many_files(
     assert response.status_code == 400
     error_response = response.json()
     assert error_response["error"] == "too many files"
+
+
+@pytest.mark.parametrize("try_storage", [False, True])
+@pytest.mark.django_db
+def test_upload_v2_complete(
+    client: Client,
+    uploaderuser: User,
+    symbol_storage: SymbolStorage,
+    metricsmock: MetricsMock,
+    try_storage: bool,
+):
+    token = create_token(uploaderuser, try_storage)
+
+    file_specs = [u.file_spec() for u in UPLOADS.values()]
+    upload_response = perform_uploads(client, token, file_specs)
+    for upload, file_spec in zip(
+        UPLOADS.values(), upload_response["files"], strict=True
+    ):
+        upload.upload_to_session_url(file_spec["action"]["url"])
+
+    response = complete_upload(client, token, upload_response["id"], list(UPLOADS))
+    assert response.status_code == 200
+    complete_response = response.json()
+    assert complete_response["id"] == upload_response["id"]
+    assert complete_response["registered_keys"] == list(UPLOADS)
+    assert complete_response["missing_keys"] == []
+
+    upload_obj = Upload.objects.get(id=upload_response["id"])
+    assert upload_obj.completed_at
+    file_uploads = {f.key: f for f in FileUpload.objects.filter(upload=upload_obj)}
+    assert set(file_uploads) == set(UPLOADS)
+    for key, upload in UPLOADS.items():
+        file_upload = file_uploads[key]
+        assert file_upload.size == len(upload.body)
+        assert file_upload.compressed is key.endswith(".sym")
+        if key.endswith(".sym"):
+            sym_data = extract_sym_header_data_from_bytes(upload.original_body)
+            assert file_upload.debug_id == sym_data["debug_id"]
+            assert file_upload.code_file == sym_data["code_file"]
+            assert file_upload.code_id == sym_data["code_id"]
+        else:
+            assert file_upload.debug_id is None
+
+    # The uploaded sym files can be found by code file and code id.
+    assert FileUpload.objects.lookup_by_syminfo("qipcap64.dll", "6A4806059000").exists()
+
+    assert_timing_count(metricsmock, "upload_v2_complete", 1)
+    assert_timing_count(
+        metricsmock,
+        "upload_read_sym_header",
+        len([key for key in UPLOADS if key.endswith(".sym")]),
+    )
+
+
+def send_file_specs(
+    client: Client, token: Token, upload_id: int, file_specs: list[FileSpecRequest]
+) -> list[dict[str, Any]]:
+    """Send a chunk of files of a upload v2 session and decode the NDJSON response."""
+    response = client.post(
+        reverse("upload:upload_v2_files", args=(upload_id,)),
+        data=msgspec.json.encode(UploadRequest(files=file_specs)),
+        content_type="application/json",
+        headers={"Auth-Token": token.key},
+    )
+    assert response.status_code == 200
+    assert response["Content-Type"] == "application/x-ndjson"
+    lines = b"".join(response.streaming_content).splitlines()
+    return [msgspec.json.decode(line) for line in lines]
+
+
+@pytest.mark.parametrize("try_storage", [False, True])
+@pytest.mark.django_db
+def test_upload_v2_session(
+    client: Client,
+    uploaderuser: User,
+    symbol_storage: SymbolStorage,
+    metricsmock: MetricsMock,
+    try_storage: bool,
+):
+    token = create_token(uploaderuser, try_storage)
+    uploads = list(UPLOADS.values())
+    # The first file is already in storage.
+    uploads[0].upload(symbol_storage, try_storage)
+
+    response = client.post(
+        reverse("upload:upload_v2_session"), headers={"Auth-Token": token.key}
+    )
+    assert response.status_code == 201
+    session = response.json()
+    assert session["try_symbols"] is try_storage
+    assert session["upload_protocol"] == "gcs-resumable"
+    assert session["user"] == uploaderuser.email
+
+    # Send the files in two chunks, and record each chunk once it's uploaded.
+    chunks = [uploads[:3], uploads[3:]]
+    for index, chunk in enumerate(chunks):
+        file_specs = send_file_specs(
+            client, token, session["id"], [u.file_spec() for u in chunk]
+        )
+        actions = {f["key"]: f["action"] for f in file_specs}
+        assert set(actions) == {u.key for u in chunk}
+        uploaded_keys = []
+        for upload in chunk:
+            action = actions[upload.key]
+            if upload is uploads[0]:
+                assert action["type"] == "skip"
+                continue
+            assert action["type"] == "upload"
+            upload.upload_to_session_url(action["url"])
+            uploaded_keys.append(upload.key)
+
+        final = index == len(chunks) - 1
+        response = client.post(
+            reverse("upload:upload_v2_complete", args=(session["id"],)),
+            data=msgspec.json.encode(
+                UploadCompleteRequest(keys=uploaded_keys, final=final)
+            ),
+            content_type="application/json",
+            headers={"Auth-Token": token.key},
+        )
+        assert response.status_code == 200
+        complete_response = response.json()
+        assert complete_response["registered_keys"] == uploaded_keys
+        assert (complete_response["completed_at"] is not None) is final
+
+    (upload_obj,) = Upload.objects.all()
+    assert upload_obj.id == session["id"]
+    assert upload_obj.try_symbols is try_storage
+    assert upload_obj.completed_at
+    assert upload_obj.skipped_keys == [uploads[0].key]
+    assert upload_obj.size == sum(len(u.original_body) for u in uploads)
+    assert FileUpload.objects.filter(upload=upload_obj).count() == len(uploads) - 1
+
+    assert_timing_count(metricsmock, "upload_v2_session", 1)
+    assert_timing_count(metricsmock, "upload_v2_files", 2)
+    assert_incr_count(
+        metricsmock,
+        "upload_uploads",
+        1,
+        tags=[f"try:{try_storage}", AnyTagValue("bucket")],
+    )
+
+
+@pytest.mark.django_db
+def test_upload_v2_session_unread_response(
+    client: Client, uploaderuser: User, symbol_storage: SymbolStorage
+):
+    token = create_token(uploaderuser, False)
+    response = client.post(
+        reverse("upload:upload_v2_session"), headers={"Auth-Token": token.key}
+    )
+    upload_id = response.json()["id"]
+    file_specs = [u.file_spec() for u in UPLOADS.values()]
+    response = client.post(
+        reverse("upload:upload_v2_files", args=(upload_id,)),
+        data=msgspec.json.encode(UploadRequest(files=file_specs)),
+        content_type="application/json",
+        headers={"Auth-Token": token.key},
+    )
+    assert response.status_code == 200
+    # Files are only recorded once their responses are sent.
+    assert Upload.objects.get(id=upload_id).size == 0
+    b"".join(response.streaming_content)
+    assert Upload.objects.get(id=upload_id).size == sum(s.size for s in file_specs)
+
+
+@pytest.mark.django_db
+def test_upload_v2_session_errors(
+    client: Client,
+    uploaderuser: User,
+    fakeuser: User,
+    symbol_storage: SymbolStorage,
+    settings: SettingsWrapper,
+):
+    settings.UPLOAD_V2_MAX_FILES_PER_REQUEST = 1
+    token = create_token(uploaderuser, False)
+    response = client.post(
+        reverse("upload:upload_v2_session"), headers={"Auth-Token": token.key}
+    )
+    upload_id = response.json()["id"]
+    url = reverse("upload:upload_v2_files", args=(upload_id,))
+
+    def post(files):
+        return client.post(
+            url,
+            data=msgspec.json.encode(UploadRequest(files=files)),
+            content_type="application/json",
+            headers={"Auth-Token": token.key},
+        )
+
+    file_specs = [u.file_spec() for u in UPLOADS.values()][:2]
+    response = post(file_specs)
+    assert response.status_code == 400
+    assert response.json()["error"] == "too many files"
+
+    # Files can't be added to completed uploads.
+    Upload.objects.filter(id=upload_id).update(completed_at=timezone.now())
+    response = post(file_specs[:1])
+    assert response.status_code == 409
+
+    # Files can't be added to uploads of other users.
+    Upload.objects.filter(id=upload_id).update(completed_at=None, user=fakeuser)
+    response = post(file_specs[:1])
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_upload_v2_complete_missing(
+    client: Client, uploaderuser: User, symbol_storage: SymbolStorage
+):
+    token = create_token(uploaderuser, False)
+
+    file_specs = [u.file_spec() for u in UPLOADS.values()]
+    upload_response = perform_uploads(client, token, file_specs)
+    # Only upload the first file.
+    upload = next(iter(UPLOADS.values()))
+    upload.upload_to_session_url(upload_response["files"][0]["action"]["url"])
+
+    response = complete_upload(client, token, upload_response["id"], list(UPLOADS))
+    assert response.status_code == 200
+    complete_response = response.json()
+    assert complete_response["registered_keys"] == [upload.key]
+    assert complete_response["missing_keys"] == list(UPLOADS)[1:]
+    assert FileUpload.objects.filter(upload_id=upload_response["id"]).count() == 1
+
+    # The upload can't be completed again.
+    response = complete_upload(client, token, upload_response["id"], [upload.key])
+    assert response.status_code == 409
+    assert response.json()["error"] == "upload already completed"
+
+
+@pytest.mark.django_db
+def test_upload_v2_complete_errors(
+    client: Client, uploaderuser: User, fakeuser: User, symbol_storage: SymbolStorage
+):
+    token = create_token(uploaderuser, False)
+    upload_response = perform_uploads(client, token, [])
+
+    response = complete_upload(client, token, upload_response["id"], ["x%l.pdb/1/x"])
+    assert response.status_code == 400
+    assert response.json()["error"] == "invalid key"
+
+    response = complete_upload(client, token, upload_response["id"] + 1, [])
+    assert response.status_code == 404
+
+    # Only keys the upload handed out upload session URLs for can be recorded.
+    upload = next(iter(UPLOADS.values()))
+    response = complete_upload(client, token, upload_response["id"], [upload.key])
+    assert response.status_code == 400
+    assert response.json()["error"] == "key not initiated by this upload"
+
+    # Uploads of other users can't be completed.
+    Upload.objects.filter(id=upload_response["id"]).update(user=fakeuser)
+    response = complete_upload(client, token, upload_response["id"], [])
+    assert response.status_code == 404
+
+
+@pytest.mark.django_db
+def test_upload_v2_complete_concurrently(
+    client: Client, uploaderuser: User, symbol_storage: SymbolStorage, monkeypatch
+):
+    token = create_token(uploaderuser, False)
+    upload = next(iter(UPLOADS.values()))
+    upload_response = perform_uploads(client, token, [upload.file_spec()])
+    upload.upload_to_session_url(upload_response["files"][0]["action"]["url"])
+
+    register_file_upload = views.register_file_upload
+
+    def register_while_completed(key, **kwargs):
+        # Another request completes the upload while this one checks the files.
+        Upload.objects.filter(id=upload_response["id"]).update(
+            completed_at=timezone.now()
+        )
+        return register_file_upload(key, **kwargs)
+
+    monkeypatch.setattr(views, "register_file_upload", register_while_completed)
+    response = complete_upload(client, token, upload_response["id"], [upload.key])
+    assert response.status_code == 409
+    assert not FileUpload.objects.filter(upload_id=upload_response["id"]).exists()
+
+
+@pytest.mark.django_db
+def test_upload_v2_complete_repeated_keys(
+    client: Client, uploaderuser: User, symbol_storage: SymbolStorage
+):
+    token = create_token(uploaderuser, False)
+    response = client.post(
+        reverse("upload:upload_v2_session"), headers={"Auth-Token": token.key}
+    )
+    session = response.json()
+    uploads = list(UPLOADS.values())[:2]
+    file_specs = send_file_specs(
+        client, token, session["id"], [u.file_spec() for u in uploads]
+    )
+    actions = {f["key"]: f["action"] for f in file_specs}
+    for upload in uploads:
+        upload.upload_to_session_url(actions[upload.key]["url"])
+
+    def complete(keys):
+        response = client.post(
+            reverse("upload:upload_v2_complete", args=(session["id"],)),
+            data=msgspec.json.encode(UploadCompleteRequest(keys=keys, final=False)),
+            content_type="application/json",
+            headers={"Auth-Token": token.key},
+        )
+        assert response.status_code == 200
+        return response.json()
+
+    complete_response = complete([uploads[0].key])
+    assert complete_response["registered_keys"] == [uploads[0].key]
+    assert complete_response["already_registered_keys"] == []
+
+    # Keys recorded by an earlier request aren't recorded again.
+    complete_response = complete([uploads[0].key, uploads[1].key])
+    assert complete_response["registered_keys"] == [uploads[1].key]
+    assert complete_response["already_registered_keys"] == [uploads[0].key]
+    assert FileUpload.objects.filter(upload_id=session["id"]).count() == 2
+
+
+@pytest.mark.django_db
+def test_upload_v2_complete_repeated_keys_concurrently(
+    client: Client, uploaderuser: User, symbol_storage: SymbolStorage, monkeypatch
+):
+    token = create_token(uploaderuser, False)
+    response = client.post(
+        reverse("upload:upload_v2_session"), headers={"Auth-Token": token.key}
+    )
+    session = response.json()
+    upload = next(iter(UPLOADS.values()))
+    (file_spec,) = send_file_specs(client, token, session["id"], [upload.file_spec()])
+    upload.upload_to_session_url(file_spec["action"]["url"])
+
+    register_file_upload = views.register_file_upload
+
+    def register_twice(key, **kwargs):
+        # Another request of the session records the file while this one checks it.
+        register_file_upload(key, **kwargs).save()
+        return register_file_upload(key, **kwargs)
+
+    monkeypatch.setattr(views, "register_file_upload", register_twice)
+    response = client.post(
+        reverse("upload:upload_v2_complete", args=(session["id"],)),
+        data=msgspec.json.encode(UploadCompleteRequest(keys=[upload.key])),
+        content_type="application/json",
+        headers={"Auth-Token": token.key},
+    )
+    assert response.status_code == 200
+    complete_response = response.json()
+    assert complete_response["registered_keys"] == []
+    assert complete_response["already_registered_keys"] == [upload.key]
+    assert FileUpload.objects.filter(upload_id=session["id"]).count() == 1
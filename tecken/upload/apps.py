@@ -57,4 +57,5 @@ class UploadAppConfig(AppConfig):
         executor.init(
             settings.SYNCHRONOUS_UPLOAD_FILE_UPLOAD,
             settings.UPLOAD_FILE_UPLOAD_MAX_WORKERS or None,
+            settings.UPLOAD_FILE_UPLOAD_MAX_WORKERS_PER_REQUEST or None,
         )
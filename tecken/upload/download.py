@@ -0,0 +1,277 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from collections import deque
+from collections.abc import Iterator
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import os
+import struct
+import time
+import zipfile
+
+from django.conf import settings
+from requests import Session
+from requests.exceptions import RequestException
+
+from tecken.base.utils import filesizeformat
+from tecken.libmarkus import METRICS
+from tecken.upload.forms import UploadByDownloadRemoteError
+from tecken.upload.utils import FileMember, check_duplicate_members
+
+
+logger = logging.getLogger("tecken")
+
+# Signature and size of the "end of central directory" record at the end of a zip file.
+_EOCD_SIGNATURE = b"PK\x05\x06"
+_EOCD_SIZE = 22
+
+# The end of central directory record is followed by a comment of at most 64 KiB, so
+# reading this many bytes from the end of the file always includes the record.
+_TAIL_SIZE = _EOCD_SIZE + 0xFFFF
+
+# Size of the chunks the body of the archive is read in.
+_CHUNK_SIZE = 1024 * 1024
+
+# Number of times downloading a range is attempted if the connection drops while
+# reading the response. Failing requests are retried by the session in addition to
+# this.
+_RANGE_ATTEMPTS = 3
+
+
+class StreamingUnavailable(Exception):
+    """The archive can't be downloaded and extracted in streaming mode."""
+
+
+class RangeRequestsUnsupported(StreamingUnavailable):
+    """The server doesn't respond to range requests with partial content."""
+
+
+def _download_range(session: Session, url: str, fd: int, start: int, end: int):
+    """Download the bytes from start to end (exclusive) of url into the file.
+
+    The bytes are written at the same offsets in the file. If the connection drops
+    while reading the response, the rest of the range is requested again.
+
+    :raises RangeRequestsUnsupported: the server didn't respond with partial content
+    :raises UploadByDownloadRemoteError: the range couldn't be downloaded
+    """
+    offset = start
+    for _ in range(_RANGE_ATTEMPTS):
+        try:
+            response = session.get(
+                url, headers={"Range": f"bytes={offset}-{end - 1}"}, stream=True
+            )
+            if response.status_code != 206:
+                response.close()
+                raise RangeRequestsUnsupported(
+                    f"range request returned status code {response.status_code}"
+                )
+            for chunk in response.iter_content(chunk_size=_CHUNK_SIZE):
+                chunk = chunk[: end - offset]
+                os.pwrite(fd, chunk, offset)
+                offset += len(chunk)
+        except RequestException as exc:
+            logger.info(f"Error downloading {url} at {offset}: {exc!r}")
+        if offset >= end:
+            return
+    raise UploadByDownloadRemoteError(f"Incomplete download of {url}")
+
+
+def download_ranges(
+    session: Session, url: str, path: str, start: int, end: int
+) -> Iterator[int]:
+    """Download the bytes from start to end (exclusive) of url into the file at path.
+
+    The range is split into segments of UPLOAD_BY_DOWNLOAD_SEGMENT_SIZE bytes, which
+    are downloaded with up to UPLOAD_BY_DOWNLOAD_CONNECTIONS concurrent range
+    requests. Each segment is written at its offset into the file, which is created
+    and extended to end if needed.
+
+    Yields the offset up to which all data is downloaded every time it advances, so
+    the caller can start processing the beginning of the file while the rest is still
+    downloading.
+
+    :raises RangeRequestsUnsupported: the server didn't respond with partial content
+    :raises UploadByDownloadRemoteError: the download failed
+    """
+    segment_size = settings.UPLOAD_BY_DOWNLOAD_SEGMENT_SIZE
+    segments = [
+        (offset, min(offset + segment_size, end))
+        for offset in range(start, end, segment_size)
+    ]
+    fd = os.open(path, os.O_WRONLY | os.O_CREAT, 0o644)
+    pool = ThreadPoolExecutor(max_workers=settings.UPLOAD_BY_DOWNLOAD_CONNECTIONS)
+    try:
+        if os.fstat(fd).st_size < end:
+            os.ftruncate(fd, end)
+        begin = time.perf_counter()
+        futures = [
+            pool.submit(_download_range, session, url, fd, segment_start, segment_end)
+            for segment_start, segment_end in segments
+        ]
+        # Segments are submitted in order, so waiting for them in order yields the
+        # offset up to which the file is complete.
+        for future, (_, segment_end) in zip(futures, segments, strict=True):
+            future.result()
+            yield segment_end
+        duration = time.perf_counter() - begin
+    finally:
+        pool.shutdown(cancel_futures=True)
+        os.close(fd)
+
+    throughput = (end - start) / duration if duration else 0
+    METRICS.histogram("upload_download_by_url_ranges", len(segments))
+    METRICS.histogram("upload_download_by_url_throughput", int(throughput))
+    logger.info(
+        f"Downloaded {filesizeformat(end - start)} in {len(segments)} ranges "
+        f"({filesizeformat(throughput)}/s)."
+    )
+
+
+class StreamingZipDownload:
+    """Download a zip archive by URL and extract each member as soon as it's downloaded.
+
+    The central directory at the end of the archive is read first with range requests,
+    so the listing of the archive is known, and can be validated, before the rest of it
+    is downloaded. The rest is then downloaded into a preallocated file with
+    concurrent range requests, and every member is extracted once all of the data up
+    to its end has arrived. This allows
+    uploading members while the archive is still downloading.
+
+    Usage::
+
+        download = StreamingZipDownload(session, url, size, root_dir, name)
+        file_listing = download.read_listing()
+        for member in download.download_and_extract():
+            ...
+
+    :arg session: the requests session to use
+    :arg url: the URL of the zip archive; the server has to support range requests
+    :arg size: the size of the archive in bytes
+    :arg root_dir: the directory to download the archive to and extract it into
+    :arg name: the file name of the archive
+    """
+
+    def __init__(self, session: Session, url: str, size: int, root_dir: str, name: str):
+        self.session = session
+        self.url = url
+        self.size = size
+        self.root_dir = root_dir
+        self.path = os.path.join(root_dir, name)
+        self.fp = None
+        self.zf = None
+        self.members = []
+        self.body_end = 0
+
+    def _get_range(self, start: int, end: int) -> bytes:
+        """Return the bytes from start to end (exclusive) of the archive."""
+        try:
+            response = self.session.get(
+                self.url, headers={"Range": f"bytes={start}-{end - 1}"}
+            )
+        except RequestException as exc:
+            raise UploadByDownloadRemoteError(
+                f"{exc.__class__.__name__} trying to open {self.url}"
+            ) from exc
+        if response.status_code != 206:
+            raise RangeRequestsUnsupported(
+                f"range request returned status code {response.status_code}"
+            )
+        return response.content
+
+    def read_listing(self) -> list[FileMember]:
+        """Read the central directory of the archive and return its files.
+
+        The returned members aren't extracted yet.
+
+        :raises StreamingUnavailable: the archive can't be processed in streaming mode
+        :raises zipfile.BadZipFile: the central directory is invalid
+        :raises DuplicateFileDifferentSize: the archive has two different files with the
+            same name
+        """
+        tail_start = max(0, self.size - _TAIL_SIZE)
+        tail = self._get_range(tail_start, self.size)
+        eocd = tail.rfind(_EOCD_SIGNATURE)
+        if eocd == -1 or len(tail) - eocd < _EOCD_SIZE:
+            raise StreamingUnavailable("end of central directory not found")
+        cd_size, cd_offset = struct.unpack("<II", tail[eocd + 12 : eocd + 20])
+        if cd_offset == 0xFFFFFFFF:
+            raise StreamingUnavailable("zip64 archives are not supported")
+        # Computing the start of the central directory from its size rather than
+        # using its offset also works if there's data prepended to the archive.
+        cd_start = tail_start + eocd - cd_size
+        if cd_start < 0:
+            raise StreamingUnavailable("invalid central directory size")
+
+        with open(self.path, "wb") as f:
+            f.truncate(self.size)
+            f.seek(tail_start)
+            f.write(tail)
+            if cd_start < tail_start:
+                f.seek(cd_start)
+                f.write(self._get_range(cd_start, tail_start))
+        self.body_end = min(cd_start, tail_start)
+
+        # The ZipFile only reads the central directory at this point, so it doesn't
+        # matter that the rest of the file isn't downloaded yet. The file is opened
+        # unbuffered so data written after this is never shadowed by a stale buffer.
+        self.fp = open(self.path, "rb", buffering=0)
+        self.zf = zipfile.ZipFile(self.fp)
+        check_duplicate_members(self.zf)
+        infos = [info for info in self.zf.infolist() if not info.is_dir()]
+        self.members = sorted(infos, key=lambda info: info.header_offset)
+        sizes = {info.filename: info.file_size for info in infos}
+        return [
+            FileMember(os.path.join(self.root_dir, filename), filename, size=size)
+            for filename, size in sizes.items()
+        ]
+
+    def _member_end(self, index: int) -> int:
+        """Return the offset up to which the archive has to be downloaded for the
+        member with the given index to be complete."""
+        # Everything from body_end on was already read together with the central
+        # directory.
+        if index + 1 < len(self.members):
+            return min(self.members[index + 1].header_offset, self.body_end)
+        return self.body_end
+
+    def download_and_extract(self) -> Iterator[FileMember]:
+        """Download the rest of the archive and yield each file once it's extracted.
+
+        Must be called after read_listing(). The downloaded archive is deleted once all
+        files are extracted.
+
+        :raises UploadByDownloadRemoteError: the download failed
+        :raises zipfile.BadZipFile: a member of the archive is invalid
+        """
+        pending = deque(enumerate(self.members))
+        extracted = set()
+
+        def extract_downloaded(downloaded):
+            while pending and self._member_end(pending[0][0]) <= downloaded:
+                _, info = pending.popleft()
+                path = self.zf.extract(info, self.root_dir)
+                if info.filename not in extracted:
+                    extracted.add(info.filename)
+                    yield FileMember(path, info.filename)
+
+        try:
+            for downloaded in download_ranges(
+                self.session, self.url, self.path, 0, self.body_end
+            ):
+                yield from extract_downloaded(downloaded)
+        except RangeRequestsUnsupported as exc:
+            # Some members may already be yielded, so it's too late to fall back.
+            raise UploadByDownloadRemoteError(
+                f"{self.url} stopped supporting range requests"
+            ) from exc
+        else:
+            # Members after the end of the body were read with the central directory.
+            yield from extract_downloaded(self.body_end)
+            METRICS.incr("upload_download_by_url_streaming")
+        finally:
+            self.zf.close()
+            self.fp.close()
+            os.remove(self.path)
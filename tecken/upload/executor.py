@@ -2,25 +2,257 @@
 # License, v. 2.0. If a copy of the MPL was not distributed with this
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
+from collections import Counter, deque
 from collections.abc import Iterator
 from concurrent.futures import Executor, Future, ThreadPoolExecutor
-from typing import Callable, Optional, TypeVar
+from contextlib import contextmanager
+from contextvars import ContextVar
+import functools
+import threading
+import time
+from typing import Any, Callable, Optional, TypeVar
 
 from encore.concurrent.futures.synchronous import SynchronousExecutor
 
+from tecken.libmarkus import METRICS
+
 
 # A global thread pool executor used for parallel file uploads.
 EXECUTOR: Optional[Executor] = None
 
 
-def init(synchronous: bool, max_workers: int):
+def task_name(fn: Callable) -> str:
+    """Return the name of the function a task runs, looking through partials."""
+    while isinstance(fn, functools.partial):
+        fn = fn.func
+    return getattr(fn, "__name__", fn.__class__.__name__)
+
+
+# The scheduling group of the tasks submitted in the current context. Tasks submitted
+# outside of a group share the group None.
+_GROUP: ContextVar[Optional[object]] = ContextVar("upload_executor_group", default=None)
+
+
+@contextmanager
+def scheduling_group():
+    """Submit the tasks in this context as a separate group.
+
+    The executor runs tasks of different groups in turns, so a request that submits a
+    few tasks doesn't wait behind all tasks of a request that submitted many of them.
+    This can be used as a decorator of views.
+
+    """
+    token = _GROUP.set(object())
+    try:
+        yield
+    finally:
+        _GROUP.reset(token)
+
+
+class _Task:
+    __slots__ = ("future", "name", "group", "submitted_at", "fn", "args", "kwargs")
+
+    def __init__(self, future, name, group, fn, args, kwargs):
+        self.future = future
+        self.name = name
+        self.group = group
+        self.submitted_at = time.perf_counter()
+        self.fn = fn
+        self.args = args
+        self.kwargs = kwargs
+
+
+class FairThreadPoolExecutor(ThreadPoolExecutor):
+    """A thread pool executor that shares its threads fairly and reports how busy it is.
+
+    Tasks are queued per scheduling group (see scheduling_group()), and handed to a
+    thread only once one is free, taking turns between the groups with queued tasks.
+    Optionally, the number of threads a single group can use at the same time is
+    capped, so long tasks of one group can't take up all threads either.
+
+    Whenever they change, this emits the number of tasks waiting for a thread and the
+    number of tasks running. For every task, it emits how long it
+    waited for a thread and how long it ran, tagged with the name of the task
+    function.
+
+    :arg max_workers: the number of threads
+    :arg max_workers_per_group: the number of threads a group can use at the same
+        time; None for no limit
+
+    """
+
+    def __init__(self, max_workers=None, max_workers_per_group=None, **kwargs):
+        super().__init__(max_workers=max_workers, **kwargs)
+        self._max_workers_per_group = max_workers_per_group or self._max_workers
+        self._stats_lock = threading.Lock()
+        self._idle = threading.Condition(self._stats_lock)
+        # Tasks waiting for a thread by group, and the groups with waiting tasks in
+        # the order they get their next turn.
+        self._pending: dict[object, deque[_Task]] = {}
+        self._turns: deque[object] = deque()
+        self._running: Counter = Counter()
+        self._closed = False
+        self._queued = 0
+        self._active = 0
+        self._completed = 0
+        self._submitted = Counter()
+        # The queue depth and the number of active tasks last emitted as gauges.
+        self._reported_queued: Optional[int] = None
+        self._reported_active: Optional[int] = None
+
+    def submit(self, fn, /, *args, **kwargs):
+        task = _Task(Future(), task_name(fn), _GROUP.get(), fn, args, kwargs)
+        with self._stats_lock:
+            if self._closed:
+                raise RuntimeError("cannot schedule new futures after shutdown")
+            if task.group not in self._pending:
+                self._pending[task.group] = deque()
+                self._turns.append(task.group)
+            self._pending[task.group].append(task)
+            self._queued += 1
+            self._submitted[task.name] += 1
+        self._dispatch()
+        return task.future
+
+    def _next_task(self) -> Optional[_Task]:
+        """Take the next task to run off the queues, if a thread is free for it.
+
+        Must be called with the stats lock held.
+
+        """
+        if self._active >= self._max_workers:
+            return None
+        for _ in range(len(self._turns)):
+            group = self._turns.popleft()
+            if self._running[group] >= self._max_workers_per_group:
+                self._turns.append(group)
+                continue
+            tasks = self._pending[group]
+            task = tasks.popleft()
+            if tasks:
+                self._turns.append(group)
+            else:
+                del self._pending[group]
+            self._queued -= 1
+            self._active += 1
+            self._running[group] += 1
+            return task
+        return None
+
+    def _report(self):
+        """Emit the queue depth and the number of active tasks if they changed.
+
+        Must be called with the stats lock held, so the last emitted values are the
+        current ones.
+
+        """
+        if self._queued != self._reported_queued:
+            self._reported_queued = self._queued
+            METRICS.gauge("upload_executor_queue_depth", self._queued)
+        if self._active != self._reported_active:
+            self._reported_active = self._active
+            METRICS.gauge("upload_executor_active", self._active)
+
+    def _dispatch(self):
+        """Hand queued tasks to the thread pool while threads are free."""
+        while True:
+            with self._stats_lock:
+                task = self._next_task()
+                if task is None:
+                    self._report()
+                    return
+            try:
+                super().submit(self._run, task)
+            except RuntimeError:
+                # The thread pool was shut down without waiting for queued tasks.
+                task.future.cancel()
+                self._finished(task)
+
+    def _run(self, task: _Task):
+        started_at = time.perf_counter()
+        try:
+            if not task.future.set_running_or_notify_cancel():
+                return
+            tags = [f"task:{task.name}"]
+            METRICS.timing(
+                "upload_executor_wait",
+                (started_at - task.submitted_at) * 1000,
+                tags=tags,
+            )
+            try:
+                result = task.fn(*task.args, **task.kwargs)
+            except BaseException as exc:
+                task.future.set_exception(exc)
+            else:
+                task.future.set_result(result)
+            METRICS.timing(
+                "upload_executor_run",
+                (time.perf_counter() - started_at) * 1000,
+                tags=tags,
+            )
+        finally:
+            self._finished(task)
+            self._dispatch()
+
+    def _finished(self, task: _Task):
+        with self._stats_lock:
+            self._active -= 1
+            self._completed += 1
+            self._running[task.group] -= 1
+            if not self._running[task.group]:
+                del self._running[task.group]
+            if not self._queued and not self._active:
+                self._idle.notify_all()
+
+    def shutdown(self, wait=True, *, cancel_futures=False):
+        with self._stats_lock:
+            self._closed = True
+            if cancel_futures:
+                for tasks in self._pending.values():
+                    for task in tasks:
+                        task.future.cancel()
+            if wait:
+                # Queued tasks are only handed to the thread pool as running tasks
+                # finish, so wait for them before shutting down the pool.
+                self._idle.wait_for(lambda: not self._queued and not self._active)
+        super().shutdown(wait=wait, cancel_futures=cancel_futures)
+
+    def state(self) -> dict[str, Any]:
+        """Return the current state of the pool."""
+        with self._stats_lock:
+            return {
+                "max_workers": self._max_workers,
+                "max_workers_per_group": self._max_workers_per_group,
+                "threads": len(self._threads),
+                "groups": len(self._pending.keys() | self._running.keys()),
+                "queued": self._queued,
+                "active": self._active,
+                "completed": self._completed,
+                "submitted": dict(self._submitted),
+            }
+
+
+def init(
+    synchronous: bool,
+    max_workers: Optional[int],
+    max_workers_per_group: Optional[int] = None,
+):
     """Initialize the executor."""
     global EXECUTOR
     if synchronous:
         # This is only applicable when running unit tests
         EXECUTOR = SynchronousExecutor()
     else:
-        EXECUTOR = ThreadPoolExecutor(max_workers=max_workers)
+        EXECUTOR = FairThreadPoolExecutor(
+            max_workers=max_workers, max_workers_per_group=max_workers_per_group
+        )
+
+
+def state() -> dict[str, Any]:
+    """Return the current state of the executor of this process."""
+    if isinstance(EXECUTOR, FairThreadPoolExecutor):
+        return EXECUTOR.state()
+    return {"synchronous": isinstance(EXECUTOR, SynchronousExecutor)}
 
 
 T = TypeVar("T")
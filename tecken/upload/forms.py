@@ -3,14 +3,16 @@
 # file, You can obtain one at https://mozilla.org/MPL/2.0/.
 
 import os
-from urllib.parse import urlparse
+from urllib.parse import urljoin, urlparse
 
 from requests.exceptions import ConnectionError, RetryError
 
 from django import forms
 from django.conf import settings
+from django.core.cache import cache
 
-from tecken.librequests import session_with_retries
+from tecken.libmarkus import METRICS
+from tecken.librequests import pooled_session
 
 
 class UploadByDownloadRemoteError(Exception):
@@ -49,33 +51,129 @@ class UploadByDownloadForm(forms.Form):
                     f"Not an allowed domain ({netloc_wo_port!r}) to download from."
                 )
 
+    def __init__(self, *args, session=None, **kwargs):
+        super().__init__(*args, **kwargs)
+        # All requests for the upload use the same session, so connections to the
+        # same host are reused.
+        self.session = session or pooled_session()
+
     def clean(self):
         cleaned_data = super().clean()
         if "url" in cleaned_data:
-            # In the main view code where the download actually happens,
-            # it'll follow any redirects automatically, but we want to
-            # do "recursive HEADs" to find out the size of the file.
-            # It also gives us an opportunity to record the redirect trail.
             url = cleaned_data["url"]
             parsed = urlparse(url)
-            response, redirect_urls = self.get_final_response(url)
+            response = None
+            if settings.UPLOAD_BY_DOWNLOAD_SKIP_HEAD:
+                response, redirect_urls = self.get_download_response(url)
+            if response is not None:
+                # The GET response is used for downloading the file, so there's no
+                # need for any HEAD requests.
+                final_url = response.url
+            else:
+                # In the main view code where the download actually happens,
+                # we download from the final URL, but we want to
+                # do "recursive HEADs" to find out the size of the file.
+                # It also gives us an opportunity to record the redirect trail.
+                final_url, redirect_urls = self.resolve_redirects(url)
+                response, more_redirect_urls = self.get_final_response(
+                    final_url, session=self.session
+                )
+                redirect_urls = redirect_urls + more_redirect_urls
+                if more_redirect_urls:
+                    final_url = more_redirect_urls[-1]
+                    self.cache_redirects(url, final_url, redirect_urls)
             content_length = response.headers["content-length"]
             cleaned_data["upload"] = {
                 "name": os.path.basename(parsed.path),
                 "size": int(content_length),
                 "redirect_urls": redirect_urls,
+                "accept_ranges": response.headers.get("accept-ranges") == "bytes",
+                "final_url": final_url,
+                # The open GET response if the HEAD requests were skipped
+                "response": response if response.request.method == "GET" else None,
             }
         return cleaned_data
 
     @staticmethod
-    def get_final_response(initial_url, max_redirects=5):
+    def _redirects_cache_key(url):
+        return f"upload_by_download_redirects::{url}"
+
+    @classmethod
+    def resolve_redirects(cls, url):
+        """Return (final URL, redirect URLs) for url from the cache.
+
+        Returns (url, []) if the redirects for url aren't cached.
+        """
+        cached = cache.get(cls._redirects_cache_key(url))
+        if cached is None:
+            METRICS.incr("upload_download_redirects_cache", tags=["result:miss"])
+            return url, []
+        METRICS.incr("upload_download_redirects_cache", tags=["result:hit"])
+        return cached["final_url"], cached["redirect_urls"]
+
+    @classmethod
+    def cache_redirects(cls, url, final_url, redirect_urls):
+        """Cache the final URL and redirect URLs for url."""
+        timeout = settings.UPLOAD_BY_DOWNLOAD_REDIRECTS_CACHE_TIMEOUT
+        if timeout:
+            cache.set(
+                cls._redirects_cache_key(url),
+                {"final_url": final_url, "redirect_urls": redirect_urls},
+                timeout,
+            )
+
+    def get_download_response(self, url, max_redirects=5):
+        """Return the streaming GET response for url and the URLs it redirected to.
+
+        Redirects are followed one at a time, since the session is shared and its
+        max_redirects can't be changed for a single request.
+
+        Returns None instead of the response if it doesn't have a Content-Length header.
+        """
+        redirect_urls = []
+        request_url = url
+        while True:
+            try:
+                response = self.session.get(
+                    request_url, stream=True, allow_redirects=False
+                )
+            except (ConnectionError, RetryError) as exc:
+                raise UploadByDownloadRemoteError(
+                    f"{exc.__class__.__name__} trying to open {request_url}"
+                ) from exc
+            if not response.is_redirect:
+                break
+            response.close()
+            if len(redirect_urls) >= max_redirects:
+                raise forms.ValidationError(f"Too many redirects trying to open {url}")
+            # The Location header may be relative to the URL that redirected.
+            request_url = urljoin(response.url, response.headers["location"])
+            redirect_urls.append(request_url)
+        if response.status_code >= 500:
+            response.close()
+            raise UploadByDownloadRemoteError(
+                f"{request_url} errored ({response.status_code})"
+            )
+        if response.status_code >= 400:
+            response.close()
+            raise forms.ValidationError(
+                f"{request_url} can't be found ({response.status_code})"
+            )
+        if "content-length" not in response.headers:
+            response.close()
+            return None, redirect_urls
+        return response, redirect_urls
+
+    @staticmethod
+    def get_final_response(initial_url, max_redirects=5, session=None):
         """return the final response when it 200 OK'ed and a list of URLs
         that we had to go through redirects of."""
         redirect_urls = []  # the mutable "store"
+        session = session or pooled_session()
 
         def get_response(url):
             try:
-                response = session_with_retries().head(url)
+                response = session.head(url)
                 status_code = response.status_code
             except ConnectionError as exc:
                 raise UploadByDownloadRemoteError(
@@ -0,0 +1,136 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from concurrent.futures import ThreadPoolExecutor
+import functools
+
+from django.core.management.base import BaseCommand
+from django.db.models import Value
+from django.db.models.functions import Coalesce
+
+from tecken.base.symbolstorage import symbol_storage
+from tecken.download.views import evict_syminfo_cache
+from tecken.libmarkus import METRICS
+from tecken.libstorage import StorageError
+from tecken.upload.models import FileUpload
+from tecken.upload.utils import read_sym_header_data
+
+
+SYMINFO_FIELDS = ["debug_filename", "debug_id", "code_file", "code_id", "generator"]
+
+
+def read_syminfo(file_upload, backends):
+    """Return (file_upload, sym header data) for a FileUpload record.
+
+    The sym header data is {} if the object doesn't exist or can't be parsed.
+    """
+    # This function is run in a thread and should not access the database.
+    backend = backends.get((file_upload.bucket_name, file_upload.try_symbols))
+    if backend is None:
+        return file_upload, {}
+    try:
+        return file_upload, read_sym_header_data(backend, file_upload.cleaned_key)
+    except StorageError:
+        return file_upload, {}
+
+
+class Command(BaseCommand):
+    """Populate the sym header fields of fileupload records of sym files missing them.
+
+    Only the beginning of each sym file is read from storage using range reads, so
+    this needs a bounded number of bytes per file no matter how large the file is.
+
+    Records are processed in order of their id in batches. Records whose sym file
+    can't be read or parsed are left as they are, and are retried the next time the
+    command runs.
+
+    """
+
+    help = "Populate missing sym header data of fileupload records from storage."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Whether or not to do a dry run."
+        )
+        parser.add_argument(
+            "--concurrency",
+            type=int,
+            default=50,
+            help="Number of sym files to read from storage concurrently.",
+        )
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=1000,
+            help="Number of records to read and update at a time.",
+        )
+        parser.add_argument(
+            "--limit",
+            type=int,
+            default=None,
+            help="Maximum number of records to process.",
+        )
+
+    def get_backends(self):
+        """Return a dict mapping (bucket name, try symbols) to the upload backend."""
+        storage = symbol_storage()
+        backends = {}
+        for try_storage in (False, True):
+            backend = storage.get_upload_backend(try_storage)
+            backends[(backend.bucket, try_storage)] = backend
+        return backends
+
+    @METRICS.timer_decorator("backfillsyminfo.timing")
+    def handle(self, *args, **options):
+        self.stdout.write("backfillsyminfo:")
+
+        is_dry_run = options["dry_run"]
+        if is_dry_run:
+            self.stdout.write(">>> THIS IS A DRY RUN.")
+
+        batch_size = options["batch_size"]
+        limit = options["limit"]
+        backends = self.get_backends()
+        file_uploads = (
+            FileUpload.objects.filter(key__iendswith=".sym", debug_id__isnull=True)
+            # Records of uploads that were deleted are assumed to be regular symbols.
+            .annotate(try_symbols=Coalesce("upload__try_symbols", Value(False)))
+            .order_by("id")
+        )
+
+        processed = updated = failed = 0
+        last_id = 0
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as pool:
+            while limit is None or processed < limit:
+                if limit is not None:
+                    batch_size = min(batch_size, limit - processed)
+                batch = list(file_uploads.filter(id__gt=last_id)[:batch_size])
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                processed += len(batch)
+
+                to_update = []
+                results = pool.map(
+                    functools.partial(read_syminfo, backends=backends), batch
+                )
+                for file_upload, sym_data in results:
+                    if not sym_data.get("debug_id"):
+                        failed += 1
+                        continue
+                    for field in SYMINFO_FIELDS:
+                        setattr(file_upload, field, sym_data[field])
+                    to_update.append(file_upload)
+
+                if not is_dry_run:
+                    FileUpload.objects.bulk_update(to_update, SYMINFO_FIELDS)
+                    # Lookups of the backfilled code files may be cached as not found.
+                    evict_syminfo_cache(to_update)
+                updated += len(to_update)
+                METRICS.incr("backfillsyminfo.updated", len(to_update))
+                METRICS.incr("backfillsyminfo.failed", len(batch) - len(to_update))
+
+        self.stdout.write(
+            f">>> processed={processed}, updated={updated}, failed={failed}"
+        )
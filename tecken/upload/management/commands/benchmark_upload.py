@@ -0,0 +1,394 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from collections import defaultdict
+import gzip
+import hashlib
+import os
+import random
+import shutil
+import statistics
+import tempfile
+import time
+import warnings
+import zipfile
+
+from django.conf import settings
+from django.contrib.auth.models import Group, Permission, User
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.urls import reverse
+from markus.testing import MetricsMock
+import msgspec
+import requests
+
+from tecken.base.symbolstorage import symbol_storage
+from tecken.base.utils import allowed_host
+from tecken.tokens.models import Token
+from tecken.upload import executor
+from tecken.upload.utils import upload_file_upload
+from tecken.upload.views import FileSpecRequest, UploadCompleteRequest, UploadRequest
+
+
+# Stages of the upload pipeline and the timing metrics they emit, in pipeline order.
+STAGES = {
+    "extract": "upload_dump_and_extract",
+    "exists": "upload_file_exists",
+    "md5": "upload_md5_hash",
+    "gzip": "upload_gzip_payload",
+    "put": "upload_put_object",
+    "copy": "upload_copy_object",
+    "read_sym_header": "upload_read_sym_header",
+    "db_insert": "upload_save_file_uploads",
+}
+
+# Stages of a v2 upload that happen in the client.
+CLIENT_STAGES = ["client_md5", "client_gzip", "client_put"]
+
+# Size of the block of symbol records repeated to fill a sym file.
+_BLOCK_SIZE = 64 * 1024
+
+# Sym files have to be large enough to hold their header.
+_MIN_FILE_SIZE = 256
+
+
+class SyntheticSymFile:
+    """A sym file with a valid header followed by FUNC and line records.
+
+    The records are a random block repeated up to the size of the file, so large files
+    can be generated quickly while still compressing like real ones.
+
+    """
+
+    def __init__(self, index: int, size: int, rng: random.Random):
+        self.debug_file = f"benchmark{index}.pdb"
+        self.debug_id = rng.randbytes(16).hex().upper() + "1"
+        self.code_file = f"benchmark{index}.dll"
+        self.code_id = rng.randbytes(6).hex().upper()
+        self.sym_file = f"benchmark{index}.sym"
+        self.size = size
+        self.seed = rng.getrandbits(64)
+
+    @property
+    def key(self) -> str:
+        return f"{self.debug_file}/{self.debug_id}/{self.sym_file}"
+
+    def header(self) -> bytes:
+        return (
+            f"MODULE windows x86_64 {self.debug_id} {self.debug_file}\n"
+            f"INFO CODE_ID {self.code_id} {self.code_file}\n"
+        ).encode("utf-8")
+
+    def block(self) -> bytes:
+        rng = random.Random(self.seed)
+        lines = []
+        size = 0
+        while size < _BLOCK_SIZE:
+            address = rng.getrandbits(32)
+            line = (
+                f"FUNC {address:x} {rng.getrandbits(12):x} 0 function_{address:x}\n"
+                f"{address:x} {rng.getrandbits(8):x} {rng.randrange(10000)} "
+                f"{rng.randrange(500)}\n"
+            )
+            lines.append(line)
+            size += len(line)
+        return "".join(lines).encode("utf-8")
+
+    def write(self, fp):
+        """Write the contents of the file to a binary file object."""
+        header = self.header()
+        fp.write(header[: self.size])
+        remaining = self.size - len(header)
+        if remaining > 0:
+            block = self.block()
+            while remaining > 0:
+                chunk = block[:remaining]
+                fp.write(chunk)
+                remaining -= len(chunk)
+
+
+def make_archive(path, files, file_size, duplicates=0, seed=0):
+    """Write a zip archive of synthetic sym files and return them.
+
+    :arg path: the path of the archive to write
+    :arg files: the number of distinct sym files in the archive
+    :arg file_size: the size of each sym file in bytes
+    :arg duplicates: the number of sym files that are added to the archive twice
+    :arg seed: the seed for generating the files
+
+    :returns: list of SyntheticSymFile
+
+    """
+    rng = random.Random(seed)
+    sym_files = [SyntheticSymFile(index, file_size, rng) for index in range(files)]
+    with zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED) as zf:
+        # Duplicate members with the same size are valid in uploaded archives.
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore", UserWarning)
+            for sym_file in sym_files + sym_files[:duplicates]:
+                with zf.open(sym_file.key, "w", force_zip64=True) as fp:
+                    sym_file.write(fp)
+    return sym_files
+
+
+def write_sym_file(sym_file, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "wb") as fp:
+        sym_file.write(fp)
+
+
+class Command(BaseCommand):
+    """Benchmark the upload API with synthetic symbols archives.
+
+    This generates zip archives of synthetic sym files of a configurable shape, uploads
+    them with v1 of the upload API (the whole archive) and v2 (the individual files
+    uploaded to storage by the client), and reports the time spent in each stage of the
+    upload pipeline, such as extracting, hashing, compressing, checking for existing
+    files, writing to storage and inserting the fileupload records.
+
+    A fraction of the files can be uploaded to storage before each run, to measure
+    uploads where some of the files are skipped. Every run uses new sym files, so runs
+    don't skip each other's files.
+
+    Uploads are sent to the upload views in-process. This is meant to be run in the
+    local development environment against the GCS emulator and Postgres.
+
+    """
+
+    help = "Benchmark the upload API with synthetic symbols archives."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--files",
+            type=int,
+            default=100,
+            help="Number of sym files in each archive.",
+        )
+        parser.add_argument(
+            "--file-size",
+            type=int,
+            default=10 * 1024,
+            help="Size of each sym file in bytes.",
+        )
+        parser.add_argument(
+            "--duplicates",
+            type=int,
+            default=0,
+            help="Number of sym files that are added to each archive twice.",
+        )
+        parser.add_argument(
+            "--uploaded-ratio",
+            type=float,
+            default=0.0,
+            help="Fraction of the sym files to upload to storage before each run.",
+        )
+        parser.add_argument(
+            "--protocol",
+            choices=["v1", "v2", "both"],
+            default="both",
+            help="Version of the upload API to benchmark.",
+        )
+        parser.add_argument(
+            "--iterations",
+            type=int,
+            default=1,
+            help="Number of uploads for each version of the upload API.",
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=None,
+            help=(
+                "Number of upload executor threads. Defaults to "
+                "UPLOAD_FILE_UPLOAD_MAX_WORKERS."
+            ),
+        )
+        parser.add_argument(
+            "--seed",
+            type=int,
+            default=0,
+            help="Seed for generating the sym files, so runs can be compared.",
+        )
+        parser.add_argument(
+            "--output",
+            default=None,
+            help="Only write a synthetic archive to this path and exit.",
+        )
+
+    def get_token(self):
+        """Return an upload token of a benchmark user."""
+        user, _ = User.objects.get_or_create(
+            username="benchmark_upload", defaults={"email": "benchmark@example.com"}
+        )
+        user.groups.add(Group.objects.get(name="Uploaders"))
+        token = Token.objects.create(user=user, notes="benchmark_upload")
+        token.permissions.add(Permission.objects.get(codename="upload_symbols"))
+        return token
+
+    def pre_upload(self, sym_files, workspace, ratio):
+        """Upload a fraction of the sym files to storage like the upload API does."""
+        backend = symbol_storage().get_upload_backend(False)
+        for sym_file in sym_files[: round(len(sym_files) * ratio)]:
+            path = os.path.join(workspace, "pre", sym_file.key)
+            write_sym_file(sym_file, path)
+            upload_file_upload(backend, sym_file.key, path, upload=None)
+
+    def upload_v1(self, client, token, archive_path):
+        with open(archive_path, "rb") as fp:
+            response = client.post(
+                reverse("upload:upload_archive"),
+                {"benchmark.zip": fp},
+                HTTP_AUTH_TOKEN=token.key,
+            )
+        if response.status_code != 201:
+            raise CommandError(f"v1 upload failed: {response.content!r}")
+
+    def upload_v2(self, client, token, archive_path, sym_files, client_timings):
+        """Upload the files like a v2 client, timing the client's work as well."""
+        headers = {"Auth-Token": token.key}
+        workspace = os.path.dirname(archive_path)
+        file_specs = []
+        paths = {}
+        for sym_file in sym_files:
+            path = os.path.join(workspace, "v2", sym_file.key)
+            write_sym_file(sym_file, path)
+            paths[sym_file.key] = path
+            start = time.perf_counter()
+            md5 = hashlib.md5()  # nosec
+            with open(path, "rb") as fp:
+                for chunk in iter(lambda: fp.read(1024 * 1024), b""):
+                    md5.update(chunk)
+            client_timings["client_md5"].append((time.perf_counter() - start) * 1000)
+            file_specs.append(
+                FileSpecRequest(
+                    key=sym_file.key, size=sym_file.size, md5_hash=md5.hexdigest()
+                )
+            )
+
+        response = client.post(
+            reverse("upload:upload_v2"),
+            data=msgspec.json.encode(UploadRequest(files=file_specs)),
+            content_type="application/json",
+            headers=headers,
+        )
+        if response.status_code != 201:
+            raise CommandError(f"v2 upload failed: {response.content!r}")
+        upload = response.json()
+
+        uploaded_keys = []
+        for file_spec in upload["files"]:
+            action = file_spec["action"]
+            if action["type"] != "upload":
+                continue
+            uploaded_keys.append(file_spec["key"])
+            path = paths[file_spec["key"]]
+            if action.get("content_encoding") == "gzip":
+                start = time.perf_counter()
+                with open(path, "rb") as f_in, gzip.open(path + ".gz", "wb") as f_out:
+                    shutil.copyfileobj(f_in, f_out)
+                client_timings["client_gzip"].append(
+                    (time.perf_counter() - start) * 1000
+                )
+                path = path + ".gz"
+            url = action["url"]
+            if settings.LOCAL_DEV_ENV:
+                # The upload view points upload URLs at the emulator's port on the
+                # host, but this command runs in a container next to the emulator.
+                url = url.replace("http://localhost", "http://gcs-emulator")
+            start = time.perf_counter()
+            with open(path, "rb") as fp:
+                requests.put(
+                    url, data=fp, headers={"Content-Type": "text/plain"}
+                ).raise_for_status()
+            client_timings["client_put"].append((time.perf_counter() - start) * 1000)
+
+        response = client.post(
+            reverse("upload:upload_v2_complete", args=(upload["id"],)),
+            data=msgspec.json.encode(UploadCompleteRequest(keys=uploaded_keys)),
+            content_type="application/json",
+            headers=headers,
+        )
+        if response.status_code != 200:
+            raise CommandError(f"v2 upload completion failed: {response.content!r}")
+
+    def report(self, protocol, timings, durations):
+        for stage in list(STAGES) + CLIENT_STAGES:
+            values = timings[stage]
+            if not values:
+                continue
+            p95 = (
+                statistics.quantiles(values, n=20)[-1] if len(values) > 1 else values[0]
+            )
+            self.stdout.write(
+                f">>> {protocol} {stage}: count={len(values)} "
+                f"total={sum(values):.2f}ms mean={statistics.mean(values):.2f}ms "
+                f"p95={p95:.2f}ms"
+            )
+        self.stdout.write(
+            f">>> {protocol} total: uploads={len(durations)} "
+            f"mean={statistics.mean(durations):.2f}ms"
+        )
+
+    def handle(self, *args, **options):
+        files = options["files"]
+        file_size = options["file_size"]
+        duplicates = min(options["duplicates"], files)
+        if files < 1 or options["iterations"] < 1:
+            raise CommandError("--files and --iterations have to be at least 1")
+        if file_size < _MIN_FILE_SIZE:
+            raise CommandError(f"--file-size has to be at least {_MIN_FILE_SIZE}")
+
+        if options["output"]:
+            make_archive(
+                options["output"], files, file_size, duplicates, options["seed"]
+            )
+            self.stdout.write(f"Wrote {options['output']}")
+            return
+
+        if options["workers"]:
+            executor.init(synchronous=False, max_workers=options["workers"])
+
+        protocols = (
+            ["v1", "v2"] if options["protocol"] == "both" else [options["protocol"]]
+        )
+        token = self.get_token()
+        client = Client(HTTP_HOST=allowed_host())
+        self.stdout.write(
+            f"benchmark_upload: {files} files of {file_size} bytes, "
+            f"{duplicates} duplicates, {options['uploaded_ratio']:.0%} already uploaded"
+        )
+        run = 0
+        for protocol in protocols:
+            timings = defaultdict(list)
+            durations = []
+            for _ in range(options["iterations"]):
+                run += 1
+                with tempfile.TemporaryDirectory() as workspace:
+                    archive_path = os.path.join(workspace, "benchmark.zip")
+                    sym_files = make_archive(
+                        archive_path,
+                        files,
+                        file_size,
+                        duplicates,
+                        options["seed"] * 1000 + run,
+                    )
+                    self.pre_upload(sym_files, workspace, options["uploaded_ratio"])
+
+                    with MetricsMock() as metrics:
+                        start = time.perf_counter()
+                        if protocol == "v1":
+                            self.upload_v1(client, token, archive_path)
+                        else:
+                            self.upload_v2(
+                                client, token, archive_path, sym_files, timings
+                            )
+                        durations.append((time.perf_counter() - start) * 1000)
+                    for stage, stat in STAGES.items():
+                        timings[stage].extend(
+                            record.value
+                            for record in metrics.filter_records(
+                                "timing", stat=f"tecken.{stat}"
+                            )
+                        )
+            self.report(protocol, timings, durations)
@@ -0,0 +1,153 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+import datetime
+import re
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.utils import timezone
+
+from tecken.libmarkus import METRICS
+from tecken.upload.management.commands.clearuploads import REGULAR_RECORD_AGE_CUTOFF
+
+
+# The table partitioned by range on created_at; see migration 0026.
+PARTITIONED_TABLE = "upload_fileupload"
+DEFAULT_PARTITION = f"{PARTITIONED_TABLE}_default"
+
+# Number of months after the current one to create partitions for.
+MONTHS_AHEAD = 3
+
+_BOUNDS_RE = re.compile(r"FROM \((?P<lower>.+?)\) TO \((?P<upper>.+?)\)")
+
+
+def _parse_bound(value):
+    """Parse a partition bound as rendered by pg_get_expr()."""
+    if value in ("MINVALUE", "MAXVALUE"):
+        return None
+    return datetime.datetime.fromisoformat(value.strip("'"))
+
+
+def _add_months(date, months):
+    month_index = date.month - 1 + months
+    return date.replace(year=date.year + month_index // 12, month=month_index % 12 + 1)
+
+
+def get_partitions():
+    """Return list of (name, lower, upper) for the range partitions of the table.
+
+    A bound of None means MINVALUE or MAXVALUE. The default partition is not included.
+    """
+    with connection.cursor() as cursor:
+        cursor.execute(
+            """
+            SELECT c.relname, pg_get_expr(c.relpartbound, c.oid)
+            FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent = %s::regclass
+            ORDER BY c.relname
+            """,
+            [PARTITIONED_TABLE],
+        )
+        rows = cursor.fetchall()
+
+    partitions = []
+    for name, bound in rows:
+        match = _BOUNDS_RE.search(bound)
+        if not match:
+            # This is the default partition
+            continue
+        partitions.append(
+            (name, _parse_bound(match["lower"]), _parse_bound(match["upper"]))
+        )
+    return partitions
+
+
+class Command(BaseCommand):
+    """Create upcoming and drop expired monthly partitions of the fileupload table.
+
+    Rows are only ever dropped a whole partition at a time once every row in it is
+    older than the retention period for regular uploads. Try records have a shorter
+    retention and are still deleted row by row by clearuploads.
+
+    """
+
+    help = "Create upcoming and drop expired partitions of the fileupload table."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--dry-run", action="store_true", help="Whether or not to do a dry run."
+        )
+        parser.add_argument(
+            "--months-ahead",
+            type=int,
+            default=MONTHS_AHEAD,
+            help="Number of months after the current one to create partitions for.",
+        )
+
+    def create_partition(self, is_dry_run, lower, upper):
+        name = f"{PARTITIONED_TABLE}_p{lower:%Y_%m}"
+        self.stdout.write(f">>> create {name}: {lower.date()} to {upper.date()}")
+        if is_dry_run:
+            return
+
+        # Rows that ended up in the default partition because this partition didn't
+        # exist yet have to move, otherwise Postgres refuses to attach it.
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"CREATE TABLE {name} "
+                + f"(LIKE {PARTITIONED_TABLE} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            )
+            cursor.execute(
+                f"WITH moved AS (DELETE FROM {DEFAULT_PARTITION} "
+                + "WHERE created_at >= %s AND created_at < %s RETURNING *) "
+                + f"INSERT INTO {name} SELECT * FROM moved",
+                [lower, upper],
+            )
+            cursor.execute(
+                f"ALTER TABLE {PARTITIONED_TABLE} ATTACH PARTITION {name} "
+                + "FOR VALUES FROM (%s) TO (%s)",
+                [lower, upper],
+            )
+        METRICS.incr("managepartitions.partition_created")
+
+    def drop_partition(self, is_dry_run, name, upper):
+        self.stdout.write(f">>> drop {name}: before {upper.date()}")
+        if is_dry_run:
+            return
+
+        with connection.cursor() as cursor:
+            cursor.execute(f"DROP TABLE {name}")
+        METRICS.incr("managepartitions.partition_dropped")
+
+    @METRICS.timer_decorator("managepartitions.timing")
+    def handle(self, *args, **options):
+        self.stdout.write("managepartitions:")
+
+        is_dry_run = options["dry_run"]
+        if is_dry_run:
+            self.stdout.write(">>> THIS IS A DRY RUN.")
+
+        today = timezone.now()
+        this_month = today.replace(day=1, hour=0, minute=0, second=0, microsecond=0)
+        partitions = get_partitions()
+
+        # Create missing monthly partitions from this month on, skipping any month
+        # that's already covered by an existing partition.
+        for i in range(options["months_ahead"] + 1):
+            lower = _add_months(this_month, i)
+            upper = _add_months(lower, 1)
+            overlaps = any(
+                (p_lower is None or p_lower < upper)
+                and (p_upper is None or lower < p_upper)
+                for _, p_lower, p_upper in partitions
+            )
+            if not overlaps:
+                self.create_partition(is_dry_run=is_dry_run, lower=lower, upper=upper)
+
+        # Drop partitions holding only rows older than the retention period.
+        cutoff = today - datetime.timedelta(days=REGULAR_RECORD_AGE_CUTOFF)
+        for name, _, upper in partitions:
+            if upper is not None and upper <= cutoff:
+                self.drop_partition(is_dry_run=is_dry_run, name=name, upper=upper)
@@ -0,0 +1,176 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# Converts upload_fileupload into a table range-partitioned on created_at.
+#
+# The existing table is renamed to upload_fileupload_legacy and attached as the
+# partition for everything created before the start of next month, so no rows are
+# copied. Monthly partitions after that are created, and expired ones dropped, by the
+# managepartitions management command. A default partition catches rows outside of
+# every defined range so inserts never fail if that command hasn't run yet.
+#
+# Postgres requires the partition key to be part of the primary key, so the
+# primary key in the database becomes (id, created_at). Django keeps treating id as
+# the primary key; it's still unique since it's drawn from a single sequence.
+#
+# Note: Attaching the legacy table builds the (id, created_at) index and
+# validates the partition constraint, which scans the whole table. Run this during a
+# maintenance window.
+#
+# Reversing the migration copies all rows of all partitions into a new plain table
+# with the original primary key, indexes and foreign keys, and drops the partitioned
+# table. That rewrites the whole table, so it needs a maintenance window, too.
+
+from django.db import migrations
+
+
+PARTITION_FILEUPLOAD_SQL = """
+DO $$
+DECLARE
+    next_id bigint;
+    cutoff timestamptz := date_trunc('month', now(), 'UTC') + interval '1 month';
+    idx record;
+    con record;
+BEGIN
+    SELECT COALESCE(MAX(id), 0) + 1 INTO next_id FROM upload_fileupload;
+
+    -- Release the id column from its identity or serial sequence; the partitioned
+    -- table gets its own sequence below.
+    IF EXISTS (
+        SELECT 1 FROM information_schema.columns
+        WHERE table_name = 'upload_fileupload'
+        AND column_name = 'id'
+        AND is_identity = 'YES'
+    ) THEN
+        ALTER TABLE upload_fileupload ALTER COLUMN id DROP IDENTITY;
+    ELSE
+        ALTER TABLE upload_fileupload ALTER COLUMN id DROP DEFAULT;
+        ALTER SEQUENCE IF EXISTS upload_fileupload_id_seq
+            RENAME TO upload_fileupload_legacy_id_seq;
+    END IF;
+
+    -- A partition can't have a primary key of its own. Attaching it to the
+    -- partitioned table below gives it the (id, created_at) one.
+    ALTER TABLE upload_fileupload DROP CONSTRAINT upload_fileupload_pkey;
+    ALTER TABLE upload_fileupload RENAME TO upload_fileupload_legacy;
+
+    CREATE TABLE upload_fileupload (
+        LIKE upload_fileupload_legacy INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+    ) PARTITION BY RANGE (created_at);
+
+    CREATE SEQUENCE upload_fileupload_id_seq OWNED BY upload_fileupload.id;
+    PERFORM setval('upload_fileupload_id_seq', next_id, false);
+    ALTER TABLE upload_fileupload
+        ALTER COLUMN id SET DEFAULT nextval('upload_fileupload_id_seq');
+    ALTER TABLE upload_fileupload
+        ADD CONSTRAINT upload_fileupload_pkey PRIMARY KEY (id, created_at);
+
+    -- Recreate the indexes and foreign keys on the partitioned table under their
+    -- original names. The legacy ones get attached to them as the partition's own.
+    FOR idx IN
+        SELECT i.relname AS name, pg_get_indexdef(i.oid) AS def
+        FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+        WHERE x.indrelid = 'upload_fileupload_legacy'::regclass
+    LOOP
+        EXECUTE format(
+            'ALTER INDEX %I RENAME TO %I', idx.name, left(idx.name, 56) || '_legacy'
+        );
+        EXECUTE regexp_replace(
+            idx.def, ' ON \\S+ USING ', ' ON upload_fileupload USING '
+        );
+    END LOOP;
+
+    FOR con IN
+        SELECT conname AS name, pg_get_constraintdef(oid) AS def
+        FROM pg_constraint
+        WHERE conrelid = 'upload_fileupload_legacy'::regclass
+        AND contype = 'f'
+    LOOP
+        EXECUTE format(
+            'ALTER TABLE upload_fileupload_legacy RENAME CONSTRAINT %I TO %I',
+            con.name,
+            left(con.name, 56) || '_legacy'
+        );
+        EXECUTE format(
+            'ALTER TABLE upload_fileupload ADD CONSTRAINT %I %s', con.name, con.def
+        );
+    END LOOP;
+
+    EXECUTE format(
+        'ALTER TABLE upload_fileupload ATTACH PARTITION upload_fileupload_legacy '
+        'FOR VALUES FROM (MINVALUE) TO (%L)',
+        cutoff
+    );
+    CREATE TABLE upload_fileupload_default PARTITION OF upload_fileupload DEFAULT;
+END $$;
+"""
+
+UNPARTITION_FILEUPLOAD_SQL = """
+DO $$
+DECLARE
+    next_id bigint;
+    statements text[];
+    statement text;
+BEGIN
+    SELECT COALESCE(MAX(id), 0) + 1 INTO next_id FROM upload_fileupload;
+
+    CREATE TABLE upload_fileupload_unpartitioned (
+        LIKE upload_fileupload INCLUDING DEFAULTS INCLUDING CONSTRAINTS
+    );
+    INSERT INTO upload_fileupload_unpartitioned SELECT * FROM upload_fileupload;
+
+    -- Remember the indexes and foreign keys of the partitioned table, so they can be
+    -- recreated under the same names once it's dropped.
+    SELECT array_agg(
+        regexp_replace(
+            pg_get_indexdef(i.oid),
+            ' ON (ONLY )?\\S+ USING ',
+            ' ON upload_fileupload USING '
+        )
+    )
+    INTO statements
+    FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+    WHERE x.indrelid = 'upload_fileupload'::regclass
+    AND NOT x.indisprimary;
+
+    SELECT statements || array_agg(
+        format(
+            'ALTER TABLE upload_fileupload ADD CONSTRAINT %I %s',
+            conname,
+            pg_get_constraintdef(oid)
+        )
+    )
+    INTO statements
+    FROM pg_constraint
+    WHERE conrelid = 'upload_fileupload'::regclass
+    AND contype = 'f';
+
+    -- Keep the id sequence, which would be dropped with the partitioned table.
+    ALTER SEQUENCE upload_fileupload_id_seq OWNED BY NONE;
+    -- This drops all partitions, including the legacy and the default one.
+    DROP TABLE upload_fileupload;
+
+    ALTER TABLE upload_fileupload_unpartitioned RENAME TO upload_fileupload;
+    ALTER SEQUENCE upload_fileupload_id_seq OWNED BY upload_fileupload.id;
+    PERFORM setval('upload_fileupload_id_seq', next_id, false);
+    ALTER TABLE upload_fileupload
+        ADD CONSTRAINT upload_fileupload_pkey PRIMARY KEY (id);
+    FOREACH statement IN ARRAY COALESCE(statements, '{}')
+    LOOP
+        EXECUTE statement;
+    END LOOP;
+END $$;
+"""
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("upload", "0025_bug_2049671_fileupload_created_at"),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            PARTITION_FILEUPLOAD_SQL, reverse_sql=UNPARTITION_FILEUPLOAD_SQL
+        ),
+    ]
@@ -0,0 +1,21 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+# Generated by Django 5.2.18 on 2026-10-18 23:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+    dependencies = [
+        ("upload", "0026_fileupload_partition_by_created_at"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="upload",
+            name="timings",
+            field=models.JSONField(null=True),
+        ),
+    ]
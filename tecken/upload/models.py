@@ -38,6 +38,9 @@ class Upload(models.Model):
     skipped_keys = ArrayField(models.CharField(max_length=300), null=True)
     # When certain files are immediately ignored
     ignored_keys = ArrayField(models.CharField(max_length=300), null=True)
+    # The keys upload v2 handed out upload session URLs for, which are the only keys
+    # that can be recorded for the upload
+    initiated_keys = ArrayField(models.CharField(max_length=300), null=True)
     # When the upload has been extracted and all individual files
     # have been successfully uploaded, this is complete.
     completed_at = models.DateTimeField(null=True)
@@ -50,6 +53,9 @@ class Upload(models.Model):
     # If the upload by download URL triggered 1 or more redirects, we
     # record that trail here.
     redirect_urls = ArrayField(models.URLField(max_length=500), null=True)
+    # How long each stage of processing the upload took, overall and for the slowest
+    # files.
+    timings = models.JSONField(null=True)
     # One increment for every attempt of processing the upload.
     created_at = models.DateTimeField(auto_now_add=True, db_index=True)
 
@@ -0,0 +1,111 @@
+# This Source Code Form is subject to the terms of the Mozilla Public
+# License, v. 2.0. If a copy of the MPL was not distributed with this
+# file, You can obtain one at https://mozilla.org/MPL/2.0/.
+
+from contextlib import contextmanager
+import threading
+import time
+from typing import Any, Optional
+
+
+def _elapsed_ms(start: float) -> float:
+    return round((time.perf_counter() - start) * 1000, 1)
+
+
+class FileProfile:
+    """Timings and sizes of uploading a single file of an upload.
+
+    The profile is created when the file is submitted to the executor, so the time the
+    file waited for an executor thread is recorded when the upload starts.
+
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self.submitted_at = time.perf_counter()
+        self.timings: dict[str, float] = {}
+        self.bytes_in = 0
+        self.bytes_out = 0
+
+    def started(self):
+        """Record the time waited for an executor thread."""
+        self.timings["queue"] = _elapsed_ms(self.submitted_at)
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the duration of a stage of uploading the file."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + _elapsed_ms(start)
+
+    @property
+    def total_ms(self) -> float:
+        """Return the time spent on the file, not counting waiting in the queue."""
+        return sum(ms for name, ms in self.timings.items() if name != "queue")
+
+    def as_dict(self) -> dict[str, Any]:
+        data = {"key": self.key}
+        data.update((f"{name}_ms", ms) for name, ms in self.timings.items())
+        data["bytes_in"] = self.bytes_in
+        data["bytes_out"] = self.bytes_out
+        return data
+
+
+class UploadProfile:
+    """Timings and sizes of the stages of an upload and of each of its files.
+
+    Usage::
+
+        profile = UploadProfile()
+        with profile.stage("extract"):
+            ...
+        file_profile = profile.file(key)
+        executor.submit(upload_file_upload, ..., profile=file_profile)
+        ...
+        upload_obj.timings = profile.as_dict(max_files=100)
+
+    File profiles are filled in by executor threads, each file by a single thread.
+
+    """
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.timings: dict[str, float] = {}
+        self.bytes_in = 0
+        self.files: dict[str, FileProfile] = {}
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name: str):
+        """Record the duration of a stage of the upload."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.timings[name] = self.timings.get(name, 0) + _elapsed_ms(start)
+
+    def file(self, key: str) -> FileProfile:
+        """Return a new profile for uploading the file with the given key."""
+        file_profile = FileProfile(key)
+        with self._lock:
+            self.files[key] = file_profile
+        return file_profile
+
+    def as_dict(self, max_files: Optional[int] = None) -> dict[str, Any]:
+        """Return the profile as JSON-serializable data.
+
+        :arg max_files: only include the files that took the longest, up to this many
+
+        """
+        files = sorted(self.files.values(), key=lambda f: f.total_ms, reverse=True)
+        data = {"total_ms": _elapsed_ms(self.start)}
+        data.update((f"{name}_ms", ms) for name, ms in self.timings.items())
+        data["bytes_in"] = self.bytes_in
+        data["bytes_out"] = sum(f.bytes_out for f in files)
+        if max_files is not None and len(files) > max_files:
+            data["files_omitted"] = len(files) - max_files
+            files = files[:max_files]
+        data["files"] = [f.as_dict() for f in files]
+        return data
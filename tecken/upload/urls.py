@@ -12,5 +12,13 @@ app_name = "upload"
 urlpatterns = [
     path("", views.upload_archive, name="upload_archive"),
     path("auth_info/", views.upload_auth_info, name="upload_auth_info"),
+    path("manifest/", views.upload_manifest, name="upload_manifest"),
     path("v2/", views.upload_v2, name="upload_v2"),
+    path("v2/session/", views.upload_v2_session, name="upload_v2_session"),
+    path("v2/<int:upload_id>/files/", views.upload_v2_files, name="upload_v2_files"),
+    path(
+        "v2/<int:upload_id>/complete/",
+        views.upload_v2_complete,
+        name="upload_v2_complete",
+    ),
 ]
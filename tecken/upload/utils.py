@@ -4,20 +4,28 @@
 
 import hashlib
 import os
-from typing import Optional
+from typing import Iterator, Optional
 import zipfile
 import gzip
 import shutil
 import logging
 
 from django.conf import settings
+from django.core.cache import cache
 from django.utils import timezone
 
+from tecken.base.symbolstorage import remember_key, symbol_storage
 from tecken.libstorage import StorageBackend
 from tecken.libstorage import ObjectMetadata
 from tecken.upload.models import FileUpload, Upload
+from tecken.upload.profile import FileProfile
 from tecken.libmarkus import METRICS
-from tecken.libsym import extract_sym_header_data, SymParseError
+from tecken.libsym import (
+    extract_sym_header_data,
+    extract_sym_header_data_from_bytes,
+    read_sym_header,
+    SymParseError,
+)
 
 
 logger = logging.getLogger("tecken")
@@ -43,6 +51,25 @@ def get_file_md5_hash(fn, blocksize=65536):
     return hasher.hexdigest()
 
 
+def check_duplicate_members(zf):
+    """Raise DuplicateFileDifferentSize if the zip file contains two different files
+    with the same name."""
+    namelist = zf.namelist()
+    # If there are repeated names in the namelist, dig deeper!
+    if len(set(namelist)) != len(namelist):
+        # It's only a problem any of the files within are of different size
+        sizes = {}
+        for info in zf.infolist():
+            if info.filename in sizes:
+                if info.file_size != sizes[info.filename]:
+                    raise DuplicateFileDifferentSize(
+                        "The zipfile buffer contains two files both called "
+                        f"{info.filename} and they have difference sizes "
+                        "({} != {})".format(info.file_size, sizes[info.filename])
+                    )
+            sizes[info.filename] = info.file_size
+
+
 @METRICS.timer_decorator("upload_dump_and_extract")
 def dump_and_extract(root_dir, file_buffer, name):
     """Given a directory and an open compressed file and its filename,
@@ -53,21 +80,8 @@ def dump_and_extract(root_dir, file_buffer, name):
     if name.lower().endswith(".zip"):
         zf = zipfile.ZipFile(file_buffer)
         zf.extractall(root_dir)
-        namelist = zf.namelist()
-        # If there are repeated names in the namelist, dig deeper!
-        if len(set(namelist)) != len(namelist):
-            # It's only a problem any of the files within are of different size
-            sizes = {}
-            for info in zf.infolist():
-                if info.filename in sizes:
-                    if info.file_size != sizes[info.filename]:
-                        raise DuplicateFileDifferentSize(
-                            "The zipfile buffer contains two files both called "
-                            f"{info.filename} and they have difference sizes "
-                            "({} != {})".format(info.file_size, sizes[info.filename])
-                        )
-                sizes[info.filename] = info.file_size
-        namelist = set(namelist)
+        check_duplicate_members(zf)
+        namelist = set(zf.namelist())
 
     else:
         raise UnrecognizedArchiveFileExtension(os.path.splitext(name)[1])
@@ -80,14 +94,18 @@ def dump_and_extract(root_dir, file_buffer, name):
 
 
 class FileMember:
-    __slots__ = ["path", "name"]
+    __slots__ = ["path", "name", "_size"]
 
-    def __init__(self, path: str, name: str):
+    def __init__(self, path: str, name: str, size: Optional[int] = None):
         self.path = path
         self.name = name
+        # The size can be passed in if it's known before the file is extracted.
+        self._size = size
 
     @property
     def size(self):
+        if self._size is not None:
+            return self._size
         return os.stat(self.path).st_size
 
     def __repr__(self):
@@ -115,76 +133,208 @@ def get_key_content_type(key_name):
     return settings.MIME_OVERRIDES.get(key_extension)
 
 
+def gzip_file(file_path: str) -> str:
+    """Compress the file and return the path of the compressed file."""
+    gzip_path = file_path + ".gz"
+    with open(file_path, "rb") as f_in:
+        with gzip.open(gzip_path, "wb") as f_out:
+            shutil.copyfileobj(f_in, f_out)
+    return gzip_path
+
+
+def _stored_content_cache_key(
+    backend: StorageBackend, md5_sum: str, size: int, compressed: bool
+) -> str:
+    encoding = "gzip" if compressed else "identity"
+    return (
+        f"upload_stored_content::{backend.bucket}/{backend.prefix}/"
+        f"{md5_sum}/{size}/{encoding}"
+    )
+
+
+def find_stored_content(
+    backend: StorageBackend, key_name: str, md5_sum: str, size: int, compressed: bool
+) -> Optional[dict]:
+    """Return where the backend already stores a file with the given content.
+
+    :arg key_name: the key the file is uploaded to, which isn't returned
+    :arg md5_sum: the MD5 hash of the uncompressed file
+    :arg size: the size of the uncompressed file
+    :arg compressed: whether the file is stored gzip-compressed
+
+    :returns: A dict with the ``key`` of the object with the same content and its
+        stored ``size``, or None if no such object is known.
+    """
+    stored_content = cache.get(
+        _stored_content_cache_key(backend, md5_sum, size, compressed)
+    )
+    if stored_content and stored_content["key"] == key_name:
+        stored_content = None
+    METRICS.incr(
+        "upload_stored_content", tags=[f"result:{'hit' if stored_content else 'miss'}"]
+    )
+    return stored_content
+
+
+def remember_stored_content(
+    backend: StorageBackend,
+    key_name: str,
+    md5_sum: str,
+    size: int,
+    compressed: bool,
+    stored_size: int,
+):
+    """Record that the object with the given key stores a file with the given content.
+
+    This allows later uploads of the same content under a different key to copy the
+    object in storage instead of uploading it.
+    """
+    cache.set(
+        _stored_content_cache_key(backend, md5_sum, size, compressed),
+        {"key": key_name, "size": stored_size},
+        settings.UPLOAD_CONTENT_DEDUPLICATION_TIMEOUT,
+    )
+
+
+def forget_stored_content(
+    backend: StorageBackend, md5_sum: str, size: int, compressed: bool
+):
+    """Forget where a file with the given content is stored."""
+    cache.delete(_stored_content_cache_key(backend, md5_sum, size, compressed))
+
+
+def _is_legacy_compressed(metadata: ObjectMetadata) -> bool:
+    """Return whether the object was compressed before its original size was stored.
+
+    The original size and hash of these objects default to the compressed ones.
+    """
+    return (
+        metadata.content_encoding == "gzip"
+        and metadata.original_content_length == metadata.content_length
+    )
+
+
+def should_upload(
+    key_name: str,
+    found: list[tuple[StorageBackend, ObjectMetadata]],
+    size: int,
+    md5_sum: Optional[str],
+    compressed_size: Optional[int] = None,
+) -> bool:
+    """Decide whether a file has to be uploaded or is already in storage.
+
+    This is shared by the upload v1 and v2 endpoints. The file is skipped if any of the
+    backends it's found in has a file with the same original size and MD5 hash. Files
+    compressed before their original size and hash were stored in the metadata are
+    compared by their compressed size instead, if it's known.
+
+    Skipped files are counted in the upload_file_upload_skip metric, tagged with the
+    reason and the storage the file was found in.
+
+    :arg key_name: the key of the file
+    :arg found: the backends the file was found in and its metadata there, as
+        returned by SymbolStorage.get_all_metadata()
+    :arg size: the size of the file before compressing it
+    :arg md5_sum: the MD5 hash of the file before compressing it
+    :arg compressed_size: the size of the file after compressing it, if it's compressed
+
+    :returns: True if the file has to be uploaded, False if it can be skipped
+    """
+    reason = None
+    for found_backend, found_metadata in found:
+        if (
+            found_metadata.original_content_length == size
+            and found_metadata.original_md5_sum == md5_sum
+        ):
+            reason = "same_content"
+        elif (
+            compressed_size is not None
+            and _is_legacy_compressed(found_metadata)
+            and found_metadata.content_length == compressed_size
+        ):
+            # This is "legacy fix", but it's worth keeping for at least
+            # well into 2018.
+            # If a symbol file was (gzipped and) uploaded but without
+            # the fancy metadata, then there is one last possibility to
+            # compare the size of the existing file in storage when this
+            # local file has been compressed too.
+            reason = "legacy_compressed_size"
+        if reason:
+            storage = "try" if found_backend.try_symbols else "regular"
+            logger.debug(f"Skipping {key_name!r} found in {found_backend!r}: {reason}")
+            METRICS.incr(
+                "upload_file_upload_skip",
+                1,
+                tags=[f"reason:{reason}", f"storage:{storage}"],
+            )
+            return False
+    return True
+
+
 @METRICS.timer_decorator("upload_file_upload")
 def upload_file_upload(
     backend: StorageBackend,
     key_name: str,
     file_path: str,
     upload: Upload,
+    profile: Optional[FileProfile] = None,
 ) -> Optional[FileUpload]:
     # NOTE(smarnach): This function is run in a thread and should not access the database.
 
-    with METRICS.timer("upload_file_exists"):
-        # FIXME(smarnach): Use symbol_storage().get_metadata() so we don't upload a file that
-        # already exists in regular storage to try storage.
-        existing_metadata = backend.get_object_metadata(key_name)
+    profile = profile or FileProfile(key_name)
+    profile.started()
+
+    with METRICS.timer("upload_file_exists"), profile.stage("exists"):
+        found = symbol_storage().get_all_metadata(key_name, backend.try_symbols)
+    existing_metadata = next(
+        (
+            found_metadata
+            for found_backend, found_metadata in found
+            if found_backend.bucket == backend.bucket
+            and found_backend.prefix == backend.prefix
+        ),
+        None,
+    )
 
     original_file_path = file_path
-    size = os.stat(file_path).st_size
+    size = original_size = os.stat(file_path).st_size
+    profile.bytes_in = size
     compressed = should_compressed_key(key_name)
     metadata = ObjectMetadata(content_type=get_key_content_type(key_name))
-
-    if not compressed:
-        # It's easy when you don't have to compare compressed files.
-        # FIXME(smarnach): Figure out why we only compare sizes for the uncompressed case,
-        # while we also compare hashes when the file is compressed.
-        if existing_metadata and existing_metadata.content_length == size:
-            # Then don't bother!
-            METRICS.incr("upload_skip_early_uncompressed", 1)
-            return
-    else:
-        metadata.original_content_length = size
-        metadata.original_md5_sum = get_file_md5_hash(file_path)
+    deduplicate = settings.UPLOAD_CONTENT_DEDUPLICATION
+    md5_sum = None
+    stored_content = None
+
+    # The hash is only needed for uncompressed files if there's something to compare
+    # it with.
+    if compressed or found or deduplicate:
+        with METRICS.timer("upload_md5_hash"), profile.stage("md5"):
+            md5_sum = get_file_md5_hash(file_path)
+    if not should_upload(key_name, found, original_size, md5_sum):
+        return
+    if deduplicate:
+        stored_content = find_stored_content(
+            backend, key_name, md5_sum, original_size, compressed
+        )
+
+    if compressed:
+        metadata.original_content_length = original_size
+        metadata.original_md5_sum = md5_sum
         metadata.content_encoding = "gzip"
-
-        # Before we compress *this* to compare its compressed size with
-        # the compressed size in storage, let's first compare the possible
-        # metadata and see if it's an opportunity for an early exit.
-        if (
-            existing_metadata
-            and existing_metadata.original_content_length == size
-            and existing_metadata.original_md5_sum == metadata.original_md5_sum
+        if stored_content:
+            # The same content is already stored compressed under another key, so
+            # there's no need to compress it again.
+            size = stored_content["size"]
+        else:
+            # At this point, we can't exit early by comparing the original.
+            # So we're going to have to assume that we'll upload this file.
+            with METRICS.timer("upload_gzip_payload"), profile.stage("gzip"):
+                file_path = gzip_file(file_path)
+            # The new 'size' is the size of the file after being compressed.
+            size = os.stat(file_path).st_size
+        if not should_upload(
+            key_name, found, original_size, md5_sum, compressed_size=size
         ):
-            # An upload existed with the exact same original size
-            # and the exact same md5 hash.
-            # Then we can definitely exit early here.
-            METRICS.incr("upload_skip_early_compressed", 1)
-            return
-
-        # At this point, we can't exit early by comparing the original.
-        # So we're going to have to assume that we'll upload this file.
-        with METRICS.timer("upload_gzip_payload"):
-            with open(file_path, "rb") as f_in:
-                with gzip.open(file_path + ".gz", "wb") as f_out:
-                    shutil.copyfileobj(f_in, f_out)
-        # Change it from now on to this new file name
-        file_path = file_path + ".gz"
-        # The new 'size' is the size of the file after being compressed.
-        size = os.stat(file_path).st_size
-
-        if (
-            existing_metadata
-            and not existing_metadata.original_content_length
-            and existing_metadata.content_length == size
-        ):
-            # This is "legacy fix", but it's worth keeping for at least
-            # well into 2018.
-            # If a symbol file was (gzipped and) uploaded but without
-            # the fancy metadata (see a couple of lines above), then
-            # there is one last possibility to compare the size of the
-            # exising file in storage when this local file has been compressed
-            # too.
-            METRICS.incr("upload_skip_early_compressed_legacy", 1)
             return
 
     sym_data = {}
@@ -193,17 +343,47 @@ def upload_file_upload(
         # debug id, code file, and code id to store in the db. We do this before we
         # compress the file.
         try:
-            sym_data = extract_sym_header_data(original_file_path)
+            with profile.stage("sym_header"):
+                sym_data = extract_sym_header_data(original_file_path)
         except SymParseError as exc:
             logging.debug("symparseerror: %s", exc)
 
     created_at = timezone.now()
-    metadata.content_length = size
-    logger.debug(f"Uploading file {key_name!r} into {backend.bucket!r}")
-    with METRICS.timer("upload_put_object"):
-        with open(file_path, "rb") as f:
-            backend.upload(key_name, f, metadata)
+    copied = False
+    if stored_content:
+        metadata.content_length = size
+        logger.debug(
+            f"Copying file {stored_content['key']!r} to {key_name!r} in "
+            f"{backend.bucket!r}"
+        )
+        with METRICS.timer("upload_copy_object"), profile.stage("copy"):
+            copied = backend.copy(
+                stored_content["key"], key_name, metadata, md5_sum, original_size
+            )
+        if copied:
+            METRICS.incr("upload_file_upload_copy", 1)
+        else:
+            # The object the content was stored in is gone or was replaced, so upload
+            # it after all.
+            forget_stored_content(backend, md5_sum, original_size, compressed)
+            if compressed:
+                with METRICS.timer("upload_gzip_payload"), profile.stage("gzip"):
+                    file_path = gzip_file(file_path)
+                size = os.stat(file_path).st_size
+
+    if not copied:
+        metadata.content_length = size
+        logger.debug(f"Uploading file {key_name!r} into {backend.bucket!r}")
+        with METRICS.timer("upload_put_object"), profile.stage("put"):
+            with open(file_path, "rb") as f:
+                backend.upload(key_name, f, metadata)
+        profile.bytes_out = size
     completed_at = timezone.now()
+    remember_key(backend, key_name)
+    if deduplicate:
+        remember_stored_content(
+            backend, key_name, md5_sum, original_size, compressed, size
+        )
     logger.info(f"Uploaded key {key_name}")
     METRICS.incr("upload_file_upload_upload", 1)
 
@@ -225,3 +405,78 @@ def upload_file_upload(
         code_id=sym_data.get("code_id"),
         generator=sym_data.get("generator"),
     )
+
+
+def iter_object_range(
+    backend: StorageBackend, key_name: str, chunk_size: int, max_size: int
+) -> Iterator[bytes]:
+    """Yield consecutive chunks of an object in storage using range reads.
+
+    Reading stops at the end of the object or after max_size bytes.
+    """
+    start = 0
+    while start < max_size:
+        length = min(chunk_size, max_size - start)
+        chunk = backend.read_range(key_name, start, length)
+        if not chunk:
+            return
+        yield chunk
+        if len(chunk) < length:
+            return
+        start += length
+
+
+def read_sym_header_data(backend: StorageBackend, key_name: str) -> dict:
+    """Return the header data of a sym file in storage, or {} if it can't be parsed.
+
+    The object is read in chunks of SYM_HEADER_READ_SIZE bytes until the end of the
+    header, but never more than SYM_HEADER_MAX_READ_SIZE bytes.
+    """
+    chunks = iter_object_range(
+        backend,
+        key_name,
+        chunk_size=settings.SYM_HEADER_READ_SIZE,
+        max_size=settings.SYM_HEADER_MAX_READ_SIZE,
+    )
+    try:
+        return extract_sym_header_data_from_bytes(read_sym_header(chunks))
+    except SymParseError as exc:
+        logging.debug("symparseerror: %s", exc)
+        return {}
+
+
+def register_file_upload(
+    key_name: str, backend: StorageBackend, upload: Upload
+) -> Optional[FileUpload]:
+    """Return a FileUpload for a file the client uploaded directly to storage.
+
+    Returns None if the object doesn't exist in storage.
+    """
+    # This function is run in a thread and should not access the database.
+
+    with METRICS.timer("upload_file_exists"):
+        metadata = backend.get_object_metadata(key_name)
+    if metadata is None:
+        return None
+    remember_key(backend, key_name)
+
+    sym_data = {}
+    if is_sym_file(key_name):
+        with METRICS.timer("upload_read_sym_header"):
+            sym_data = read_sym_header_data(backend, key_name)
+
+    return FileUpload(
+        upload=upload,
+        created_at=timezone.now(),
+        completed_at=metadata.last_modified,
+        bucket_name=backend.bucket,
+        key=key_name,
+        compressed=metadata.content_encoding == "gzip",
+        size=metadata.content_length,
+        # sym file information
+        debug_filename=sym_data.get("debug_filename"),
+        debug_id=sym_data.get("debug_id"),
+        code_file=sym_data.get("code_file"),
+        code_id=sym_data.get("code_id"),
+        generator=sym_data.get("generator"),
+    )
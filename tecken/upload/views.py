@@ -11,11 +11,12 @@ import os
 import re
 from tempfile import TemporaryDirectory
 import time
-from typing import Optional, TypeAlias
+from typing import Iterator, Optional, TypeAlias
 import zipfile
 
 from django import http
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 from django.views.decorators.csrf import csrf_exempt
 import msgspec
@@ -27,20 +28,30 @@ from tecken.base.decorators import (
 )
 from tecken.base.symbolstorage import symbol_storage
 from tecken.base.utils import filesizeformat, validate_key, validate_md5_lowercase_hex
-from tecken.libstorage import ObjectMetadata, StorageBackend
+from tecken.download.views import evict_syminfo_cache, prewarm_syminfo_cache
+from tecken.libstorage import ObjectMetadata, StorageBackend, StorageError
 from tecken.upload import client_otel, executor
+from tecken.upload.download import (
+    RangeRequestsUnsupported,
+    StreamingUnavailable,
+    StreamingZipDownload,
+    download_ranges,
+)
 from tecken.upload.forms import UploadByDownloadForm, UploadByDownloadRemoteError
 from tecken.upload.models import FileUpload, Upload
+from tecken.upload.profile import UploadProfile
 from tecken.upload.utils import (
     FileMember,
     dump_and_extract,
     UnrecognizedArchiveFileExtension,
     DuplicateFileDifferentSize,
     get_key_content_type,
+    register_file_upload,
     should_compressed_key,
+    should_upload,
     upload_file_upload,
 )
-from tecken.librequests import session_with_retries
+from tecken.librequests import pooled_session
 from tecken.libmarkus import METRICS
 
 
@@ -140,18 +151,26 @@ def make_tempdir(tempdir_root, suffix=None):
 @api_login_required
 @api_any_permission_required("upload.upload_symbols", "upload.upload_try_symbols")
 @make_tempdir(tempdir_root=settings.UPLOAD_TEMPDIR)
+@executor.scheduling_group()
 def upload_archive(request, upload_workspace):
+    profile = UploadProfile()
     try:
         for name in request.FILES:
             upload_ = request.FILES[name]
-            file_listing = dump_and_extract(upload_workspace, upload_, name)
+            with profile.stage("extract"):
+                file_listing = dump_and_extract(upload_workspace, upload_, name)
             size = upload_.size
             url = None
             redirect_urls = None
+            streaming = None
             break
         else:
             if request.POST.get("url"):
-                form = UploadByDownloadForm(request.POST)
+                # The same pooled session is used for all requests for this upload,
+                # so connections are reused across redirects, HEAD and GET requests
+                # and across uploads.
+                session = pooled_session(default_timeout=(5, 300))
+                form = UploadByDownloadForm(request.POST, session=session)
                 try:
                     is_valid = form.is_valid()
                 except UploadByDownloadRemoteError as exception:
@@ -164,44 +183,109 @@ def upload_archive(request, upload_workspace):
                     logger.info(f"Download to upload {url} ({size_fmt})")
                     redirect_urls = form.cleaned_data["upload"]["redirect_urls"] or None
                     download_name = os.path.join(upload_workspace, name)
-                    session = session_with_retries(default_timeout=(5, 300))
-                    with METRICS.timer("upload_download_by_url"):
-                        response_stream = session.get(url, stream=True)
-                        # NOTE(willkg): The UploadByDownloadForm handles most errors
-                        # when it does a HEAD, so this mostly covers transient errors
-                        # between the HEAD and this GET request.
-                        if response_stream.status_code != 200:
+                    # Downloads go straight to the final URL rather than following
+                    # the redirects again.
+                    final_url = form.cleaned_data["upload"]["final_url"]
+                    response_stream = form.cleaned_data["upload"]["response"]
+                    # If the form already opened a GET response, that's used for
+                    # downloading the file.
+                    accept_ranges = (
+                        form.cleaned_data["upload"]["accept_ranges"]
+                        and response_stream is None
+                    )
+                    streaming = None
+                    if (
+                        settings.UPLOAD_BY_DOWNLOAD_STREAMING
+                        and accept_ranges
+                        and name.lower().endswith(".zip")
+                    ):
+                        streaming = StreamingZipDownload(
+                            session, final_url, size, upload_workspace, name
+                        )
+                        try:
+                            with (
+                                METRICS.timer("upload_download_central_directory"),
+                                profile.stage("download"),
+                            ):
+                                file_listing = streaming.read_listing()
+                        except StreamingUnavailable as exception:
+                            logger.info(f"Not streaming {url}: {exception}")
+                            if isinstance(exception, RangeRequestsUnsupported):
+                                accept_ranges = False
+                            streaming = None
+                        except UploadByDownloadRemoteError as exception:
                             return http.JsonResponse(
-                                {
-                                    "error": "non-200 status code when retrieving %s"
-                                    % url
-                                },
-                                status=400,
+                                {"error": str(exception)}, status=500
                             )
-
-                        with open(download_name, "wb") as f:
-                            # Read 1MB at a time
-                            chunk_size = 1024 * 1024
-                            stream = response_stream.iter_content(chunk_size=chunk_size)
-                            count_chunks = 0
-                            start = time.perf_counter()
-                            for chunk in stream:
-                                if chunk:  # filter out keep-alive new chunks
-                                    f.write(chunk)
-                                count_chunks += 1
-                            end = time.perf_counter()
-                            total_size = chunk_size * count_chunks
-                            download_speed = size / (end - start)
-                            logger.info(
-                                f"Read {count_chunks} chunks of "
-                                f"{filesizeformat(chunk_size)} each "
-                                f"totalling {filesizeformat(total_size)} "
-                                f"({filesizeformat(download_speed)}/s)."
+                    if streaming is None and accept_ranges:
+                        try:
+                            with (
+                                METRICS.timer("upload_download_by_url"),
+                                profile.stage("download"),
+                            ):
+                                for _ in download_ranges(
+                                    session, final_url, download_name, 0, size
+                                ):
+                                    pass
+                        except RangeRequestsUnsupported as exception:
+                            logger.info(f"Not downloading {url} in ranges: {exception}")
+                            accept_ranges = False
+                        except UploadByDownloadRemoteError as exception:
+                            return http.JsonResponse(
+                                {"error": str(exception)}, status=500
                             )
-                    file_listing = dump_and_extract(
-                        upload_workspace, download_name, name
-                    )
-                    os.remove(download_name)
+                        else:
+                            with profile.stage("extract"):
+                                file_listing = dump_and_extract(
+                                    upload_workspace, download_name, name
+                                )
+                            os.remove(download_name)
+                    if streaming is None and not accept_ranges:
+                        with (
+                            METRICS.timer("upload_download_by_url"),
+                            profile.stage("download"),
+                        ):
+                            if response_stream is None:
+                                response_stream = session.get(final_url, stream=True)
+                            # NOTE(willkg): The UploadByDownloadForm handles most errors
+                            # when it does a HEAD, so this mostly covers transient errors
+                            # between the HEAD and this GET request.
+                            if response_stream.status_code != 200:
+                                response_stream.close()
+                                return http.JsonResponse(
+                                    {
+                                        "error": "non-200 status code when retrieving %s"
+                                        % url
+                                    },
+                                    status=400,
+                                )
+
+                            with open(download_name, "wb") as f:
+                                # Read 1MB at a time
+                                chunk_size = 1024 * 1024
+                                stream = response_stream.iter_content(
+                                    chunk_size=chunk_size
+                                )
+                                count_chunks = 0
+                                start = time.perf_counter()
+                                for chunk in stream:
+                                    if chunk:  # filter out keep-alive new chunks
+                                        f.write(chunk)
+                                    count_chunks += 1
+                                end = time.perf_counter()
+                                total_size = chunk_size * count_chunks
+                                download_speed = size / (end - start)
+                                logger.info(
+                                    f"Read {count_chunks} chunks of "
+                                    f"{filesizeformat(chunk_size)} each "
+                                    f"totalling {filesizeformat(total_size)} "
+                                    f"({filesizeformat(download_speed)}/s)."
+                                )
+                        with profile.stage("extract"):
+                            file_listing = dump_and_extract(
+                                upload_workspace, download_name, name
+                            )
+                        os.remove(download_name)
                 else:
                     for errors in form.errors.as_data().values():
                         return http.JsonResponse(
@@ -258,6 +342,8 @@ def upload_archive(request, upload_workspace):
     # if the client uploads with the same filename in quick succession.
     content_hash = hashlib.md5(content.encode("utf-8")).hexdigest()[:30]  # nosec
 
+    profile.bytes_in = size
+
     # Always create the Upload object no matter what happens next.
     # If all individual file uploads work out, we say this is complete.
     upload_obj = Upload.objects.create(
@@ -272,57 +358,129 @@ def upload_archive(request, upload_workspace):
     )
 
     ignored_keys = []
-    skipped_keys = []
-
-    file_uploads_created = 0
-    uploaded_symbol_keys = []
-    key_to_symbol_keys = {}
     future_to_key = {}
-    for member in file_listing:
-        if _ignore_member_file(member.name):
-            ignored_keys.append(member.name)
-            continue
-        # We need to know and remember, for every file attempted,
-        # what that name corresponds to as a "symbol key".
-        # A symbol key is, for example, ('xul.pdb', 'A7D6F1BBA7D6F1BB1')
-        symbol_key = tuple(member.name.split("/")[:2])
-        key_to_symbol_keys[member.name] = symbol_key
-        future_to_key[
-            executor.submit(
-                upload_file_upload,
-                backend=backend,
-                key_name=member.name,
-                file_path=member.path,
-                upload=upload_obj,
-            )
-        ] = member.name
+    if streaming is None:
+        members = file_listing
+    else:
+        # Members are yielded as soon as they're downloaded and extracted, so uploading
+        # them overlaps with downloading the rest of the archive.
+        members = streaming.download_and_extract()
+    try:
+        for member in members:
+            if _ignore_member_file(member.name):
+                ignored_keys.append(member.name)
+                continue
+            future_to_key[
+                executor.submit(
+                    upload_file_upload,
+                    backend=backend,
+                    key_name=member.name,
+                    file_path=member.path,
+                    upload=upload_obj,
+                    profile=profile.file(member.name),
+                )
+            ] = member.name
+    except (UploadByDownloadRemoteError, zipfile.BadZipfile) as exception:
+        # Let uploads that already started finish before the workspace is removed, and
+        # record them, since their files are in storage now. The upload stays
+        # incomplete.
+        concurrent.futures.wait(future_to_key)
+        file_uploads, skipped_keys = _collect_file_uploads(
+            future_to_key, ignore_errors=True
+        )
+        _save_file_uploads(
+            upload_obj, file_uploads, skipped_keys, ignored_keys, profile
+        )
+        evict_syminfo_cache(file_uploads)
+        status = 500 if isinstance(exception, UploadByDownloadRemoteError) else 400
+        return http.JsonResponse({"error": str(exception)}, status=status)
     # Now lets wait for them all to finish and we'll see which ones
     # were skipped and which ones were created.
+    file_uploads, skipped_keys = _collect_file_uploads(
+        future_to_key, ignore_errors=True
+    )
+    errors = [future.exception() for future in future_to_key if future.exception()]
+    if errors:
+        # Record the files that made it to storage before failing, like when the
+        # download fails. The upload stays incomplete.
+        _save_file_uploads(
+            upload_obj, file_uploads, skipped_keys, ignored_keys, profile
+        )
+        evict_syminfo_cache(file_uploads)
+        raise errors[0]
+    upload_obj.completed_at = timezone.now()
+    _save_file_uploads(upload_obj, file_uploads, skipped_keys, ignored_keys, profile)
+
+    if file_uploads:
+        logger.info(f"Created {len(file_uploads)} FileUpload objects")
+    else:
+        logger.info(f"No file uploads created for {upload_obj!r}")
+    if settings.UPLOAD_PREWARM_DOWNLOAD_CACHES:
+        prewarm_syminfo_cache(file_uploads)
+    else:
+        evict_syminfo_cache(file_uploads)
+
+    METRICS.incr(
+        "upload_uploads", tags=[f"try:{is_try_upload}", f"bucket:{backend.bucket}"]
+    )
+
+    upload_data = _serialize_upload(upload_obj)
+    # Clients can ask for the timings of the upload, for example to debug slow uploads.
+    if request.POST.get("timings"):
+        upload_data["timings"] = upload_obj.timings
+    return http.JsonResponse({"upload": upload_data}, status=201)
+
+
+def _collect_file_uploads(
+    future_to_key: dict[concurrent.futures.Future, str], ignore_errors: bool = False
+) -> tuple[list[FileUpload], list[str]]:
+    """Wait for the file uploads to finish and return the created and skipped ones.
+
+    :arg future_to_key: the futures of upload_file_upload() calls and their keys
+    :arg ignore_errors: leave out the files that failed to upload instead of raising
+        the error
+
+    :returns: the FileUpload instances of the uploaded files and the keys of the
+        skipped files
+    """
+    file_uploads = []
+    skipped_keys = []
     for future in concurrent.futures.as_completed(future_to_key):
+        if ignore_errors and future.exception() is not None:
+            continue
         file_upload: Optional[FileUpload] = future.result()
         if file_upload:
-            file_upload.save()
-            file_uploads_created += 1
-            uploaded_symbol_keys.append(key_to_symbol_keys[file_upload.key])
+            file_uploads.append(file_upload)
         else:
             skipped_keys.append(future_to_key[future])
-            METRICS.incr("upload_file_upload_skip", 1)
+    return file_uploads, skipped_keys
 
-    if file_uploads_created:
-        logger.info(f"Created {file_uploads_created} FileUpload objects")
-    else:
-        logger.info(f"No file uploads created for {upload_obj!r}")
 
+def _save_file_uploads(
+    upload_obj: Upload,
+    file_uploads: list[FileUpload],
+    skipped_keys: list[str],
+    ignored_keys: list[str],
+    profile: UploadProfile,
+):
+    """Save the file uploads and the skipped and ignored keys of an upload."""
     upload_obj.skipped_keys = skipped_keys or None
     upload_obj.ignored_keys = ignored_keys or None
-    upload_obj.completed_at = timezone.now()
-    upload_obj.save(update_fields=["skipped_keys", "ignored_keys", "completed_at"])
-
-    METRICS.incr(
-        "upload_uploads", tags=[f"try:{is_try_upload}", f"bucket:{backend.bucket}"]
-    )
 
-    return http.JsonResponse({"upload": _serialize_upload(upload_obj)}, status=201)
+    # Insert all FileUpload records in batches rather than one INSERT per file, and
+    # update the upload in the same transaction.
+    with METRICS.timer("upload_save_file_uploads"), transaction.atomic():
+        with profile.stage("save"):
+            FileUpload.objects.bulk_create(
+                file_uploads,
+                batch_size=settings.UPLOAD_FILE_UPLOAD_BULK_CREATE_BATCH_SIZE,
+            )
+        upload_obj.timings = profile.as_dict(
+            max_files=settings.UPLOAD_TIMINGS_MAX_FILES
+        )
+        upload_obj.save(
+            update_fields=["skipped_keys", "ignored_keys", "completed_at", "timings"]
+        )
 
 
 def _serialize_upload(upload):
@@ -421,6 +579,7 @@ class UploadResponse(msgspec.Struct):
 @api_require_POST
 @api_login_required
 @api_any_permission_required("upload.upload_symbols", "upload.upload_try_symbols")
+@executor.scheduling_group()
 def upload_v2(request):
     try:
         payload = msgspec.json.decode(request.body, type=UploadRequest)
@@ -444,6 +603,7 @@ def upload_v2(request):
         bucket_name=backend.bucket,
         try_symbols=try_storage,
         skipped_keys=[f.key for f in files if isinstance(f.action, ActionSkip)],
+        initiated_keys=[f.key for f in files if isinstance(f.action, ActionUpload)],
         # The size is a required field for now, but we can drop it from the model once
         # we remove v1 of the upload API.
         size=sum(f.size for f in payload.files),
@@ -477,13 +637,8 @@ def initiate_file_upload(
         return FileSpecResponse(key, ActionError("invalid MD5 hex digest"))
 
     with METRICS.timer("upload_file_exists"):
-        existing_metadata = symbol_storage().get_metadata(key, backend.try_symbols)
-    if (
-        existing_metadata
-        and existing_metadata.original_content_length == file_spec.size
-        and existing_metadata.original_md5_sum == file_spec.md5_hash
-    ):
-        METRICS.incr("upload_file_upload_skip", 1)
+        found = symbol_storage().get_all_metadata(key, backend.try_symbols)
+    if not should_upload(key, found, file_spec.size, file_spec.md5_hash):
         return FileSpecResponse(key, ActionSkip())
 
     metadata = ObjectMetadata(content_type=get_key_content_type(key))
@@ -499,3 +654,354 @@ def initiate_file_upload(
         url = url.replace("http://gcs-emulator", "http://localhost")
     METRICS.incr("upload_file_upload_upload", 1)
     return FileSpecResponse(key, ActionUpload(url, metadata.content_encoding))
+
+
+class UploadSessionResponse(msgspec.Struct):
+    """The JSON schema of the upload v2 session response."""
+
+    id: int
+    created_at: int
+    user: str
+    try_symbols: bool
+    upload_protocol: str
+
+
+def _get_incomplete_upload(request, upload_id: int) -> Upload | http.JsonResponse:
+    """Return the user's upload with the given id, or an error response.
+
+    Files can only be added to uploads that aren't completed yet.
+    """
+    upload_obj = Upload.objects.filter(id=upload_id, user=request.user).first()
+    if upload_obj is None:
+        return http.JsonResponse({"error": "upload not found"}, status=404)
+    if upload_obj.completed_at is not None:
+        return http.JsonResponse({"error": "upload already completed"}, status=409)
+    return upload_obj
+
+
+@METRICS.timer_decorator("upload_v2_session")
+@api_require_POST
+@api_login_required
+@api_any_permission_required("upload.upload_symbols", "upload.upload_try_symbols")
+def upload_v2_session(request):
+    """Start a upload v2 session for sending the files of an upload in several chunks.
+
+    Builds with more than UPLOAD_V2_MAX_FILES_PER_REQUEST files start a session, send
+    their file specs in chunks to upload_v2_files(), and record the uploaded files
+    with one or more upload_v2_complete() requests, all as part of a single upload.
+    """
+    # Determine try storage from the token's permissions like upload_v2() does.
+    try_storage = not request.user.has_perm("upload.upload_symbols")
+    backend = symbol_storage().get_upload_backend(try_storage)
+    upload_obj = Upload.objects.create(
+        user=request.user,
+        bucket_name=backend.bucket,
+        try_symbols=try_storage,
+        initiated_keys=[],
+        size=0,
+    )
+    METRICS.incr(
+        "upload_uploads", tags=[f"try:{try_storage}", f"bucket:{backend.bucket}"]
+    )
+    response = UploadSessionResponse(
+        id=upload_obj.id,
+        created_at=int(upload_obj.created_at.timestamp()),
+        user=upload_obj.user.email,
+        try_symbols=upload_obj.try_symbols,
+        upload_protocol=backend.upload_session_protocol,
+    )
+    return http.HttpResponse(
+        msgspec.json.encode(response), status=201, content_type="application/json"
+    )
+
+
+def _stream_file_specs(
+    upload_obj: Upload,
+    future_to_file_spec: dict[concurrent.futures.Future, FileSpecRequest],
+) -> Iterator[bytes]:
+    """Yield the responses for a chunk of files as NDJSON lines as they're done.
+
+    The size, the skipped keys and the initiated keys of the upload are updated for
+    every batch of files that are done before their responses are sent, so only files
+    that were reported to the client are recorded, even if the response isn't read to
+    the end.
+    """
+    pending = set(future_to_file_spec)
+    while pending:
+        done, pending = concurrent.futures.wait(
+            pending, return_when=concurrent.futures.FIRST_COMPLETED
+        )
+        file_spec_responses = []
+        for future in done:
+            file_spec = future_to_file_spec[future]
+            try:
+                file_spec_responses.append(future.result())
+            except StorageError:
+                # The files before this one were already sent, so report the error for
+                # this file only rather than failing the whole response.
+                logger.exception(f"Error initiating upload of {file_spec.key!r}")
+                file_spec_responses.append(
+                    FileSpecResponse(file_spec.key, ActionError("storage error"))
+                )
+        skipped_keys = [
+            f.key for f in file_spec_responses if isinstance(f.action, ActionSkip)
+        ]
+        initiated_keys = [
+            f.key for f in file_spec_responses if isinstance(f.action, ActionUpload)
+        ]
+        with transaction.atomic():
+            upload_obj = Upload.objects.select_for_update().get(id=upload_obj.id)
+            upload_obj.size += sum(future_to_file_spec[f].size for f in done)
+            if skipped_keys:
+                upload_obj.skipped_keys = (upload_obj.skipped_keys or []) + skipped_keys
+            upload_obj.initiated_keys = (
+                upload_obj.initiated_keys or []
+            ) + initiated_keys
+            upload_obj.save(update_fields=["size", "skipped_keys", "initiated_keys"])
+        for file_spec_response in file_spec_responses:
+            yield msgspec.json.encode(file_spec_response) + b"\n"
+
+
+@METRICS.timer_decorator("upload_v2_files")
+@api_require_POST
+@api_login_required
+@api_any_permission_required("upload.upload_symbols", "upload.upload_try_symbols")
+@executor.scheduling_group()
+def upload_v2_files(request, upload_id):
+    """Start uploading a chunk of the files of a upload v2 session.
+
+    The request payload has the same schema as a upload v2 request. Checking whether a
+    file is in storage and creating its upload session URL run in parallel for all files
+    of the chunk. The response is streamed as newline-delimited JSON with one file spec
+    response per line in the order the files are done, so the client can start uploading
+    the first files while the rest of the chunk is still being processed.
+    """
+    try:
+        payload = msgspec.json.decode(request.body, type=UploadRequest)
+    except (msgspec.DecodeError, msgspec.ValidationError):
+        return http.JsonResponse({"error": "malformed JSON request body"}, status=400)
+    if len(payload.files) > settings.UPLOAD_V2_MAX_FILES_PER_REQUEST:
+        return http.JsonResponse({"error": "too many files"}, status=400)
+
+    upload_obj = _get_incomplete_upload(request, upload_id)
+    if isinstance(upload_obj, http.JsonResponse):
+        return upload_obj
+
+    backend = symbol_storage().get_upload_backend(upload_obj.try_symbols)
+    future_to_file_spec = {
+        executor.submit(initiate_file_upload, file_spec, backend=backend): file_spec
+        for file_spec in payload.files
+    }
+    return http.StreamingHttpResponse(
+        _stream_file_specs(upload_obj, future_to_file_spec),
+        content_type="application/x-ndjson",
+    )
+
+
+class UploadCompleteRequest(msgspec.Struct):
+    """The JSON schema of the upload v2 completion request payload."""
+
+    keys: list[str]
+    # Uploads started with a session can record their files in several requests, and
+    # only the final one completes the upload.
+    final: bool = True
+
+
+class UploadCompleteResponse(msgspec.Struct):
+    """The JSON schema of the upload v2 completion response."""
+
+    id: int
+    completed_at: Optional[int]
+    registered_keys: list[str]
+    missing_keys: list[str]
+    # Keys that an earlier request of the same upload already recorded
+    already_registered_keys: list[str]
+
+
+def _registered_keys(upload_obj: Upload, keys: list[str]) -> set[str]:
+    """Return the keys that already have a FileUpload for the given upload."""
+    return set(
+        FileUpload.objects.filter(upload=upload_obj, key__in=keys).values_list(
+            "key", flat=True
+        )
+    )
+
+
+@METRICS.timer_decorator("upload_v2_complete")
+@api_require_POST
+@api_login_required
+@api_any_permission_required("upload.upload_symbols", "upload.upload_try_symbols")
+@executor.scheduling_group()
+def upload_v2_complete(request, upload_id):
+    """Record the files of a upload v2 request once the client finished uploading them.
+
+    The client sends the keys of all files it uploaded to the upload session URLs. Each
+    key is checked in storage, and a FileUpload including the sym header data is
+    recorded for it, so that lookups by code file and code id work for these files.
+    Only keys the upload handed out upload session URLs for can be recorded, and each
+    key is only recorded once per upload.
+    """
+    try:
+        payload = msgspec.json.decode(request.body, type=UploadCompleteRequest)
+    except (msgspec.DecodeError, msgspec.ValidationError):
+        return http.JsonResponse({"error": "malformed JSON request body"}, status=400)
+    if len(payload.keys) > settings.UPLOAD_V2_MAX_FILES_PER_REQUEST:
+        return http.JsonResponse({"error": "too many files"}, status=400)
+    if not all(validate_key(key) for key in payload.keys):
+        return http.JsonResponse({"error": "invalid key"}, status=400)
+
+    upload_obj = _get_incomplete_upload(request, upload_id)
+    if isinstance(upload_obj, http.JsonResponse):
+        return upload_obj
+    keys = list(dict.fromkeys(payload.keys))
+    # Uploads created before initiated keys were recorded don't have them.
+    if upload_obj.initiated_keys is not None:
+        initiated_keys = set(upload_obj.initiated_keys)
+        if not all(key in initiated_keys for key in keys):
+            return http.JsonResponse(
+                {"error": "key not initiated by this upload"}, status=400
+            )
+
+    # Sessions record their files in several requests, which may repeat keys.
+    registered_keys = _registered_keys(upload_obj, keys)
+    already_registered_keys = [key for key in keys if key in registered_keys]
+    keys = [key for key in keys if key not in registered_keys]
+
+    backend = symbol_storage().get_upload_backend(upload_obj.try_symbols)
+    results = executor.map(
+        functools.partial(register_file_upload, backend=backend, upload=upload_obj),
+        keys,
+    )
+    file_uploads = []
+    missing_keys = []
+    for key, file_upload in zip(keys, results, strict=True):
+        if file_upload:
+            file_uploads.append(file_upload)
+        else:
+            missing_keys.append(key)
+
+    with METRICS.timer("upload_save_file_uploads"), transaction.atomic():
+        # Another request may have completed the upload while the files were checked.
+        upload_obj = Upload.objects.select_for_update().get(id=upload_obj.id)
+        if upload_obj.completed_at is not None:
+            return http.JsonResponse({"error": "upload already completed"}, status=409)
+        # Another request of the session may have recorded some of the files, too.
+        registered_keys = _registered_keys(upload_obj, [f.key for f in file_uploads])
+        if registered_keys:
+            already_registered_keys += [
+                f.key for f in file_uploads if f.key in registered_keys
+            ]
+            file_uploads = [f for f in file_uploads if f.key not in registered_keys]
+        FileUpload.objects.bulk_create(
+            file_uploads, batch_size=settings.UPLOAD_FILE_UPLOAD_BULK_CREATE_BATCH_SIZE
+        )
+        if payload.final:
+            upload_obj.completed_at = timezone.now()
+            upload_obj.save(update_fields=["completed_at"])
+    METRICS.incr("upload_file_upload_registered", len(file_uploads))
+    METRICS.incr("upload_file_upload_missing", len(missing_keys))
+    if settings.UPLOAD_PREWARM_DOWNLOAD_CACHES:
+        prewarm_syminfo_cache(file_uploads)
+    else:
+        evict_syminfo_cache(file_uploads)
+
+    response = UploadCompleteResponse(
+        id=upload_obj.id,
+        completed_at=(
+            int(upload_obj.completed_at.timestamp())
+            if upload_obj.completed_at
+            else None
+        ),
+        registered_keys=[f.key for f in file_uploads],
+        missing_keys=missing_keys,
+        already_registered_keys=already_registered_keys,
+    )
+    return http.HttpResponse(
+        msgspec.json.encode(response), status=200, content_type="application/json"
+    )
+
+
+class ManifestRequest(msgspec.Struct):
+    """The JSON schema of the upload manifest request payload."""
+
+    files: list[FileSpecRequest]
+    try_symbols: Optional[bool] = msgspec.field(name="try", default=None)
+
+
+class ManifestResponse(msgspec.Struct):
+    """The JSON schema of the upload manifest response."""
+
+    try_symbols: bool
+    needed_keys: list[str]
+    skipped_keys: list[str]
+    ignored_keys: list[str]
+
+
+def check_file_needed(file_spec: FileSpecRequest, try_storage: bool) -> bool:
+    """Return whether a file listed in an upload manifest has to be uploaded.
+
+    Manifests don't list compressed sizes, so files that were compressed before their
+    original size and hash were stored are reported as needed, even though the upload
+    may skip them by their compressed size.
+    """
+    with METRICS.timer("upload_file_exists"):
+        found = symbol_storage().get_all_metadata(file_spec.key, try_storage)
+    return should_upload(file_spec.key, found, file_spec.size, file_spec.md5_hash)
+
+
+@METRICS.timer_decorator("upload_manifest")
+@api_require_POST
+@api_login_required
+@api_any_permission_required("upload.upload_symbols", "upload.upload_try_symbols")
+@executor.scheduling_group()
+def upload_manifest(request):
+    """Return which members of a symbols ZIP file have to be uploaded.
+
+    Clients send the manifest of the ZIP file they are about to upload, i.e. the name,
+    size and MD5 hash of each member, and then only upload a ZIP file with the members
+    that are needed. Members are needed unless they would be skipped by the upload
+    because they're already in storage, or ignored.
+    """
+    try:
+        payload = msgspec.json.decode(request.body, type=ManifestRequest)
+    except (msgspec.DecodeError, msgspec.ValidationError):
+        return http.JsonResponse({"error": "malformed JSON request body"}, status=400)
+    if len(payload.files) > settings.UPLOAD_MANIFEST_MAX_FILES:
+        return http.JsonResponse({"error": "too many files"}, status=400)
+
+    ignored_keys = []
+    file_specs = []
+    for file_spec in payload.files:
+        if _ignore_member_file(file_spec.key):
+            ignored_keys.append(file_spec.key)
+        elif not validate_key(file_spec.key):
+            return http.JsonResponse({"error": "invalid key"}, status=400)
+        elif not validate_md5_lowercase_hex(file_spec.md5_hash):
+            return http.JsonResponse({"error": "invalid MD5 hex digest"}, status=400)
+        else:
+            file_specs.append(file_spec)
+
+    # Determine whether this is a try upload the same way upload_archive() does.
+    try_storage = payload.try_symbols
+    if try_storage is None:
+        try_storage = not request.user.has_perm("upload.upload_symbols")
+    needed = executor.map(
+        functools.partial(check_file_needed, try_storage=try_storage), file_specs
+    )
+    needed_keys = []
+    skipped_keys = []
+    for file_spec, is_needed in zip(file_specs, needed, strict=True):
+        if is_needed:
+            needed_keys.append(file_spec.key)
+        else:
+            skipped_keys.append(file_spec.key)
+
+    response = ManifestResponse(
+        try_symbols=try_storage,
+        needed_keys=needed_keys,
+        skipped_keys=skipped_keys,
+        ignored_keys=ignored_keys,
+    )
+    return http.HttpResponse(
+        msgspec.json.encode(response), status=200, content_type="application/json"
+    )
@@ -7,7 +7,7 @@ from urllib.parse import urlparse
 from django.conf import settings
 from django.core.management.base import BaseCommand, CommandError
 
-from tecken.librequests import session_with_retries
+from tecken.librequests import pooled_session
 from tecken.useradmin.middleware import find_users
 
 
@@ -21,7 +21,7 @@ class Command(BaseCommand):
         email = options["email"]
         if " " in email or email.count("@") != 1:
             raise CommandError(f"Invalid email {email!r}")
-        session = session_with_retries()
+        session = pooled_session()
         users = find_users(
             settings.OIDC_RP_CLIENT_ID,
             settings.OIDC_RP_CLIENT_SECRET,
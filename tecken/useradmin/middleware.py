@@ -11,7 +11,7 @@ from django.core.cache import cache
 from django.core.exceptions import MiddlewareNotUsed, PermissionDenied
 from django.contrib import auth
 
-from tecken.librequests import session_with_retries
+from tecken.librequests import pooled_session
 from tecken.libmarkus import METRICS
 
 
@@ -24,7 +24,7 @@ class Auth0ManagementAPIError(Exception):
 
 @METRICS.timer_decorator("useradmin_is_blocked_in_auth0")
 def is_blocked_in_auth0(email):
-    session = session_with_retries(total_retries=5)
+    session = pooled_session(total_retries=5)
     users = find_users(
         settings.OIDC_RP_CLIENT_ID,
         settings.OIDC_RP_CLIENT_SECRET,